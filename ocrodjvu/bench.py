@@ -0,0 +1,434 @@
+# Copyright © 2024 FriedrichFroebel
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+"""
+Microbenchmarks of parsing OCR results and serializing text and images.
+
+Run with:
+
+    python -m ocrodjvu.bench [--output FILE] [--compare FILE]
+
+The results are printed (or saved) as JSON, so that runs can be compared.
+"""
+
+import argparse
+import functools
+import gc
+import io
+import itertools
+import json
+import os
+import platform
+import shlex
+import statistics
+import sys
+import timeit
+
+from ocrodjvu import hocr
+from ocrodjvu import image_io
+from ocrodjvu import text_zones
+from ocrodjvu import unicode_support
+from ocrodjvu import version
+from ocrodjvu.cli import hocr2djvused
+from ocrodjvu.engines import gocr
+from ocrodjvu.engines import ocrad
+
+
+const = text_zones.const
+
+DEFAULT_REPEAT = 5
+
+_HOCR_FIXTURES = os.path.join(os.path.dirname(__file__), os.pardir, 'tests', 'test_hocr2djvused')
+
+_WORDS = 'the quick brown fox jumps over a lazy dog'.split()
+_WORDS_PER_LINE = 10
+_LINES_PER_BLOCK = 40
+_CHAR_WIDTH = 20
+_LINE_HEIGHT = 40
+
+
+def _get_layout(n_words):
+    """
+    Yield (block, line, word, x, y, text) tuples of a synthetic page.
+    """
+    x = y = 0
+    for i in range(n_words):
+        line, word = divmod(i, _WORDS_PER_LINE)
+        if word == 0:
+            x = 100
+            y = 100 + line * _LINE_HEIGHT
+        text = _WORDS[i % len(_WORDS)]
+        yield line // _LINES_PER_BLOCK, line, word, x, y, text
+        x += (len(text) + 1) * _CHAR_WIDTH
+
+
+def _get_page_size(n_words):
+    n_lines = -(-n_words // _WORDS_PER_LINE)
+    return 200 + _WORDS_PER_LINE * 10 * _CHAR_WIDTH, 200 + n_lines * _LINE_HEIGHT
+
+
+def make_hocr(n_words):
+    """
+    Return synthetic hOCR page (in the style of Tesseract) with the given number of words.
+    """
+    width, height = _get_page_size(n_words)
+    lines = [
+        '<html><head>',
+        "<meta name='ocr-system' content='tesseract 3.02' />",
+        "<meta name='ocr-capabilities' content='ocr_page ocr_carea ocr_par ocr_line ocrx_word'/>",
+        '</head><body>',
+        f"<div class='ocr_page' title='bbox 0 0 {width} {height}'>",
+    ]
+    close = []
+    for _, line, word, x, y, text in _get_layout(n_words):
+        if word == 0:
+            lines += close
+            close = ['</span>']
+            if line % _LINES_PER_BLOCK == 0:
+                if line:
+                    lines += ['</p></div>']
+                lines += ["<div class='ocr_carea'><p class='ocr_par'>"]
+            lines += [f"<span class='ocr_line' title='bbox {x} {y} {width - 100} {y + _LINE_HEIGHT - 10}'>"]
+        x1 = x + len(text) * _CHAR_WIDTH
+        lines += [f"<span class='ocrx_word' title='bbox {x} {y} {x1} {y + _LINE_HEIGHT - 10}'>{text}</span> "]
+    lines += close
+    lines += ['</p></div></div></body></html>']
+    return str.join('\n', lines).encode('UTF-8')
+
+
+def make_ocrad(n_words):
+    """
+    Return synthetic ORF (Ocrad result file) with the given number of words.
+    """
+    lines = {}
+    for _, line, word, x, y, text in _get_layout(n_words):
+        chars = lines.setdefault(line, [])
+        if word > 0:
+            chars += [(x - _CHAR_WIDTH, y, ' ')]
+        chars += [(x + i * _CHAR_WIDTH, y, ch) for i, ch in enumerate(text)]
+    width, height = _get_page_size(n_words)
+    # The scanner expects a single text block.
+    result = [
+        'total text blocks 1',
+        f'text block 1 100 100 {width - 200} {height - 200}',
+        f'lines {len(lines)}',
+    ]
+    for i, chars in enumerate(lines.values()):
+        result += [f'line {i + 1} chars {len(chars)} height {_LINE_HEIGHT - 10}']
+        result += [
+            f"{x} {y} {_CHAR_WIDTH} {_LINE_HEIGHT - 10}; 1, '{ch}'1"
+            for x, y, ch in chars
+        ]
+    return str.join('', (line + '\n' for line in result))
+
+
+def make_gocr(n_words):
+    """
+    Return synthetic GOCR XML output with the given number of words.
+    """
+    width, height = _get_page_size(n_words)
+    result = [f'<page x="0" y="0" dx="{width}" dy="{height}">']
+    close = []
+    for _, line, word, x, y, text in _get_layout(n_words):
+        if word == 0:
+            result += close
+            close = ['</line>']
+            if line % _LINES_PER_BLOCK == 0:
+                if line:
+                    result += ['</block>']
+                result += ['<block>']
+            result += ['<line>']
+        else:
+            result += [f'<space x="{x - _CHAR_WIDTH}" y="{y}" dx="{_CHAR_WIDTH}" dy="{_LINE_HEIGHT - 10}" />']
+        result += [
+            f'<box x="{x + i * _CHAR_WIDTH}" y="{y}" dx="{_CHAR_WIDTH}" dy="{_LINE_HEIGHT - 10}" value="{ch}" />'
+            for i, ch in enumerate(text)
+        ]
+    result += close
+    result += ['</block>', '</page>']
+    return str.join('\n', result).encode('UTF-8')
+
+
+def make_page_zone(n_words):
+    """
+    Return synthetic page zone with the given number of words.
+    """
+    settings = gocr.ExtractSettings(page_size=_get_page_size(n_words))
+    return gocr.scan(_iterparse(make_gocr(n_words)), settings)
+
+
+def _copy_zone(zone):
+    if not isinstance(zone, text_zones.Zone):
+        return zone
+    return text_zones.Zone(zone.type, zone.bbox, [_copy_zone(child) for child in zone])
+
+
+def _iterparse(data):
+    return gocr.etree.iterparse(io.BytesIO(data))
+
+
+class _PageJob:
+    """
+    Stand-in for djvu.decode.PageJob, with pre-rendered (blank) pixel data.
+    """
+
+    dpi = 300
+
+    def __init__(self, size):
+        self.size = size
+        self._data = {}
+
+    def render(self, mode, page_rect, render_rect, pixel_format, row_alignment=1):
+        width, height = render_rect[2:]
+        row_size = -(-width * pixel_format.bpp // 8)
+        row_size = -(-row_size // row_alignment) * row_alignment
+        key = row_size, height
+        if key not in self._data:
+            self._data[key] = bytes(row_size * height)
+        return self._data[key]
+
+
+class WithSetup:
+    """
+    Function to be timed with a fresh argument for every call,
+    prepared by setup() outside the measurement.
+    """
+
+    def __init__(self, setup, function):
+        self.setup = setup
+        self.function = function
+
+
+class Benchmark:
+
+    def __init__(self, name, function):
+        self.name = name
+        self.function = function
+
+    def _time(self, loops):
+        function = self.function
+        if not isinstance(function, WithSetup):
+            return timeit.Timer(function).timeit(number=loops)
+        args = [function.setup() for _ in range(loops)]
+        # Like timeit, measure without the garbage collector.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            started = timeit.default_timer()
+            for arg in args:
+                function.function(arg)
+            return timeit.default_timer() - started
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def run(self, repeat):
+        # The same numbers of loops as tried by timeit.Timer.autorange():
+        loop_counts = (10 ** i * j for i in itertools.count() for j in (1, 2, 5))
+        loops = next(n for n in loop_counts if self._time(n) >= 0.2)
+        times = [self._time(loops) / loops for _ in range(repeat)]
+        return dict(
+            name=self.name,
+            loops=loops,
+            times=times,
+            best=min(times),
+            median=statistics.median(times),
+            mean=statistics.mean(times),
+        )
+
+
+def _get_hocr_fixtures():
+    """
+    Yield (name, data, extract_text() arguments) for every hOCR file from the test suite.
+    """
+    directory = os.path.normpath(_HOCR_FIXTURES)
+    if not os.path.isdir(directory):
+        # The test suite is not installed.
+        return
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.html'):
+            continue
+        base = os.path.join(directory, filename[:-5])
+        try:
+            with open(f'{base}.test1', 'r') as file:
+                args = shlex.split(file.readline())[1:]
+        except FileNotFoundError:
+            args = []
+        if base.endswith(('cuneiform0.7', 'cuneiform0.8')) and not any(arg.startswith('--page-size') for arg in args):
+            args += ['--page-size=1000x1000']
+        options = hocr2djvused.ArgumentParser().parse_args(args + ['--details=words'])
+        kwargs = dict(details=options.details, uax29=options.uax29, page_size=options.page_size)
+        with open(f'{base}.html', 'rb') as file:
+            data = file.read()
+        yield filename[:-5], data, kwargs
+
+
+def get_benchmarks():
+    """
+    Yield (name, factory) pairs, where factory() prepares the input and
+    returns the function to be timed.
+    """
+    def extract_hocr(data, **kwargs):
+        hocr.extract_text(io.BytesIO(data), **kwargs)
+
+    for name, data, kwargs in _get_hocr_fixtures():
+        yield f'hocr.extract_text:{name}', functools.partial(functools.partial, extract_hocr, data, **kwargs)
+
+    for n_words, label in (10000, '10k'), (100000, '100k'):
+        yield f'hocr.extract_text:synthetic-{label}', lambda n_words=n_words: functools.partial(extract_hocr, make_hocr(n_words))
+
+    def scan_ocrad(data, settings):
+        ocrad.scan(io.StringIO(data), settings)
+
+    def ocrad_benchmark():
+        settings = ocrad.ExtractSettings(page_size=_get_page_size(10000))
+        settings.replacement_character = '\N{REPLACEMENT CHARACTER}'
+        return functools.partial(scan_ocrad, make_ocrad(10000), settings)
+
+    yield 'ocrad.scan:synthetic-10k', ocrad_benchmark
+
+    def gocr_benchmark():
+        settings = gocr.ExtractSettings(page_size=_get_page_size(10000))
+        data = make_gocr(10000)
+        return lambda: gocr.scan(_iterparse(data), settings)
+
+    yield 'gocr.scan:synthetic-10k', gocr_benchmark
+
+    def group_words_benchmark(details):
+        chars = [
+            text_zones.Zone(const.TEXT_ZONE_CHARACTER, text_zones.BBox(x + i * _CHAR_WIDTH, y, x + (i + 1) * _CHAR_WIDTH, y + 30), [ch])
+            for _, _, _, x, y, text in _get_layout(_WORDS_PER_LINE)
+            for i, ch in enumerate(text + ' ')
+        ]
+        word_break_iterator = functools.partial(unicode_support.word_break_iterator, locale=None)
+        return lambda: text_zones.group_words(chars, details, word_break_iterator)
+
+    yield 'text_zones.group_words:words', lambda: group_words_benchmark(text_zones.TEXT_DETAILS_WORD)
+    yield 'text_zones.group_words:chars', lambda: group_words_benchmark(text_zones.TEXT_DETAILS_CHARACTER)
+
+    def rotate_benchmark():
+        # Zone.rotate() modifies the zone in place, so every call gets a copy of the same page.
+        zone = make_page_zone(10000)
+        return WithSetup(functools.partial(_copy_zone, zone), lambda zone_: zone_.rotate(90))
+
+    yield 'Zone.rotate:synthetic-10k', rotate_benchmark
+
+    def sexpr_benchmark():
+        zone = make_page_zone(10000)
+        return lambda: zone.sexpr
+
+    yield 'Zone.sexpr:synthetic-10k', sexpr_benchmark
+
+    def print_sexpr_benchmark():
+        expr = make_page_zone(10000).sexpr
+        return lambda: text_zones.print_sexpr(expr, io.StringIO())
+
+    yield 'text_zones.print_sexpr:synthetic-10k', print_sexpr_benchmark
+
+    def write_image_benchmark(image_format, bpp):
+        # A4 at 300 DPI:
+        page_job = _PageJob((2480, 3508))
+        image_format = image_format(bpp)
+        page_job.render(None, None, (0, 0) + page_job.size, image_format._pixel_format, image_format._row_alignment)
+        return lambda: image_format.write_image(page_job, None, io.BytesIO())
+
+    for image_format in image_io.PNM, image_io.BMP, image_io.TIFF:
+        for bpp in 1, 24:
+            yield f'image_io.{image_format.__name__}.write_image:{bpp}bpp', functools.partial(write_image_benchmark, image_format, bpp)
+
+
+def _get_benchmarks(filters):
+    for name, factory in get_benchmarks():
+        if filters and not any(filter_ in name for filter_ in filters):
+            continue
+        yield Benchmark(name, factory())
+
+
+def compare(results, baseline, file):
+    """
+    Print how the best times changed since the baseline.
+    """
+    baseline = {item['name']: item for item in baseline['benchmarks']}
+    for item in results['benchmarks']:
+        old = baseline.get(item['name'])
+        if old is None:
+            continue
+        ratio = item['best'] / old['best']
+        print(f'{item["name"]}: {old["best"]:.6f}s -> {item["best"]:.6f}s ({ratio - 1:+.1%})', file=file)
+
+
+class ArgumentParser(argparse.ArgumentParser):
+
+    def __init__(self):
+        argparse.ArgumentParser.__init__(self, prog='python -m ocrodjvu.bench', description=__doc__.strip().splitlines()[0])
+        self.add_argument(
+            '-k', '--filter', metavar='SUBSTRING', dest='filters', action='append', default=[],
+            help='run only benchmarks whose name contains the string (can be given multiple times)'
+        )
+        self.add_argument('--list', dest='list', action='store_true', help='print names of the benchmarks and exit')
+        self.add_argument(
+            '--repeat', metavar='N', dest='repeat', type=int, default=DEFAULT_REPEAT,
+            help=f'number of measurements of every benchmark (default: {DEFAULT_REPEAT})'
+        )
+        self.add_argument('-o', '--output', metavar='FILE', dest='output', help='save results to this file (default: standard output)')
+        self.add_argument(
+            '--compare', metavar='FILE', dest='baseline', type=argparse.FileType('r'),
+            help='print changes relative to results saved in this file'
+        )
+
+    def parse_args(self, args=None, namespace=None):
+        options = argparse.ArgumentParser.parse_args(self, args, namespace)
+        if options.repeat < 1:
+            self.error('--repeat must be positive')
+        return options
+
+
+def main(argv=None):
+    argv = argv if argv is not None else sys.argv
+    options = ArgumentParser().parse_args(argv[1:])
+    if options.list:
+        for name, _ in get_benchmarks():
+            print(name)
+        return
+    results = dict(
+        ocrodjvu=version.__version__,
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        machine=platform.machine(),
+        repeat=options.repeat,
+        benchmarks=[],
+    )
+    for benchmark in _get_benchmarks(options.filters):
+        result = benchmark.run(options.repeat)
+        print(f'{result["name"]}: {result["best"]:.6f}s', file=sys.stderr)
+        results['benchmarks'] += [result]
+    if options.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(options.output, 'w', encoding='UTF-8') as file:
+            json.dump(results, file, indent=2)
+            file.write('\n')
+    if options.baseline is not None:
+        with options.baseline:
+            baseline = json.load(options.baseline)
+        compare(results, baseline, sys.stderr)
+
+
+__all__ = [
+    'main',
+]
+
+
+if __name__ == '__main__':
+    main()
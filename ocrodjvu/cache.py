@@ -0,0 +1,159 @@
+# Copyright © 2024 FriedrichFroebel
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+"""
+Content-addressed on-disk cache of raw OCR results.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # no coverage
+    fcntl = None
+
+
+def get_key(image_path, options_key):
+    """
+    Return cache key for the image file and the digest of OCR options.
+    """
+    digest = hashlib.sha256()
+    digest.update(options_key.encode('UTF-8'))
+    digest.update(b'\0')
+    with open(image_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Cache:
+    """
+    Directory of OCR results, limited to `max_size` bytes.
+
+    Entries are written atomically, so the cache can be shared by concurrent
+    processes. The modification time of an entry is updated on every hit;
+    when the cache is too large, the least recently used entries are removed.
+    """
+
+    _lock_name = 'lock'
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Don't scan the whole directory after every new entry;
+        # only after this process has added a sizable fraction of the limit.
+        self._eviction_threshold = max(1, max_size // 16)
+        self._n_added = self._eviction_threshold
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """
+        Return (format, contents) pair of the cached engine output, or None.
+        """
+        path = self._get_path(key)
+        try:
+            with open(path, 'rb') as file:
+                header = json.loads(file.readline().decode('UTF-8'))
+                contents = file.read()
+        except FileNotFoundError:
+            return
+        except ValueError:
+            # Broken entry; let it be replaced.
+            return
+        try:
+            os.utime(path)
+        except OSError:  # no coverage
+            pass
+        if not header.get('binary'):
+            contents = contents.decode('UTF-8')
+        return header['format'], contents
+
+    def put(self, key, format_, contents):
+        """
+        Store engine output (either str or bytes).
+        """
+        binary = isinstance(contents, bytes)
+        if not binary:
+            contents = contents.encode('UTF-8')
+        header = json.dumps(dict(format=format_, binary=binary)).encode('UTF-8')
+        path = self._get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp.', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(header + b'\n' + contents)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            raise
+        with self._lock:
+            self._n_added += len(header) + len(contents)
+            if self._n_added < self._eviction_threshold:
+                return
+            self._n_added = 0
+        self.evict()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        if fcntl is None:  # no coverage
+            yield
+            return
+        with open(os.path.join(self.directory, self._lock_name), 'wb') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _scan(self):
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir(follow_symlinks=False):
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime_ns, stat.st_size, entry.path
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in the limit.
+        """
+        with self._locked():
+            entries = sorted(self._scan())
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total_size <= self.max_size:
+                    break
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(path)
+                total_size -= size
+
+
+__all__ = [
+    'Cache',
+    'get_key',
+]
@@ -13,29 +13,45 @@
 # for more details.
 
 import argparse
+import asyncio
+import collections
+import concurrent.futures
 import contextlib
+import contextvars
 import inspect
+import itertools
 import locale
+import multiprocessing
 import os
+import queue
 import shutil
 import string
 import sys
 import threading
+import time
 import traceback
 from typing import Union
 
+from ocrodjvu import cache
 from ocrodjvu import cli
+from ocrodjvu import distributed
 from ocrodjvu import engines
 from ocrodjvu import errors
+from ocrodjvu import image_io
 from ocrodjvu import ipc
+from ocrodjvu import journal
 from ocrodjvu import logger
+from ocrodjvu import metrics
+from ocrodjvu import stats
 from ocrodjvu import temporary
 from ocrodjvu import text_zones
 from ocrodjvu import utils
 from ocrodjvu import version
+from ocrodjvu.engines import common as engines_common
 
 # Import this after local modules, so that they can take care of a showing a nice ImportError message.
 import djvu.decode
+import djvu.sexpr
 
 
 __version__ = version.__version__
@@ -48,6 +64,7 @@ LOGGER = logger.setup()
 class Saver:
 
     in_place = False
+    _save_path = None
 
     def __init__(self):
         pass
@@ -60,6 +77,14 @@ class Saver:
     def check(self):
         pass
 
+    def for_document(self, djvu_path):
+        """
+        Return saver for the particular document in the batch mode.
+        """
+        if self._save_path is None:
+            return self
+        return type(self)(expand_document_template(self._save_path, djvu_path))
+
     @utils.not_overridden
     def save(self, document, pages, djvu_path, sed_file):
         raise NotImplementedError('Cannot save results in this format')  # no coverage
@@ -151,11 +176,14 @@ class DryRunSaver(Saver):
         pass
 
 
-def expand_template(template, pageno, pageid):
+def expand_template(template, pageno, pageid, djvu_path=''):
+    djvu_name = os.path.basename(djvu_path)
     d = {
         'page': pageno,
         'id': pageid,
         'id-ext': os.path.splitext(pageid)[0],
+        'name': djvu_name,
+        'name-ext': os.path.splitext(djvu_name)[0],
     }
     formatter = string.Formatter()
     for _, var, _, _ in formatter.parse(template):
@@ -183,6 +211,29 @@ def expand_template(template, pageno, pageid):
     return formatter.vformat(template, (), d)
 
 
+def expand_document_template(template, djvu_path):
+    djvu_name = os.path.basename(djvu_path)
+    d = {
+        'name': djvu_name,
+        'name-ext': os.path.splitext(djvu_name)[0],
+    }
+    formatter = string.Formatter()
+    return formatter.vformat(template, (), d)
+
+
+def read_manifest(path):
+    """
+    Read paths of DjVu files from a manifest file, one per line.
+    Empty lines and lines starting with # are ignored.
+    """
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.rstrip('\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            yield line
+
+
 class EngineChoices:
 
     default = 'tesseract'
@@ -219,7 +270,7 @@ class HelpFormatter(argparse.HelpFormatter):
         actions += [argparse.Action(['options'], 'options', nargs=0, required=False)]
         actions += [
             act for act in orig_actions
-            if (act.required or isinstance(act, ArgumentParser.SetOutput))
+            if (act.required or not act.option_strings or isinstance(act, (ArgumentParser.SetOutput, ArgumentParser.Listen)))
         ]
         return argparse.HelpFormatter.add_usage(self, usage, actions, groups, prefix)
 
@@ -259,8 +310,32 @@ class ArgumentParser(cli.ArgumentParser):
                     help=saver_type.__doc__
                 )
             )
+        saver_group.add_argument(
+            '--listen', dest='listen', metavar='ADDRESS', action=self.Listen,
+            help='run as a worker accepting pages to OCR on ADDRESS (HOST:PORT or path of a Unix socket)'
+        )
         group.add_argument('--ocr-only', dest='ocr_only', action='store_true', default=False, help="don't save pages without OCR")
         group.add_argument('--clear-text', dest='clear_text', action='store_true', default=False, help='remove existing hidden text')
+        group.add_argument(
+            '--skip-non-text', dest='skip_non_text', action='store_true', default=False,
+            help="don't OCR pages that look blank or like full-page pictures"
+        )
+        group.add_argument(
+            '--blank-threshold', dest='blank_threshold', metavar='DENSITY', type=float, default=0.002,
+            help='ink density below which pages are blank (default: 0.002)'
+        )
+        group.add_argument(
+            '--skip-duplicates', dest='skip_duplicates', action='store_true', default=False,
+            help="don't OCR pages that look like pages already recognized; reuse their text"
+        )
+        group.add_argument(
+            '--duplicate-threshold', dest='duplicate_threshold', metavar='DISTANCE', type=float, default=0.01,
+            help='maximum fraction of perceptual hash bits that may differ between duplicates (default: 0.01)'
+        )
+        group.add_argument(
+            '--skip-existing-text', dest='skip_existing_text', action='store_true', default=False,
+            help="don't OCR pages that already have hidden text; keep their text"
+        )
         group.add_argument('--save-raw-ocr', dest='save_raw_ocr_dir', metavar='DIRECTORY', help='save raw OCR output')
         group.add_argument('--raw-ocr-filename-template', metavar='TEMPLATE', default='{id-ext}', help='file naming scheme for raw OCR')
         self.add_argument(
@@ -275,6 +350,21 @@ class ArgumentParser(cli.ArgumentParser):
             help='image layers to render'
         )
 
+        def dpi(s):
+            n = int(s)
+            if n <= 0:
+                raise ValueError
+            return n
+
+        self.add_argument(
+            '--dpi', dest='dpi', metavar='DPI', type=dpi, default=None,
+            help="render pages at this resolution (default: the page's own resolution)"
+        )
+        self.add_argument(
+            '--max-dpi', dest='max_dpi', metavar='DPI', type=dpi, default=None,
+            help='render pages of higher resolution at this resolution'
+        )
+
         def pages(x):
             return utils.parse_page_numbers(x)
 
@@ -289,7 +379,46 @@ class ArgumentParser(cli.ArgumentParser):
             return n
 
         self.add_argument('-j', '--jobs', dest='n_jobs', metavar='N', type=jobs, default=1, help='start N OCR threads')
-        self.add_argument('path', metavar='FILE', help='DjVu file to process')
+        self.add_argument(
+            '--executor', dest='executor', choices=('thread', 'process', 'asyncio', 'remote'), default='thread',
+            help='run OCR jobs in threads, in separate processes, in an asyncio event loop, or on remote workers (default: thread)'
+        )
+        self.add_argument(
+            '--worker', dest='workers', metavar='ADDRESS', action='append', default=[],
+            help='send OCR jobs to the worker listening on ADDRESS; requires --executor=remote'
+        )
+        self.add_argument(
+            '--remote-input', dest='remote_input', choices=('image', 'path'), default='image',
+            help='send rendered page images, or paths of documents on shared storage, to the workers (default: image)'
+        )
+        self.add_argument(
+            '--worker-timeout', dest='worker_timeout', metavar='SECONDS', type=float, default=None,
+            help='consider a worker lost if it does not reply within this time, and send its page to another one'
+        )
+
+        def count(s):
+            n = int(s)
+            if n < 0:
+                raise ValueError
+            return n
+
+        self.add_argument(
+            '--render-jobs', dest='n_render_jobs', metavar='N', type=count, default=0,
+            help='decode and render pages in N separate threads, ahead of OCR (default: 0, i.e. in the OCR threads)'
+        )
+        self.add_argument(
+            '--parse-jobs', dest='n_parse_jobs', metavar='N', type=jobs, default=1,
+            help='parse OCR results in N separate threads (default: 1); requires --render-jobs'
+        )
+        self.add_argument(
+            '--prefetch', dest='prefetch', metavar='N', type=jobs, default=None,
+            help='keep at most N rendered pages waiting for OCR (default: number of OCR threads); requires --render-jobs'
+        )
+        self.add_argument('paths', metavar='FILE', nargs='*', help='DjVu file(s) to process')
+        self.add_argument(
+            '--manifest', dest='manifest', metavar='FILE', action='append', default=[],
+            help='read paths of DjVu files to process from FILE'
+        )
         group = self.add_argument_group(title='text segmentation options')
         group.add_argument(
             '-t', '--details', dest='details', choices=('lines', 'words', 'chars'), action='store', default='words',
@@ -306,6 +435,60 @@ class ArgumentParser(cli.ArgumentParser):
         )
         group.add_argument('--on-error', choices=('abort', 'resume'), default='abort', help='error handling strategy')
         group.add_argument('--html5', dest='html5', action='store_true', help='use HTML5 parser')
+        group.add_argument(
+            '--tile-threshold', dest='tile_threshold', metavar='MEGAPIXELS', type=float, default=None,
+            help='split pages larger than this into tiles, recognized in parallel'
+        )
+        group.add_argument(
+            '--tile-overlap', dest='tile_overlap', metavar='PIXELS', type=count, default=300,
+            help='overlap of neighbouring tiles (default: 300)'
+        )
+        group.add_argument(
+            '--images-in-memory', dest='images_in_memory', action='store_true', default=False,
+            help='keep page images for the OCR engine in memory rather than in temporary files'
+        )
+        group.add_argument(
+            '--page-timeout', dest='page_timeout', metavar='SECONDS', type=float, default=None,
+            help='kill the OCR engine if it takes longer than this to recognize a page'
+        )
+        group.add_argument(
+            '--timeout-retries', dest='timeout_retries', metavar='N', type=count, default=1,
+            help='recognize a timed out page again up to N times, each time at half the resolution (default: 1)'
+        )
+        group.add_argument(
+            '--max-memory', dest='max_memory', metavar='SIZE', type=self._parse_size, default=None,
+            help='maximum total size of page images being rendered or recognized at the same time'
+        )
+        group.add_argument(
+            '--page-order', dest='page_order', choices=('document', 'largest-first'), default='document',
+            help='order in which pages are handed out to OCR threads (default: document)'
+        )
+        group.add_argument(
+            '--script-order', dest='script_order', choices=('page', 'completion'), default='page',
+            help='order of pages in the djvused script (default: page)'
+        )
+        group.add_argument('--journal', dest='journal', metavar='FILE', help='record finished pages in FILE')
+        group.add_argument(
+            '--resume', dest='resume', action='store_true', default=False,
+            help='reuse pages recorded in the journal instead of OCRing them again'
+        )
+        group.add_argument('--stats', dest='stats', metavar='FILE', help='write timing of every processing stage to FILE (in JSON)')
+        group.add_argument(
+            '--metrics-file', dest='metrics_file', metavar='FILE',
+            help=f'write progress metrics for the Prometheus textfile collector to FILE every {metrics.DEFAULT_INTERVAL} seconds'
+        )
+        group.add_argument('--cache', dest='cache', metavar='DIRECTORY', help='cache raw OCR results in DIRECTORY')
+        group.add_argument(
+            '--cache-size', dest='cache_size', metavar='SIZE', type=self._parse_size, default='1G',
+            help='maximum size of the cache (default: 1G)'
+        )
+
+    @staticmethod
+    def _parse_size(value):
+        try:
+            return utils.parse_size(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'invalid size: {value!r}')
 
     class ListEngines(argparse.Action):
         def __call__(self, parser, namespace, values, option_string=None):
@@ -341,15 +524,54 @@ class ArgumentParser(cli.ArgumentParser):
         def __call__(self, parser, namespace, values, option_string=None):
             namespace.saver = self.saver_type(*values)
 
+    class Listen(argparse.Action):
+        def __call__(self, parser, namespace, values, option_string=None):
+            namespace.listen = values
+            namespace.saver = None
+
     def parse_args(self, args=None, namespace=None):
         options = cli.ArgumentParser.parse_args(self, args, namespace)
         options.details = self._details_map[options.details]
         options.render_layers = self._render_map[options.render_layers]
         options.resume_on_error = options.on_error == 'resume'
-        try:
-            options.saver.check()
-        except OSError as exc:
-            errors.fatal(f'cannot find {exc.filename!r}: {exc.strerror}')
+        for manifest in options.manifest:
+            try:
+                options.paths += read_manifest(manifest)
+            except EnvironmentError as ex:
+                errors.fatal(f'cannot read {ex.filename!r}: {ex.strerror}')
+        if options.listen is not None:
+            if options.paths:
+                self.error('argument --listen: not allowed with FILE')
+        elif not options.paths:
+            self.error('the following arguments are required: FILE')
+        if options.resume and options.journal is None:
+            self.error('argument --resume: requires --journal')
+        if options.n_render_jobs and options.executor != 'thread':
+            self.error(f'argument --render-jobs: not allowed with --executor={options.executor}')
+        if options.executor == 'remote' and not options.workers:
+            self.error('argument --executor=remote: requires --worker')
+        if options.workers and options.executor != 'remote':
+            self.error('argument --worker: requires --executor=remote')
+        if options.worker_timeout is not None:
+            if options.executor != 'remote':
+                self.error('argument --worker-timeout: requires --executor=remote')
+            if options.worker_timeout <= 0:
+                self.error('argument --worker-timeout: must be positive')
+        if options.saver is not None:
+            try:
+                options.saver.check()
+            except OSError as exc:
+                errors.fatal(f'cannot find {exc.filename!r}: {exc.strerror}')
+        if len(options.paths) > 1:
+            try:
+                savers = [options.saver.for_document(path) for path in options.paths]
+            except ValueError as ex:
+                self.error(f'cannot parse output filename template: {ex}')
+            except KeyError as ex:
+                self.error(f'cannot parse output filename template: unknown field {ex.args[0]!r}')
+            save_paths = [saver._save_path for saver in savers]
+            if None not in save_paths and len(set(save_paths)) < len(save_paths):
+                self.error('multiple input files require an output filename template, such as {name-ext}.ocr.djvu')
         if options.save_raw_ocr_dir is not None:
             try:
                 os.stat(os.path.join(options.save_raw_ocr_dir, ''))
@@ -382,6 +604,8 @@ class ArgumentParser(cli.ArgumentParser):
             options.engine = options.engine(**kwargs)
         except AttributeError as ex:
             errors.fatal(ex)
+        except ValueError as ex:
+            self.error(f'argument -X: {ex}')
         except errors.EngineNotFoundError as ex:
             msg = str(ex)
             if implicit_default_engine:
@@ -399,6 +623,17 @@ class ArgumentParser(cli.ArgumentParser):
         options.uax29 = options.language if options.word_segmentation == 'uax29' else None
         if options.n_jobs is None:
             options.n_jobs = utils.get_cpu_count()
+        if options.prefetch is None:
+            options.prefetch = options.n_jobs
+        if options.tile_threshold is not None and options.tile_threshold <= 0:
+            self.error('argument --tile-threshold: must be positive')
+        if options.images_in_memory:
+            if options.debug:
+                self.error('argument --images-in-memory: not allowed with --debug')
+            if not hasattr(os, 'memfd_create'):
+                self.error('argument --images-in-memory: not supported on this system')
+        if options.page_timeout is not None and options.page_timeout <= 0:
+            self.error('argument --page-timeout: must be positive')
         return options
 
 
@@ -409,18 +644,332 @@ class Results(dict):
         return
 
 
+# Pages with at least this ink density, but only a few bands of rows with ink,
+# are full-page pictures rather than text:
+_PICTURE_MIN_DENSITY = 0.25
+_PICTURE_MAX_BANDS = 3
+
+
+def classify_image(density, n_bands, blank_threshold):
+    """
+    Return 'blank' or 'picture' for images not worth OCRing, None otherwise.
+    """
+    if density < blank_threshold:
+        return 'blank'
+    if density >= _PICTURE_MIN_DENSITY and n_bands <= _PICTURE_MAX_BANDS:
+        return 'picture'
+
+
+class _NonText:
+    """
+    OCR result of a page classified as blank or non-text.
+    """
+
+
+_NON_TEXT = _NonText()
+
+
+class _Duplicate:
+    """
+    OCR result of a page that looks like an already recognized page.
+    """
+
+    def __init__(self, text):
+        self.text = text
+
+
+class _TiledImage:
+    """
+    Rendered tiles of a page, to be recognized separately.
+    """
+
+    def __init__(self):
+        # (rect, core, image file) triples:
+        self.tiles = []
+
+    def tell(self):
+        return sum(file.tell() for _, _, file in self.tiles)
+
+    def close(self):
+        for _, _, file in self.tiles:
+            file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class _Tiles:
+    """
+    OCR results of the tiles of a page.
+    """
+
+    def __init__(self, tiles):
+        # (rect, core, OCR result) triples:
+        self.tiles = tiles
+
+
+def _has_text(zone):
+    """
+    Check if the text zone contains any non-whitespace text.
+    """
+    # (type x0 y0 x1 y1 child...), where the children are either zones or a string.
+    for child in zone[5:]:
+        if isinstance(child, str):
+            if child.strip():
+                return True
+        elif _has_text(child):
+            return True
+    return False
+
+
+class Job:
+    """
+    Pages of a single document to be OCRed, and their results.
+    """
+
+    def __init__(self, path, document, pages, saver, prefix='', in_page_order=True):
+        self.path = path
+        self.document = document
+        self.pages = pages
+        self.saver = saver
+        # Prefix for names of intermediate files, to keep documents apart in the batch mode.
+        self.prefix = prefix
+        self.in_page_order = in_page_order
+        self.results = Results()
+        self.sed_file = None
+        self.journal_key = None
+        # Pages to be processed that no thread has taken yet:
+        self.n_queued = 0
+        self._n_done = 0
+        self._completed = collections.deque()
+
+    @property
+    def done(self):
+        return self._n_done == len(self.pages)
+
+    def set_result(self, page, result):
+        self.results[page.n] = result
+        if not self.in_page_order:
+            self._completed.append(page)
+
+    def pop_results(self):
+        """
+        Return (page, result) pairs that can be written to the djvused script,
+        either in page order or in the order of completion.
+        The caller must hold the lock protecting the results.
+        """
+        if not self.in_page_order:
+            return self._pop_completed_results()
+        ready = []
+        while not self.done:
+            page = self.pages[self._n_done]
+            result = self.results[page.n]
+            if result is None or result is True:
+                # Result is not yet available.
+                break
+            self.results[page.n] = Ellipsis  # no longer needed
+            self._n_done += 1
+            ready += [(page, result)]
+            if isinstance(result, Exception):
+                break
+        return ready
+
+    def _pop_completed_results(self):
+        # Every chunk of the djvused script selects its page explicitly,
+        # so the chunks can be written in any order.
+        ready = []
+        while self._completed:
+            page = self._completed.popleft()
+            result = self.results[page.n]
+            self.results[page.n] = Ellipsis  # no longer needed
+            self._n_done += 1
+            ready += [(page, result)]
+            if isinstance(result, Exception):
+                break
+        return ready
+
+
+class Pipeline:
+    """
+    Bounded queues connecting the render, OCR and parse stages.
+
+    Every stage runs in its own threads. The bounds of the queues limit the
+    number of rendered images (and of raw OCR results) waiting for the next
+    stage.
+    """
+
+    def __init__(self, n_render_jobs, n_ocr_jobs, n_parse_jobs, prefetch):
+        self.rendered = queue.Queue(prefetch)
+        self.recognized = queue.Queue(prefetch)
+        self.stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._n_running = {
+            self.rendered: n_render_jobs,
+            self.recognized: n_ocr_jobs,
+        }
+        self._n_consumers = {
+            self.rendered: n_ocr_jobs,
+            self.recognized: n_parse_jobs,
+        }
+
+    def producer_done(self, output_queue):
+        """
+        Called by every thread of a stage when it's done. When the last one
+        is done, tell the threads of the next stage to finish.
+        """
+        with self._lock:
+            self._n_running[output_queue] -= 1
+            last = self._n_running[output_queue] == 0
+        if last:
+            for _ in range(self._n_consumers[output_queue]):
+                output_queue.put(None)
+
+    @staticmethod
+    def consume(input_queue):
+        while True:
+            item = input_queue.get()
+            if item is None:
+                return
+            yield item
+
+
+class Tasks:
+    """
+    (job, page) pairs to be processed, in the order they should be started.
+
+    Pairs are added as the documents are opened, while the threads are
+    already running. Every thread goes through all the pairs, skipping those
+    already taken by other threads, and waits for more until the list is
+    closed.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._tasks = []
+        self._positions = {}
+        self._closed = False
+
+    def add(self, job, pages):
+        with self._condition:
+            n = len(self._tasks)
+            self._positions[job] = list(range(n, n + len(pages)))
+            self._tasks += [(job, page) for page in pages]
+            self._condition.notify_all()
+
+    def sort(self, key, reverse=False):
+        """
+        Reorder the pairs. This must be done before they're processed.
+        """
+        with self._condition:
+            self._tasks.sort(key=key, reverse=reverse)
+            self._positions = {}
+            for i, (job, page) in enumerate(self._tasks):
+                self._positions.setdefault(job, []).append(i)
+
+    def discard(self, job):
+        """
+        Drop the pairs of the job, so that its pages can be freed.
+        """
+        with self._condition:
+            for i in self._positions.pop(job, ()):
+                self._tasks[i] = None
+
+    def close(self):
+        """
+        Tell the threads that no more pairs will be added.
+        Return the pairs that were not discarded.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            return [task for task in self._tasks if task is not None]
+
+    def __iter__(self):
+        i = 0
+        while True:
+            with self._condition:
+                while i >= len(self._tasks):
+                    if self._closed:
+                        return
+                    self._condition.wait()
+                task = self._tasks[i]
+            i += 1
+            if task is not None:
+                yield task
+
+
 class Context(djvu.decode.Context):
 
-    def init(self, options):
+    def init(self, options, temp_dir=None):
+        if temp_dir is None:
+            temp_dir = temporary.raw.mkdtemp(prefix='ocrodjvu.')
         # noinspection PyAttributeOutsideInit
-        self._temp_dir = temporary.raw.mkdtemp(prefix='ocrodjvu.')
+        self._temp_dir = temp_dir
         # noinspection PyAttributeOutsideInit
         self._debug = options.debug
         # noinspection PyAttributeOutsideInit
         self._options = options
+        # noinspection PyAttributeOutsideInit
+        self._engine = options.engine
         bpp = 24 if self._options.render_layers != djvu.decode.RENDER_MASK_ONLY else 1
         # noinspection PyAttributeOutsideInit
         self._image_format = self._options.engine.image_format(bpp)
+        # noinspection PyAttributeOutsideInit
+        self._documents = {}
+        # noinspection PyAttributeOutsideInit
+        self._executor = None
+        # noinspection PyAttributeOutsideInit
+        self._coordinator = None
+        # noinspection PyAttributeOutsideInit
+        self._tile_executor = None
+        # noinspection PyAttributeOutsideInit
+        self._tile_executor_lock = threading.Lock()
+        # noinspection PyAttributeOutsideInit
+        self._remote_job_counter = itertools.count()
+        # noinspection PyAttributeOutsideInit
+        self._async_task = None
+        # noinspection PyAttributeOutsideInit
+        self._journal = None
+        # noinspection PyAttributeOutsideInit
+        self._metrics = metrics.Metrics() if options.metrics_file is not None else None
+        # noinspection PyAttributeOutsideInit
+        self._metrics_writer = None
+        # noinspection PyAttributeOutsideInit
+        self._stats = None
+        if options.stats is not None or self._metrics is not None:
+            # Metrics of processing stages are collected the same way as the stats.
+            observer = self._metrics.observe_stage if self._metrics is not None else None
+            self._stats = stats.Stats(observer=observer)
+        # noinspection PyAttributeOutsideInit
+        self._memory_budget = utils.MemoryBudget(options.max_memory)
+        # Classification and perceptual hashes of rendered pages, by (prefix, page number),
+        # and hashes of pages being processed:
+        # noinspection PyAttributeOutsideInit
+        self._non_text_images = {}
+        # noinspection PyAttributeOutsideInit
+        self._image_hashes = {}
+        # noinspection PyAttributeOutsideInit
+        self._page_hashes = {}
+        # (hash, page number, text) of pages recognized so far:
+        # noinspection PyAttributeOutsideInit
+        self._recognized_pages = []
+        # noinspection PyAttributeOutsideInit
+        self._recognized_pages_lock = threading.Lock()
+        # noinspection PyAttributeOutsideInit
+        self._cache = None
+        if options.cache is not None:
+            self._cache = cache.Cache(options.cache, options.cache_size)
+            # noinspection PyAttributeOutsideInit
+            self._cache_options_key = journal.get_digest(
+                self._engine.get_identity(options.language),
+                sorted(options.properties),
+                options.language,
+                str(options.details),
+                options.uax29,
+            )
 
     def _temp_file(self, name, mode='w+', encoding: Union[str, None] = locale.getpreferredencoding(), auto_remove=True):
         path = os.path.join(self._temp_dir, name)
@@ -429,22 +978,170 @@ class Context(djvu.decode.Context):
             file = temporary.wrapper(file, file.name)
         return file
 
+    def _image_file(self, name):
+        """
+        Return a binary file for the image to be passed to the OCR engine.
+        In-process engines get images in memory, unless they are kept for debugging.
+        """
+        if self._options.images_in_memory or (self._engine.in_process and not self._debug and hasattr(os, 'memfd_create')):
+            return temporary.memory_file(name)
+        return self._temp_file(name, mode='wb', encoding=None)
+
     def handle_message(self, message):
         if isinstance(message, djvu.decode.ErrorMessage):
             LOGGER.warning(message)
 
-    @contextlib.contextmanager
-    def get_output_image(self, nth, page_job):
+    def _measure(self, stage, path, page=None, cpu=True):
+        if self._stats is None:
+            return contextlib.nullcontext()
+        return self._stats.measure(stage, path, None if page is None else page.n, cpu=cpu)
+
+    def get_render_dpi(self, dpi):
+        """
+        Return resolution at which a page of the resolution is rendered.
+        """
+        if self._options.dpi is not None:
+            dpi = self._options.dpi
+        if self._options.max_dpi is not None:
+            dpi = min(dpi, self._options.max_dpi)
+        return dpi
+
+    def scale_page_job(self, page_job, attempt=0):
+        """
+        Return the page job to be rendered instead of this one: possibly at a different resolution.
+        Every attempt after a timeout halves the resolution.
+        """
+        if not page_job.dpi:
+            return page_job
+        dpi = max(1, self.get_render_dpi(page_job.dpi) >> attempt)
+        if dpi == page_job.dpi:
+            return page_job
+        return image_io.ScaledPageJob(page_job, dpi)
+
+    def render_image(self, nth, page_job, prefix=''):
         output_format = self._image_format
-        temp_file = self._temp_file(f'{nth:06}.{output_format.extension}', mode='wb', encoding=None)
+        temp_file = self._image_file(f'{prefix}{nth:06}.{output_format.extension}')
         try:
-            output_format.write_image(page_job, self._options.render_layers, temp_file)
+            data = output_format.write_image(page_job, self._options.render_layers, temp_file)
             temp_file.flush()
+        except BaseException:
+            temp_file.close()
+            raise
+        if self._options.skip_non_text:
+            self._classify_image(nth, prefix, data, page_job.size)
+        if self._options.skip_duplicates:
+            image_hash = image_io.get_perceptual_hash(page_job, self._options.render_layers)
+            self._image_hashes[prefix, nth] = image_hash
+            self._page_hashes[prefix, nth] = image_hash
+        return temp_file
+
+    def render_tiles(self, nth, page_job, prefix=''):
+        """
+        Render the page in overlapping tiles, if it's larger than the tile threshold.
+        Return _TiledImage, or None if the page should be rendered as a whole.
+        """
+        if self._options.tile_threshold is None:
+            return
+        width, height = page_job.size
+        max_pixels = self._options.tile_threshold * 1e6
+        if width * height <= max_pixels:
+            return
+        tiles = image_io.get_tiles(page_job.size, max_pixels, self._options.tile_overlap)
+        if len(tiles) < 2:
+            return
+        LOGGER.info(f'Page #{nth + 1} is split into {len(tiles)} tiles.')
+        output_format = self._image_format
+        tiled_image = _TiledImage()
+        try:
+            for i, (rect, core) in enumerate(tiles):
+                temp_file = self._image_file(f'{prefix}{nth:06}.{i:03}.{output_format.extension}')
+                tiled_image.tiles += [(rect, core, temp_file)]
+                x0, y0, x1, y1 = rect
+                output_format.write_image(page_job, self._options.render_layers, temp_file, rect=(x0, y0, x1 - x0, y1 - y0))
+                temp_file.flush()
+        except BaseException:
+            tiled_image.close()
+            raise
+        return tiled_image
+
+    def _classify_image(self, nth, prefix, data, size):
+        density, n_bands = self._image_format.get_ink_statistics(data, size)
+        kind = classify_image(density, n_bands, self._options.blank_threshold)
+        description = f'ink density: {density:.4f}, bands of ink: {n_bands}'
+        if kind is None:
+            LOGGER.debug(f'Page #{nth + 1} looks like text ({description}).')
+            return
+        LOGGER.info(f'Page #{nth + 1} looks like a {kind} page ({description}); skipping OCR.')
+        self._non_text_images[prefix, nth] = kind
+
+    def is_non_text_image(self, page_key):
+        """
+        Check if the rendered image of the (prefix, page number) was classified as blank or non-text.
+        """
+        return self._non_text_images.pop(page_key, None) is not None
+
+    def find_duplicate(self, page_key):
+        """
+        Return text of an already recognized page that looks like the rendered image
+        of the (prefix, page number), or None.
+        """
+        try:
+            image_hash = self._image_hashes.pop(page_key)
+        except LookupError:
+            return
+        nth = page_key[1]
+        with self._recognized_pages_lock:
+            candidates = list(self._recognized_pages)
+        best = None
+        for other_hash, other_nth, text in candidates:
+            distance = image_io.get_hash_distance(image_hash, other_hash)
+            if distance <= self._options.duplicate_threshold and (best is None or distance < best[0]):
+                best = distance, other_nth, text
+        if best is None:
+            return
+        distance, other_nth, text = best
+        LOGGER.info(f'Page #{nth + 1} looks like page #{other_nth + 1} (distance: {distance:.4f}); reusing its text.')
+        return text
+
+    def _forget_image(self, page_key):
+        self._non_text_images.pop(page_key, None)
+        self._image_hashes.pop(page_key, None)
+
+    def _remember_page_text(self, job, page, text):
+        image_hash = self._page_hashes.pop((job.prefix, page.n), None)
+        if image_hash is None or not isinstance(text, djvu.sexpr.Expression):
+            return
+        with self._recognized_pages_lock:
+            self._recognized_pages += [(image_hash, page.n, text)]
+
+    @staticmethod
+    def get_scaled_text(text, rotation, size):
+        """
+        Return text of another page, scaled to the page size.
+        """
+        if (rotation // 90) & 1:
+            size = tuple(reversed(size))
+        width, height = size
+        other_width, other_height = text.value[3:5]
+        if (width, height) == (other_width, other_height):
+            return text
+        return text_zones.scale_sexpr(text, width / other_width, height / other_height)
+
+    def get_empty_text(self, rotation, size):
+        bbox = text_zones.BBox(0, 0, *size)
+        page = text_zones.Zone(text_zones.const.TEXT_ZONE_PAGE, bbox, [])
+        page.rotate(rotation)
+        return page.sexpr
+
+    @contextlib.contextmanager
+    def get_output_image(self, nth, page_job, prefix=''):
+        temp_file = self.render_image(nth, page_job, prefix)
+        try:
             yield temp_file
         finally:
             temp_file.close()
 
-    def save_raw_ocr(self, page, result):
+    def save_raw_ocr(self, page, result, path='', suffix=''):
         output_dir = self._options.save_raw_ocr_dir
         if output_dir is None:
             return
@@ -453,164 +1150,1123 @@ class Context(djvu.decode.Context):
         page_number = page.n + 1
         prefix = os.path.join(
             output_dir,
-            expand_template(template, pageno=page_number, pageid=page_id),
+            expand_template(template, pageno=page_number, pageid=page_id, djvu_path=path),
         )
-        result.save(prefix)
+        result.save(prefix + suffix)
+
+    def open_document(self, path):
+        document = self.new_document(djvu.decode.FileURI(path))
+        document.decoding_job.wait()
+        return document
 
-    def process_page(self, page):
+    def get_document(self, path):
+        if self._options.listen is not None:
+            # A worker runs for a long time, and the documents may change
+            # in the meantime; don't keep them.
+            return self.open_document(path)
+        try:
+            return self._documents[path]
+        except LookupError:
+            pass
+        document = self._documents[path] = self.open_document(path)
+        return document
+
+    def process_page_number(self, path, n, prefix='', n_threads=1):
+        """
+        Process the n-th page of the document and return its text as a string.
+
+        This is the entry point for worker processes: the document is opened
+        (once per process) from the path, and only the compact result is sent
+        back to the parent process.
+        """
+        page = self.get_document(path).pages[n]
+        try:
+            text = self.process_page(page, path, prefix, n_threads)
+        except djvu.decode.NotAvailable:
+            return None
+        finally:
+            # The text is not kept here for detection of duplicates (see finish_page()).
+            self._forget_image((prefix, n))
+            self._page_hashes.pop((prefix, n), None)
+        return text.as_string(escape_unicode=False)
+
+    def _start_executor(self):
+        if self._options.executor == 'remote':
+            try:
+                # noinspection PyAttributeOutsideInit
+                self._coordinator = distributed.Coordinator(
+                    self._options.workers, self._get_options_journal_key(), timeout=self._options.worker_timeout
+                )
+            except distributed.NoWorkersError as ex:
+                errors.fatal(ex)
+            return
+        if self._options.executor != 'process':
+            return
+        # Start worker processes from scratch rather than forking this one:
+        # DjVuLibre runs its own threads, which don't survive fork().
+        mp_context = multiprocessing.get_context('spawn')
+        # noinspection PyAttributeOutsideInit
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self._options.n_jobs,
+            mp_context=mp_context,
+            initializer=_init_worker_context,
+            initargs=(self._options, self._temp_dir),
+        )
+
+    def _stop_executor(self):
+        if self._tile_executor is not None:
+            self._tile_executor.shutdown(wait=False, cancel_futures=True)
+            # noinspection PyAttributeOutsideInit
+            self._tile_executor = None
+        if self._coordinator is not None:
+            self._coordinator.close()
+            # noinspection PyAttributeOutsideInit
+            self._coordinator = None
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        # noinspection PyAttributeOutsideInit
+        self._executor = None
+
+    def run_page(self, job, page):
+        if self._coordinator is not None:
+            return self.run_page_remotely(job, page)
+        n_bytes = self._memory_budget.acquire(self.estimate_page_memory(page))
+        n_threads = self._thread_allocator.acquire()
+        try:
+            if self._executor is None:
+                with ipc.thread_environment(OMP_THREAD_LIMIT=str(n_threads)):
+                    return self.process_page(page, job.path, job.prefix, n_threads)
+            future = self._executor.submit(_process_page_in_worker, job.path, page.n, job.prefix, n_threads)
+            result, timings = future.result()
+            if self._stats is not None:
+                self._stats.merge_page(job.path, page.n, timings)
+        finally:
+            self._thread_allocator.release(n_threads)
+            self._memory_budget.release(n_bytes)
+        if result is None:
+            raise djvu.decode.NotAvailable
+        return djvu.sexpr.Expression.from_string(result)
+
+    def run_page_remotely(self, job, page):
+        if self._options.remote_input == 'path':
+            LOGGER.info(f'- Page #{page.n + 1}')
+            header = dict(type='page', path=os.path.abspath(job.path), n=page.n)
+            reply = self._coordinator.submit(header, b'')
+        else:
+            # The image is held in memory until the worker replies.
+            n_bytes = self._memory_budget.acquire(self.estimate_page_memory(page))
+            try:
+                page_job = self.decode_page(page)
+                render_job = self.scale_page_job(page_job)
+                header = dict(type='image', n=page.n, rotation=page.rotation, size=page_job.size, render_size=render_job.size)
+                with self.get_output_image(page.n, render_job, job.prefix) as image_file:
+                    render_job = None  # no longer needed
+                    page_job = None  # no longer needed
+                    page_key = job.prefix, page.n
+                    if self.is_non_text_image(page_key):
+                        self._forget_image(page_key)
+                        return self.get_empty_text(page.rotation, header['size'])
+                    text = self.find_duplicate(page_key)
+                    if text is not None:
+                        return self.get_scaled_text(text, page.rotation, header['size'])
+                    with open(image_file.name, 'rb') as file:
+                        payload = file.read()
+                reply = self._coordinator.submit(header, payload)
+            finally:
+                self._memory_budget.release(n_bytes)
+        if reply['status'] == 'not-available':
+            raise djvu.decode.NotAvailable
+        return djvu.sexpr.Expression.from_string(reply['text'])
+
+    def process_remote_job(self, header, payload):
+        """
+        Process a job received from a coordinator, and return the reply.
+        """
+        n = int(header['n'])
+        if header['type'] == 'page':
+            # Jobs processed at the same time may be for the same page number of different documents.
+            prefix = f'remote.{next(self._remote_job_counter):06}.'
+            text = self.process_page_number(header['path'], n, prefix)
+            if text is None:
+                return dict(status='not-available')
+            return dict(status='ok', text=text)
+        if header['type'] != 'image':
+            raise ValueError(f'unknown job type {header["type"]!r}')
+        name = f'remote.{next(self._remote_job_counter):06}.{self._image_format.extension}'
+        with self._image_file(name) as image_file:
+            image_file.write(payload)
+            image_file.flush()
+            # The image can't be rendered again at lower resolution here, so there are no retries.
+            with ipc.deadline(self._options.page_timeout):
+                result = self.recognize_image(image_file)
+        # Coordinators of older versions don't scale images.
+        render_size = tuple(header.get('render_size', header['size']))
+        text = self.parse_page(result, int(header['rotation']), tuple(header['size']), render_size)
+        return dict(status='ok', text=text.as_string(escape_unicode=False))
+
+    def serve(self, address):
+        try:
+            worker = distributed.Worker(address, self.process_remote_job, self._get_options_journal_key(), self._options.n_jobs)
+        except ValueError as ex:
+            errors.fatal(f'cannot parse address {address!r}: {ex}')
+        except OSError as ex:
+            errors.fatal(f'cannot listen on {address!r}: {ex.strerror}')
+        try:
+            LOGGER.info(f'Listening on {worker.address}')
+            worker.serve_forever()
+        finally:
+            worker.close()
+            self._stop_executor()
+
+    @staticmethod
+    def decode_page(page):
         LOGGER.info(f'- Page #{page.n + 1}')
         page_job = page.decode(wait=True)
         # Because of a bug in python-djvulibre <= 0.3.9, sometimes the exception is not raised.
         # Raise in manually in such case.
         if issubclass(page_job.status, djvu.decode.JobFailed):
             raise page_job.status
-        size = page_job.size
-        with self.get_output_image(page.n, page_job) as pfile:
-            result = self._engine.recognize(
-                pfile, language=self._options.language, details=self._options.details, uax29=self._options.uax29
-            )
-            if self._debug:
-                result.save(os.path.join(self._temp_dir, f'{page.n:06}'))
-            self.save_raw_ocr(page, result)
-            [text] = self._engine.extract_text(
-                result.as_stringio() if self._engine.name != 'gocr' else result.as_bytesio(),
-                rotation=page.rotation,
-                details=self._options.details,
-                uax29=self._options.uax29,
-                html5=self._options.html5,
-                fix_utf8=self._engine.needs_utf8_fix,
-                page_size=size
+        return page_job
+
+    def _get_known_result(self, image_file, page_key=None):
+        """
+        Return (cache key, OCR result) pair for the image, without running the engine.
+        The result is None if the image has to be recognized;
+        the key is None if the result must not be cached.
+        page_key is (prefix, page number) if the image is of the whole page, rather than of a tile.
+        """
+        if page_key is not None:
+            if self.is_non_text_image(page_key):
+                self._forget_image(page_key)
+                return None, _NON_TEXT
+            text = self.find_duplicate(page_key)
+            if text is not None:
+                return None, _Duplicate(text)
+        if self._cache is None:
+            return None, None
+        key = cache.get_key(image_file.name, self._cache_options_key)
+        entry = self._cache.get(key)
+        if entry is None:
+            return key, None
+        format_, contents = entry
+        return key, engines_common.Output(contents, format_=format_)
+
+    def _cache_result(self, key, result):
+        if key is not None:
+            self._cache.put(key, result.format, result.contents)
+
+    def recognize_image(self, image_file, page_key=None):
+        key, result = self._get_known_result(image_file, page_key)
+        if result is not None:
+            return result
+        result = self._engine.recognize(
+            image_file, language=self._options.language, details=self._options.details, uax29=self._options.uax29
+        )
+        self._cache_result(key, result)
+        return result
+
+    def recognize_tiles(self, tiled_image, n_threads=1):
+        """
+        Recognize the tiles in parallel, sharing n_threads cores between them.
+        """
+        n_workers = max(1, min(n_threads, len(tiled_image.tiles)))
+        thread_limit = str(max(1, n_threads // n_workers))
+
+        def recognize(image_file):
+            with ipc.thread_environment(OMP_THREAD_LIMIT=thread_limit):
+                return self.recognize_image(image_file)
+
+        def recognize_all(executor):
+            # The tiles share the deadline of the page.
+            futures = [
+                executor.submit(contextvars.copy_context().run, recognize, file)
+                for _, _, file in tiled_image.tiles
+            ]
+            return [future.result() for future in futures]
+
+        if self._engine.in_process:
+            results = recognize_all(self._get_tile_executor())
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+                results = recognize_all(executor)
+        return _Tiles([
+            (rect, core, result)
+            for (rect, core, _), result in zip(tiled_image.tiles, results)
+        ])
+
+    def _get_tile_executor(self):
+        """
+        Return the pool of threads recognizing tiles with in-process engines.
+        The pool lives as long as the context, so that its threads keep the
+        state of the engine (such as loaded language data) between pages.
+        """
+        with self._tile_executor_lock:
+            if self._tile_executor is None:
+                # noinspection PyAttributeOutsideInit
+                self._tile_executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._options.n_jobs)
+            return self._tile_executor
+
+    def recognize_page(self, page, image_file, path='', prefix='', n_threads=1):
+        with self._measure('ocr', path, page), ipc.deadline(self._options.page_timeout):
+            if isinstance(image_file, _TiledImage):
+                result = self.recognize_tiles(image_file, n_threads)
+            else:
+                result = self.recognize_image(image_file, (prefix, page.n))
+        self.keep_ocr_result(page, result, path, prefix)
+        return result
+
+    def keep_ocr_result(self, page, result, path='', prefix='', suffix=''):
+        if isinstance(result, (_NonText, _Duplicate)):
+            return
+        if isinstance(result, _Tiles):
+            for i, (_, _, tile_result) in enumerate(result.tiles):
+                self.keep_ocr_result(page, tile_result, path, prefix, suffix=f'.{i:03}')
+            return
+        if self._debug:
+            result.save(os.path.join(self._temp_dir, f'{prefix}{page.n:06}{suffix}'))
+        self.save_raw_ocr(page, result, path, suffix)
+
+    def render_page(self, page, path='', prefix='', attempt=0):
+        with self._measure('decode', path, page):
+            page_job = self.decode_page(page)
+        with self._measure('render', path, page) as values:
+            render_job = self.scale_page_job(page_job, attempt)
+            image_file = self.render_tiles(page.n, render_job, prefix)
+            if image_file is None:
+                image_file = self.render_image(page.n, render_job, prefix)
+            if values is not None:
+                values['bytes'] = image_file.tell()
+        return page_job.size, render_job.size, image_file
+
+    async def _acquire_memory_async(self, page):
+        n_bytes = await asyncio.to_thread(self.estimate_page_memory, page)
+        # Coroutines wait in turn; a thread blocked in MemoryBudget.acquire()
+        # would take a thread needed by the coroutines that hold the memory.
+        async with self._memory_lock:
+            while True:
+                self._memory_released.clear()
+                reserved = self._memory_budget.try_acquire(n_bytes)
+                if reserved is not None:
+                    return reserved
+                await self._memory_released.wait()
+
+    def _release_memory_async(self, n_bytes):
+        self._memory_budget.release(n_bytes)
+        self._memory_released.set()
+
+    async def recognize_image_async(self, image_file, n_threads=1, page_key=None):
+        key, result = await asyncio.to_thread(self._get_known_result, image_file, page_key)
+        if result is not None:
+            return result
+        with ipc.thread_environment(OMP_THREAD_LIMIT=str(n_threads)):
+            result = await self._engine.recognize_async(
+                image_file, language=self._options.language, details=self._options.details, uax29=self._options.uax29
             )
-            # It should be: (page 0 0 <width> <height> …):
-            assert len(text) > 5
-            return text
+        await asyncio.to_thread(self._cache_result, key, result)
+        return result
+
+    async def recognize_tiles_async(self, tiled_image, n_threads=1):
+        """
+        Asynchronous variant of `recognize_tiles()`.
+        """
+        n_workers = max(1, min(n_threads, len(tiled_image.tiles)))
+        semaphore = asyncio.Semaphore(n_workers)
+
+        async def recognize(image_file):
+            async with semaphore:
+                return await self.recognize_image_async(image_file, max(1, n_threads // n_workers))
+
+        results = await asyncio.gather(*(recognize(file) for _, _, file in tiled_image.tiles))
+        return _Tiles([
+            (rect, core, result)
+            for (rect, core, _), result in zip(tiled_image.tiles, results)
+        ])
+
+    async def process_page_async(self, job, page):
+        n_bytes = await self._acquire_memory_async(page)
+        try:
+            for attempt in itertools.count():
+                # DjVuLibre and the parser can't run asynchronously, so they get threads of their own.
+                size, render_size, image_file = await asyncio.to_thread(self.render_page, page, job.path, job.prefix, attempt)
+                try:
+                    n_threads = self._thread_allocator.acquire()
+                    try:
+                        # CPU time of the event loop thread doesn't belong to this page.
+                        with self._measure('ocr', job.path, page, cpu=False), ipc.deadline(self._options.page_timeout):
+                            if isinstance(image_file, _TiledImage):
+                                result = await self.recognize_tiles_async(image_file, n_threads)
+                            else:
+                                result = await self.recognize_image_async(image_file, n_threads, (job.prefix, page.n))
+                    finally:
+                        self._thread_allocator.release(n_threads)
+                except ipc.TimeoutExpired:
+                    if not self.retry_after_timeout(page, attempt):
+                        raise
+                else:
+                    break
+                finally:
+                    image_file.close()
+        finally:
+            self._release_memory_async(n_bytes)
+        self.keep_ocr_result(page, result, job.path, job.prefix)
+        return await asyncio.to_thread(self.parse_recognized_page, page, result, size, render_size, job.path)
+
+    def parse_page(self, result, rotation, size, render_size=None):
+        """
+        Return text of the page of the size, from OCR result of its image of render_size.
+        """
+        if result is _NON_TEXT:
+            return self.get_empty_text(rotation, size)
+        if isinstance(result, _Duplicate):
+            return self.get_scaled_text(result.text, rotation, size)
+        if render_size is None:
+            render_size = size
+        scale = render_size[0] / size[0], render_size[1] / size[1]
+        if isinstance(result, _Tiles):
+            tiles = [
+                (rect, core, self.extract_text(tile_result, 0, (rect[2] - rect[0], rect[3] - rect[1])))
+                for rect, core, tile_result in result.tiles
+            ]
+            return text_zones.merge_tiles(tiles, size, rotation, scale)
+        if render_size != size:
+            # The image was scaled: map the coordinates back to the page before rotating them.
+            text = self.extract_text(result, 0, render_size)
+            return text_zones.merge_tiles([((0, 0) + render_size, None, text)], size, rotation, scale)
+        return self.extract_text(result, rotation, size)
+
+    def extract_text(self, result, rotation, size):
+        [text] = self._engine.extract_text(
+            result.as_stringio() if self._engine.name != 'gocr' else result.as_bytesio(),
+            rotation=rotation,
+            details=self._options.details,
+            uax29=self._options.uax29,
+            html5=self._options.html5,
+            fix_utf8=self._engine.needs_utf8_fix,
+            page_size=size
+        )
+        # It should be: (page 0 0 <width> <height> …):
+        assert len(text) > 5
+        return text
+
+    def parse_recognized_page(self, page, result, size, render_size, path=''):
+        with self._measure('parse', path, page):
+            return self.parse_page(result, page.rotation, size, render_size)
+
+    def retry_after_timeout(self, page, attempt):
+        """
+        Return true if the page should be recognized again, after the OCR
+        engine was killed for taking too long in the attempt.
+        """
+        if attempt >= self._options.timeout_retries:
+            return False
+        LOGGER.warning(f'OCR of page {page.n + 1} timed out; trying again at lower resolution.')
+        return True
+
+    def render_and_recognize_page(self, page, path='', prefix='', n_threads=1, attempt=0):
+        """
+        Return (page size, image size, OCR result) triple for the page.
+        """
+        while True:
+            size, render_size, image_file = self.render_page(page, path, prefix, attempt)
+            try:
+                with image_file:
+                    return size, render_size, self.recognize_page(page, image_file, path, prefix, n_threads)
+            except ipc.TimeoutExpired:
+                if not self.retry_after_timeout(page, attempt):
+                    raise
+            attempt += 1
+
+    def process_page(self, page, path='', prefix='', n_threads=1):
+        size, render_size, result = self.render_and_recognize_page(page, path, prefix, n_threads)
+        return self.parse_recognized_page(page, result, size, render_size, path)
+
+    def _get_options_journal_key(self):
+        options = self._options
+        return journal.get_digest(
+            options.engine.name,
+            sorted(options.properties),
+            options.language,
+            str(options.details),
+            options.uax29,
+            str(options.render_layers),
+            options.html5,
+            options.dpi,
+            options.max_dpi,
+            options.tile_threshold,
+            options.tile_overlap if options.tile_threshold is not None else None,
+            options.skip_non_text,
+            options.blank_threshold if options.skip_non_text else None,
+            options.skip_duplicates,
+        )
+
+    @staticmethod
+    def _get_page_journal_key(page):
+        try:
+            return page.file.id
+        except UnicodeError:
+            return f'#{page.n + 1}'
+
+    def _open_journal(self):
+        if self._options.journal is None:
+            return
+        # noinspection PyAttributeOutsideInit
+        self._journal = journal.Journal(self._options.journal)
+        # noinspection PyAttributeOutsideInit
+        self._journal_options_key = self._get_options_journal_key()
 
-    def page_thread(self, pages, results, condition):
-        for page in pages:
-            n = page.n
+    def _restore_from_journal(self, job):
+        if self._journal is None:
+            return
+        job.journal_key = journal.get_file_digest(job.path)
+        if not self._options.resume:
+            return
+        recorded = self._journal.load(job.journal_key, self._journal_options_key)
+        n_restored = 0
+        for page in job.pages:
+            try:
+                text = recorded[self._get_page_journal_key(page)]
+            except LookupError:
+                continue
+            if text is None:
+                job.set_result(page, False)
+            else:
+                job.set_result(page, djvu.sexpr.Expression.from_string(text))
+            n_restored += 1
+        if n_restored:
+            LOGGER.info(f'Restored {n_restored} page(s) of {job.path} from the journal.')
+
+    def _close_journal(self):
+        if self._journal is None:
+            return
+        self._journal.close()
+        # noinspection PyAttributeOutsideInit
+        self._journal = None
+
+    def record_page_result(self, job, page, result):
+        if self._journal is None:
+            return
+        text = None if result is False else result.as_string(escape_unicode=False)
+        self._journal.record(job.journal_key, self._journal_options_key, self._get_page_journal_key(page), text)
+
+    def take_page(self, job, page, condition):
+        with condition:
+            if job.results[page.n] is not None:
+                # The page is being processed or has been already processed.
+                return False
+            # Mark the page as taken.
+            job.results[page.n] = True
+            job.n_queued -= 1
+            # The main thread may have to open the next document.
+            condition.notify()
+        self._count('queue_depth', -1)
+        self._count('pages_in_progress', 1)
+        if self._stats is not None:
+            # All the pages are queued when the run starts.
+            self._stats.add('queue', job.path, page.n, time.perf_counter() - self._stats.started)
+        return True
+
+    def _count(self, name, value=1):
+        if self._metrics is not None:
+            self._metrics.add(name, value)
+
+    def _add_queue_wait(self, stage, job, page, queued):
+        if self._stats is not None:
+            self._stats.add(stage, job.path, page.n, time.perf_counter() - queued)
+
+    def finish_page(self, job, page, result, condition):
+        self._remember_page_text(job, page, result)
+        self._count('pages_in_progress', -1)
+        self._count('pages_skipped' if result is False else 'pages_done')
+        if self._stats is not None:
+            # The result may have to wait for the preceding pages before it's written.
+            self._stats.mark(job.path, page.n)
+        with condition:
+            assert job.results[page.n] is True
+            job.set_result(page, result)
+            condition.notify()
+
+    def fail_page(self, job, page, ex, condition, batch=()):
+        """
+        Report an exception raised while processing the page.
+        Return true if other pages should be still processed.
+
+        batch are (job, page) pairs taken together with the page. If processing
+        is aborted, those not finished yet get the same exception: otherwise
+        the main thread could wait for them forever.
+        """
+        self._forget_image((job.prefix, page.n))
+        self._page_hashes.pop((job.prefix, page.n), None)
+        self._count('pages_in_progress', -1)
+        self._count('pages_failed')
+        try:
+            interrupted_by_user = isinstance(ex, ipc.CalledProcessInterrupted) and ex.by_user
+            message = f'Exception while processing page {(page.n + 1)}:\n{traceback.format_exc()}'
+            LOGGER.error(message.rstrip())
+            if self._options.resume_on_error and not interrupted_by_user:
+                # As requested by user, do not abort on error and pretend that nothing happened.
+                job.set_result(page, False)
+                job.results.seen_exception = True
+                return True
+            else:
+                # The main thread will take care of aborting the application.
+                job.set_result(page, ex)
+                with condition:
+                    for other_job, other_page in batch:
+                        if other_job.results[other_page.n] is True:
+                            self._count('pages_in_progress', -1)
+                            other_job.set_result(other_page, ex)
+                return False
+        finally:
             with condition:
-                result = results[n]
-                if result is not None:
-                    # The page is being processed or has been already processed.
-                    continue
-                # Mark the page as taken.
-                results[n] = True
+                condition.notify()
+
+    def page_thread(self, tasks, condition):
+        for job, page in tasks:
+            if not self.take_page(job, page, condition):
+                continue
             try:
-                result = self.process_page(page)
-            except djvu.decode.NotAvailable:
-                LOGGER.info('No image suitable for OCR.')
-                result = False
+                try:
+                    result = self.run_page(job, page)
+                except djvu.decode.NotAvailable:
+                    LOGGER.info('No image suitable for OCR.')
+                    result = False
+                self.record_page_result(job, page, result)
             except (SystemExit, KeyboardInterrupt):
                 with condition:
                     condition.notify()
                 raise
             except Exception as ex:
-                try:
-                    interrupted_by_user = isinstance(ex, ipc.CalledProcessInterrupted) and ex.by_user
-                    message = f'Exception while processing page {(n + 1)}:\n{traceback.format_exc()}'
-                    LOGGER.error(message.rstrip())
-                    if self._options.resume_on_error and not interrupted_by_user:
-                        # As requested by user, do not abort on error and pretend that nothing happened.
-                        results[n] = False
-                        results.seen_exception = True
+                if self.fail_page(job, page, ex, condition):
+                    continue
+                return
+            self.finish_page(job, page, result, condition)
+
+    def page_batch_thread(self, tasks, condition, batch_size):
+        """
+        Like `page_thread()`, but take batch_size pages at a time, and
+        recognize them with a single invocation of the OCR engine.
+        """
+        batch = []
+        for job, page in tasks:
+            if not self.take_page(job, page, condition):
+                continue
+            batch += [(job, page)]
+            if len(batch) < batch_size:
+                continue
+            if not self.run_page_batch(batch, condition):
+                return
+            batch = []
+        if batch:
+            self.run_page_batch(batch, condition)
+
+    def run_page_batch(self, batch, condition):
+        """
+        Process the pages of the batch.
+        Return true if other pages should be still processed.
+        """
+        n_bytes = self._memory_budget.acquire(sum(self.estimate_page_memory(page) for _, page in batch))
+        n_threads = self._thread_allocator.acquire()
+        rendered = []
+        try:
+            with ipc.thread_environment(OMP_THREAD_LIMIT=str(n_threads)):
+                for job, page in batch:
+                    try:
+                        size, render_size, image_file = self.render_page(page, job.path, job.prefix)
+                    except djvu.decode.NotAvailable:
+                        LOGGER.info('No image suitable for OCR.')
+                        self.record_page_result(job, page, False)
+                        self.finish_page(job, page, False, condition)
                         continue
-                    else:
-                        # The main thread will take care of aborting the application.
-                        results[n] = ex
-                        return
-                finally:
-                    with condition:
-                        condition.notify()
+                    except Exception as ex:
+                        if not self.fail_page(job, page, ex, condition, batch):
+                            return False
+                        continue
+                    rendered += [(job, page, size, render_size, image_file)]
+                results = self.recognize_page_batch(rendered, n_threads)
+                for (job, page, size, render_size, image_file), result in zip(rendered, results):
+                    image_file.close()
+                    if not self.finish_batch_page(job, page, size, render_size, result, condition, n_threads, batch):
+                        return False
+        finally:
+            for _, _, _, _, image_file in rendered:
+                image_file.close()
+            self._thread_allocator.release(n_threads)
+            self._memory_budget.release(n_bytes)
+        return True
+
+    def finish_batch_page(self, job, page, size, render_size, result, condition, n_threads=1, batch=()):
+        """
+        Parse OCR result of a page of a batch, and report its text.
+        Return true if other pages should be still processed.
+        batch is passed on to `fail_page()`.
+        """
+        try:
+            try:
+                if isinstance(result, Exception):
+                    raise result
+                if result is None:
+                    # The batch failed: try again with this page alone.
+                    text = self.process_page(page, job.path, job.prefix, n_threads)
+                else:
+                    self.keep_ocr_result(page, result, job.path, job.prefix)
+                    text = self.parse_recognized_page(page, result, size, render_size, job.path)
+            except djvu.decode.NotAvailable:
+                LOGGER.info('No image suitable for OCR.')
+                text = False
+            self.record_page_result(job, page, text)
+        except (SystemExit, KeyboardInterrupt):
             with condition:
-                assert results[n] is True
-                results[n] = result
                 condition.notify()
+            raise
+        except Exception as ex:
+            return self.fail_page(job, page, ex, condition, batch)
+        self.finish_page(job, page, text, condition)
+        return True
+
+    def recognize_page_batch(self, rendered, n_threads=1):
+        """
+        Recognize images of the rendered pages, all at once if possible.
+        Return a list of OCR results. A result is None if the page must be
+        processed again on its own, or an exception if it failed.
+        """
+        results = [None] * len(rendered)
+        batch = []
+        page_timeout = self._options.page_timeout
+        for i, (job, page, _, _, image_file) in enumerate(rendered):
+            try:
+                if isinstance(image_file, _TiledImage):
+                    # Tiles are recognized in parallel anyway.
+                    with self._measure('ocr', job.path, page), ipc.deadline(page_timeout):
+                        results[i] = self.recognize_tiles(image_file, n_threads)
+                    continue
+                key, result = self._get_known_result(image_file, (job.prefix, page.n))
+            except ipc.TimeoutExpired:
+                # Processed again on its own, with the usual retries.
+                continue
+            except Exception as ex:
+                results[i] = ex
+                continue
+            if result is None:
+                batch += [(i, key)]
+            else:
+                results[i] = result
+        if not batch:
+            return results
+        start = time.perf_counter()
+        try:
+            with ipc.deadline(None if page_timeout is None else page_timeout * len(batch)):
+                batch_results = self._engine.recognize_batch(
+                    [rendered[i][4] for i, _ in batch],
+                    language=self._options.language, details=self._options.details, uax29=self._options.uax29
+                )
+        except (ipc.TimeoutExpired, errors.MalformedOcrOutputError, ipc.CalledProcessError) as ex:
+            if isinstance(ex, ipc.CalledProcessInterrupted) and ex.by_user:
+                raise
+            LOGGER.warning(f'OCR of a batch of {len(batch)} pages failed ({ex}); recognizing them one by one.')
+            return results
+        if self._stats is not None:
+            # The engine time is shared equally between the pages.
+            wall = (time.perf_counter() - start) / len(batch)
+            for i, _ in batch:
+                job, page = rendered[i][:2]
+                self._stats.add('ocr', job.path, page.n, wall)
+        for (i, key), result in zip(batch, batch_results):
+            self._cache_result(key, result)
+            results[i] = result
+        return results
+
+    def render_thread(self, tasks, condition, pipeline):
+        try:
+            for job, page in tasks:
+                if pipeline.stopped.is_set():
+                    return
+                if not self.take_page(job, page, condition):
+                    continue
+                # The memory is released by the OCR thread, when the engine is done with the image.
+                n_bytes = self._memory_budget.acquire(self.estimate_page_memory(page))
+                try:
+                    try:
+                        item = (job, page, *self.render_page(page, job.path, job.prefix))
+                    except djvu.decode.NotAvailable:
+                        self._memory_budget.release(n_bytes)
+                        LOGGER.info('No image suitable for OCR.')
+                        self.record_page_result(job, page, False)
+                        self.finish_page(job, page, False, condition)
+                        continue
+                except Exception as ex:
+                    self._memory_budget.release(n_bytes)
+                    if self.fail_page(job, page, ex, condition):
+                        continue
+                    return
+                pipeline.rendered.put((*item, n_bytes, time.perf_counter()))
+        finally:
+            pipeline.producer_done(pipeline.rendered)
 
-    def _process(self, path, pages=None):
-        self._engine = self._options.engine
-        LOGGER.info(f'Processing {path}:')
-        document = self.new_document(djvu.decode.FileURI(path))
-        document.decoding_job.wait()
+    def ocr_thread(self, condition, pipeline):
+        try:
+            for job, page, size, render_size, image_file, n_bytes, queued in pipeline.consume(pipeline.rendered):
+                self._add_queue_wait('rendered-queue', job, page, queued)
+                try:
+                    try:
+                        if pipeline.stopped.is_set():
+                            continue
+                        n_threads = self._thread_allocator.acquire()
+                        try:
+                            with ipc.thread_environment(OMP_THREAD_LIMIT=str(n_threads)):
+                                try:
+                                    result = self.recognize_page(page, image_file, job.path, job.prefix, n_threads)
+                                except ipc.TimeoutExpired:
+                                    if not self.retry_after_timeout(page, 0):
+                                        raise
+                                    image_file.close()
+                                    # Retries are rare: render them in this thread.
+                                    size, render_size, result = self.render_and_recognize_page(
+                                        page, job.path, job.prefix, n_threads, attempt=1
+                                    )
+                        finally:
+                            self._thread_allocator.release(n_threads)
+                    finally:
+                        image_file.close()
+                        self._memory_budget.release(n_bytes)
+                except Exception as ex:
+                    self.fail_page(job, page, ex, condition)
+                    continue
+                pipeline.recognized.put((job, page, size, render_size, result, time.perf_counter()))
+        finally:
+            pipeline.producer_done(pipeline.recognized)
+
+    async def page_coroutine(self, tasks, condition):
+        for job, page in tasks:
+            if not self.take_page(job, page, condition):
+                continue
+            try:
+                try:
+                    result = await self.process_page_async(job, page)
+                except djvu.decode.NotAvailable:
+                    LOGGER.info('No image suitable for OCR.')
+                    result = False
+                self.record_page_result(job, page, result)
+            except Exception as ex:
+                if self.fail_page(job, page, ex, condition):
+                    continue
+                return
+            self.finish_page(job, page, result, condition)
+
+    async def _process_tasks_async(self, tasks, condition):
+        # noinspection PyAttributeOutsideInit
+        self._async_task = asyncio.get_running_loop(), asyncio.current_task()
+        # noinspection PyAttributeOutsideInit
+        self._memory_lock = asyncio.Lock()
+        # noinspection PyAttributeOutsideInit
+        self._memory_released = asyncio.Event()
+        # All the coroutines take pages from a single iterator.
+        tasks = iter(tasks)
+        await asyncio.gather(*(
+            self.page_coroutine(tasks, condition)
+            for _ in range(self._options.n_jobs)
+        ))
+
+    def async_thread(self, tasks, condition):
+        try:
+            asyncio.run(self._process_tasks_async(tasks, condition))
+        except asyncio.CancelledError:
+            pass
+
+    def _cancel_async_tasks(self):
+        if self._async_task is None:
+            return
+        loop, task = self._async_task
+        try:
+            # Engine subprocesses that are still running get killed.
+            loop.call_soon_threadsafe(task.cancel)
+        except RuntimeError:
+            # The event loop is already closed.
+            pass
+
+    def parse_thread(self, condition, pipeline):
+        for job, page, size, render_size, result, queued in pipeline.consume(pipeline.recognized):
+            self._add_queue_wait('recognized-queue', job, page, queued)
+            if pipeline.stopped.is_set():
+                continue
+            try:
+                text = self.parse_recognized_page(page, result, size, render_size, job.path)
+                self.record_page_result(job, page, text)
+            except Exception as ex:
+                self.fail_page(job, page, ex, condition)
+                continue
+            self.finish_page(job, page, text, condition)
+
+    def write_page_result(self, sed_file, page, result):
+        try:
+            file_id = page.file.id
+        except UnicodeError:
+            page_number = page.n + 1
+            LOGGER.warning(f'warning: cannot convert page {page_number} identifier to locale encoding')
+            sed_file.write(f'select {page_number}\n')
+        else:
+            sed_file.write("select '{fileid}'\n".format(
+                fileid=file_id.replace('\\', '\\\\').replace("'", "\\'")
+            ))
+        sed_file.write('set-txt\n')
+        if result is False:
+            # No image suitable for OCR.
+            pass
+        else:
+            text_zones.print_sexpr(result, sed_file)
+        sed_file.write('\n.\n\n')
+
+    def save_job(self, job):
+        with self._measure('save', job.path):
+            self._save_job(job)
+
+    def _save_job(self, job):
+        job.sed_file.flush()
+        document = job.document
+        if job.saver.in_place:
+            document = None
+        pages_to_save = None
+        if self._options.ocr_only:
+            pages_to_save = [page.n for page in job.pages]
+        job.saver.save(document, pages_to_save, job.path, job.sed_file)
+        job.document = document = None  # noqa: F841
+
+    def _new_jobs(self, paths):
+        batch_mode = len(paths) > 1
+        in_page_order = self._options.script_order == 'page'
+        for index, path in enumerate(paths):
+            if batch_mode:
+                saver = self._options.saver.for_document(path)
+                prefix = f'{index + 1:04}.'
+            else:
+                saver = self._options.saver
+                prefix = ''
+            # The document is opened only when its pages are about to be processed.
+            yield Job(path, None, None, saver, prefix=prefix, in_page_order=in_page_order)
+
+    def _open_job(self, job, pages):
+        """
+        Open the document of the job, and its djvused script.
+        Return the pages that still have to be processed.
+        """
+        LOGGER.info(f'Processing {job.path}:')
+        job.document = document = self.open_document(job.path)
         if pages is None:
-            pages = list(document.pages)
+            job.pages = list(document.pages)
         else:
-            pages = [document.pages[i - 1] for i in pages]
-        results = Results()
+            job.pages = []
+            for i in pages:
+                if not 1 <= i <= len(document.pages):
+                    LOGGER.warning(f'warning: {job.path} has no page {i}; skipping it')
+                    continue
+                job.pages += [document.pages[i - 1]]
+        self._restore_from_journal(job)
+        if self._options.skip_existing_text:
+            self._skip_pages_with_text(job)
+        sed_file_name = f'ocrodjvu.{job.prefix}djvused' if job.prefix else 'ocrodjvu.djvused'
+        job.sed_file = self._temp_file(sed_file_name, auto_remove=False)
+        if self._options.clear_text:
+            job.sed_file.write('remove-txt\n')
+        job_pages = [page for page in job.pages if job.results[page.n] is None]
+        job.n_queued = len(job_pages)
+        if self._metrics is not None:
+            # Pages restored from the journal or with existing text are not queued.
+            self._metrics.add('pages_skipped', len(job.pages) - len(job_pages))
+            self._metrics.add('queue_depth', len(job_pages))
+        return job_pages
+
+    @staticmethod
+    def get_existing_text(page):
+        """
+        Return the hidden text of the page, or None if it has no text.
+        """
+        try:
+            page.text.wait()
+            text = page.text.sexpr
+        except (djvu.decode.NotAvailable, djvu.decode.JobFailed):
+            return
+        if not _has_text(text.value):
+            return
+        return text
+
+    def _skip_pages_with_text(self, job):
+        n_skipped = 0
+        for page in job.pages:
+            if job.results[page.n] is not None:
+                continue
+            text = self.get_existing_text(page)
+            if text is None:
+                continue
+            # The text is written back as it is, so that it survives --clear-text.
+            job.set_result(page, text)
+            n_skipped += 1
+        if n_skipped:
+            LOGGER.info(f'Skipped {n_skipped} page(s) of {job.path} that already have text.')
+
+    @staticmethod
+    def estimate_page_cost(page):
+        """
+        Estimate how expensive the OCR of the page is, without decoding it.
+        """
+        try:
+            page.get_info(wait=True)
+            width, height = page.size
+        except (djvu.decode.NotAvailable, djvu.decode.JobFailed):
+            return 0
+        # The image is rendered at the page's own resolution,
+        # so the number of pixels already takes the DPI into account.
+        return width * height
+
+    def estimate_page_memory(self, page):
+        """
+        Estimate how much memory the rendered image of the page takes:
+        once in this process, and once more in the OCR engine.
+        """
+        n_pixels = self.estimate_page_cost(page)
+        if n_pixels and page.dpi:
+            # Pages rendered at a different resolution have a different number of pixels.
+            n_pixels *= (self.get_render_dpi(page.dpi) / page.dpi) ** 2
+        return 2 * int(n_pixels) * self._image_format.bpp // 8
+
+    def _process(self, paths, pages=None):
+        jobs = list(self._new_jobs(paths))
+        unopened_jobs = collections.deque(jobs)
+        self._open_journal()
+        if self._metrics is not None:
+            metrics_writer = metrics.Writer(self._metrics, self._options.metrics_file)
+            try:
+                metrics_writer.start()
+            except OSError as ex:
+                errors.fatal(f'cannot write {self._options.metrics_file!r}: {ex.strerror}')
+            # noinspection PyAttributeOutsideInit
+            self._metrics_writer = metrics_writer
+        self._start_executor()
         njobs = self._options.n_jobs
-        thread_limit = utils.get_thread_limit(len(pages), njobs)
-        os.environ['OMP_THREAD_LIMIT'] = str(thread_limit)
+        if self._coordinator is not None:
+            # Keep all the workers busy.
+            njobs = self._coordinator.n_slots
         condition = threading.Condition()
-        threads = [
-            threading.Thread(target=self.page_thread, args=(pages, results, condition))
-            for _ in range(njobs)
-        ]
+        batch_size = self._engine.batch_size
+        if batch_size > 1 and (self._options.executor != 'thread' or self._options.n_render_jobs):
+            LOGGER.warning('Batches of pages are recognized only by the thread executor, without --render-jobs.')
+            batch_size = 1
+        # The number of OpenMP threads for every engine invocation is chosen when its page
+        # (or batch of pages) is started.
+        # noinspection PyAttributeOutsideInit
+        self._thread_allocator = utils.ThreadAllocator(0, njobs)
+        # All pages of all documents share a single queue.
+        tasks = Tasks()
+        # Documents whose pages are queued, but not saved yet:
+        open_jobs = []
+        # Open the next document when fewer pages than this are queued:
+        n_lookahead = 2 * njobs * batch_size
+
+        def open_next_job():
+            job = unopened_jobs.popleft()
+            job_pages = self._open_job(job, pages)
+            self._thread_allocator.add(-(-len(job_pages) // batch_size))
+            open_jobs.append(job)
+            tasks.add(job, job_pages)
+            if not unopened_jobs:
+                tasks.close()
+
+        if self._options.page_order == 'largest-first':
+            # Start with the most expensive pages, so that a few large ones
+            # near the end of the queue don't delay the whole run.
+            # This needs all the documents opened up front.
+            while unopened_jobs:
+                open_next_job()
+            tasks.sort(key=lambda task: self.estimate_page_cost(task[1]), reverse=True)
+        if self._options.n_render_jobs:
+            # Decoding and rendering, OCR, and parsing of OCR results run in separate stages,
+            # so that the OCR engine doesn't wait for DjVuLibre and the other way round.
+            pipeline = Pipeline(self._options.n_render_jobs, njobs, self._options.n_parse_jobs, self._options.prefetch)
+            threads = [
+                threading.Thread(target=self.render_thread, args=(tasks, condition, pipeline))
+                for _ in range(self._options.n_render_jobs)
+            ] + [
+                threading.Thread(target=self.ocr_thread, args=(condition, pipeline))
+                for _ in range(njobs)
+            ] + [
+                threading.Thread(target=self.parse_thread, args=(condition, pipeline))
+                for _ in range(self._options.n_parse_jobs)
+            ]
+        elif self._options.executor == 'asyncio':
+            # A single event loop runs up to njobs pages at the same time.
+            pipeline = None
+            threads = [threading.Thread(target=self.async_thread, args=(tasks, condition))]
+        elif batch_size > 1:
+            pipeline = None
+            threads = [
+                threading.Thread(target=self.page_batch_thread, args=(tasks, condition, batch_size))
+                for _ in range(njobs)
+            ]
+        else:
+            pipeline = None
+            threads = [
+                threading.Thread(target=self.page_thread, args=(tasks, condition))
+                for _ in range(njobs)
+            ]
 
         def stop_threads():
+            if pipeline is not None:
+                pipeline.stopped.set()
+            self._cancel_async_tasks()
+            # No more documents are opened.
+            queued_tasks = tasks.close()
             with condition:
-                for page_ in pages:
+                for job_, page_ in queued_tasks:
                     # Worker threads should not bother with processing other pages.
                     # Mark them as already taken.
-                    results[page_.n] = True
+                    job_.results[page_.n] = True
 
         for thread in threads:
             thread.start()
-        sed_file = self._temp_file('ocrodjvu.djvused', auto_remove=False)
         try:
-            if self._options.clear_text:
-                sed_file.write('remove-txt\n')
-            for page in pages:
-                try:
-                    file_id = page.file.id
-                except UnicodeError:
-                    page_number = page.n + 1
-                    LOGGER.warning(f'warning: cannot convert page {page_number} identifier to locale encoding')
-                    sed_file.write(f'select {page_number}\n')
-                else:
-                    sed_file.write("select '{fileid}'\n".format(
-                        fileid=file_id.replace('\\', '\\\\').replace("'", "\\'")
-                    ))
-                sed_file.write('set-txt\n')
-                result = None  # noqa: F841
+            while open_jobs or unopened_jobs:
                 with condition:
                     while True:
-                        result = results[page.n]
-                        if result is None or result is True:
-                            # Result is not yet available.
-                            condition.wait()
-                            continue
-                        results[page.n] = Ellipsis  # no longer needed
+                        ready = [(job, job.pop_results()) for job in open_jobs]
+                        # Open the next document before the threads run out of pages.
+                        open_next = unopened_jobs and sum(job.n_queued for job in open_jobs) < n_lookahead
+                        if open_next or any(job_results or job.done for job, job_results in ready):
+                            break
+                        condition.wait()
+                for job, job_results in ready:
+                    for page, result in job_results:
                         if isinstance(result, Exception):
                             stop_threads()
-                        break
-                if isinstance(result, Exception):
-                    if len(threads) > 1:
-                        LOGGER.info('Waiting for other threads to finish...')
-                    for thread in threads:
-                        thread.join()
-                    self._debug = True
-                    sys.exit(errors.EXIT_FATAL)
-                if result is False:
-                    # No image suitable for OCR.
-                    pass
-                else:
-                    text_zones.print_sexpr(result, sed_file)
-                result = None  # no longer needed  # noqa: F841
-                sed_file.write('\n.\n\n')
-            sed_file.flush()
-            saver = self._options.saver
-            if saver.in_place:
-                document = None
-            pages_to_save = None
-            if self._options.ocr_only:
-                pages_to_save = [page.n for page in pages]
-            self._options.saver.save(document, pages_to_save, path, sed_file)
-            document = None  # noqa: F841
+                            if len(threads) > 1:
+                                LOGGER.info('Waiting for other threads to finish...')
+                            for thread in threads:
+                                thread.join()
+                            self._debug = True
+                            sys.exit(errors.EXIT_FATAL)
+                        if self._stats is not None:
+                            self._stats.add_wait('write-wait', job.path, page.n)
+                        with self._measure('print', job.path, page):
+                            self.write_page_result(job.sed_file, page, result)
+                    if job.done:
+                        # Save each document as soon as its last page is done,
+                        # without waiting for the other ones, and let it be freed.
+                        open_jobs.remove(job)
+                        self.save_job(job)
+                        job.sed_file.close()
+                        tasks.discard(job)
+                        job.pages = None
+                ready = None  # no longer needed
+                if open_next:
+                    open_next_job()
+            for thread in threads:
+                thread.join()
         except Exception:
             stop_threads()
             raise
         finally:
-            sed_file.close()
-        if results.seen_exception:
+            for job in jobs:
+                if job.sed_file is not None:
+                    job.sed_file.close()
+        if any(job.results.seen_exception for job in jobs):
             sys.exit(errors.EXIT_NONFATAL)
 
     def process(self, *args, **kwargs):
@@ -620,6 +2276,13 @@ class Context(djvu.decode.Context):
             # The djvused script can be valuable and should not be lost in case of crash.
             self._debug = True
             raise
+        finally:
+            self._stop_executor()
+            self._close_journal()
+            if self._metrics_writer is not None:
+                self._metrics_writer.stop()
+            if self._options.stats is not None:
+                self._stats.write(self._options.stats)
 
     def close(self):
         if self._debug:
@@ -628,14 +2291,46 @@ class Context(djvu.decode.Context):
             shutil.rmtree(self._temp_dir)
 
 
+_worker_context = None
+
+
+def _init_worker_context(options, temp_dir):
+    global _worker_context
+    context = Context()
+    context.init(options, temp_dir=temp_dir)
+    _worker_context = context
+
+
+def _process_page_in_worker(path, n, prefix, n_threads):
+    """
+    Return (text, timings) pair for the page.
+    """
+    try:
+        with ipc.thread_environment(OMP_THREAD_LIMIT=str(n_threads)):
+            text = _worker_context.process_page_number(path, n, prefix, n_threads)
+    except KeyboardInterrupt:
+        ipc.interrupt_process_groups()
+        raise
+    timings = {}
+    if _worker_context._stats is not None:
+        timings = _worker_context._stats.pop_page(path, n)
+    return text, timings
+
+
 def main(argv=None):
     argv = argv if argv is not None else sys.argv
     options = ArgumentParser().parse_args(argv[1:])
     context = Context()
     context.init(options)
     try:
-        context.process(options.path, options.pages)
+        if options.listen is not None:
+            context.serve(options.listen)
+        else:
+            context.process(options.paths, options.pages)
     except KeyboardInterrupt:
+        # OCR engines with a time limit run in process groups of their own,
+        # so they didn't get the signal from the terminal.
+        ipc.interrupt_process_groups()
         LOGGER.info('Interrupted by user.')
         sys.exit(errors.EXIT_FATAL)
     finally:
@@ -0,0 +1,372 @@
+# Copyright © 2024 FriedrichFroebel
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+"""
+Distributing OCR of pages between worker processes over sockets.
+
+Every message consists of a JSON header, optionally followed by binary
+payload (such as a rendered page image). Both are preceded by their sizes.
+"""
+
+import collections
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import struct
+import threading
+
+
+PROTOCOL_VERSION = 1
+
+# TCP keepalive: probe an idle connection after a minute,
+# and drop it if the peer doesn't answer 3 probes sent 10 seconds apart.
+KEEPALIVE_IDLE = 60
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 3
+
+_size_struct = struct.Struct('>II')
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class RemoteError(Exception):
+    """
+    Processing of the job failed on the worker side.
+    """
+
+
+class NoWorkersError(Exception):
+
+    def __init__(self):
+        Exception.__init__(self, 'no OCR workers available')
+
+
+def parse_address(address):
+    """
+    Parse the address of a worker, either HOST:PORT or a path of a Unix socket.
+    Return (address family, address) pair.
+    """
+    if os.sep in address or ':' not in address:
+        return socket.AF_UNIX, address
+    host, port = address.rsplit(':', 1)
+    if host.startswith('[') and host.endswith(']'):
+        host = host[1:-1]
+    return socket.AF_INET6 if ':' in host else socket.AF_INET, (host, int(port))
+
+
+def format_address(family, address):
+    if family == socket.AF_UNIX:
+        return address
+    host, port = address[:2]
+    if ':' in host:
+        host = f'[{host}]'
+    return f'{host}:{port}'
+
+
+def _enable_keepalive(sock):
+    """
+    Make the kernel notice when the host on the other end of the TCP
+    connection goes away, even if nothing is being sent.
+    """
+    if sock.family not in {socket.AF_INET, socket.AF_INET6}:
+        return
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for name, value in [
+        ('TCP_KEEPIDLE', KEEPALIVE_IDLE),
+        ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+        ('TCP_KEEPCNT', KEEPALIVE_COUNT),
+    ]:
+        if hasattr(socket, name):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+
+
+def _receive_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise EOFError
+        chunks += [chunk]
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_message(sock, header, payload=b''):
+    header = json.dumps(header).encode('UTF-8')
+    sock.sendall(_size_struct.pack(len(header), len(payload)) + header + payload)
+
+
+def receive_message(sock):
+    """
+    Return (header, payload) pair. Raise EOFError if the connection was
+    closed before the message was received.
+    """
+    header_size, payload_size = _size_struct.unpack(_receive_exactly(sock, _size_struct.size))
+    try:
+        header = json.loads(_receive_exactly(sock, header_size).decode('UTF-8'))
+    except ValueError as ex:
+        raise ProtocolError(f'malformed message header: {ex}')
+    if not isinstance(header, dict):
+        raise ProtocolError('malformed message header')
+    payload = _receive_exactly(sock, payload_size)
+    return header, payload
+
+
+# Worker
+# ======
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        worker = self.server.worker
+        try:
+            _enable_keepalive(self.request)
+            send_message(self.request, dict(version=PROTOCOL_VERSION, options=worker.options_key, jobs=worker.n_jobs))
+        except OSError:
+            return
+        while True:
+            try:
+                header, payload = receive_message(self.request)
+            except (OSError, EOFError, ProtocolError):
+                # The coordinator is gone.
+                return
+            with worker.semaphore:
+                try:
+                    reply = worker.process(header, payload)
+                except Exception as ex:
+                    logger.exception('Exception while processing remote job:')
+                    reply = dict(status='error', message=f'{type(ex).__name__}: {ex}')
+            try:
+                send_message(self.request, reply)
+            except OSError:
+                return
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _TCP6Server(_TCPServer):
+    address_family = socket.AF_INET6
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+else:  # no coverage
+    _UnixServer = None
+
+
+def _remove_stale_socket(path):
+    """
+    Remove the Unix socket left by a worker that was killed.
+    """
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return
+    except FileNotFoundError:
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+class Worker:
+    """
+    Server accepting OCR jobs from coordinators.
+
+    `process` is called with (header, payload) of every job and must return
+    the reply header. At most `n_jobs` jobs are processed at the same time.
+    `options_key` identifies the OCR options of the worker; coordinators
+    refuse workers with options different from their own.
+    """
+
+    def __init__(self, address, process, options_key, n_jobs=1):
+        self.process = process
+        self.options_key = options_key
+        self.n_jobs = n_jobs
+        self.semaphore = threading.BoundedSemaphore(n_jobs)
+        family, address = parse_address(address)
+        if family == socket.AF_UNIX:
+            _remove_stale_socket(address)
+        server_type = {
+            socket.AF_UNIX: _UnixServer,
+            socket.AF_INET: _TCPServer,
+            socket.AF_INET6: _TCP6Server,
+        }[family]
+        self._server = server_type(address, _RequestHandler)
+        self._server.worker = self
+        self._family = family
+
+    @property
+    def address(self):
+        return format_address(self._family, self._server.server_address)
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def shutdown(self):
+        self._server.shutdown()
+
+    def close(self):
+        self._server.server_close()
+        if self._family == socket.AF_UNIX:
+            try:
+                os.unlink(self._server.server_address)
+            except FileNotFoundError:
+                pass
+
+
+# Coordinator
+# ===========
+
+class _RemoteWorker:
+
+    def __init__(self, address):
+        self.address = address
+        self.lost = False
+
+
+class Coordinator:
+    """
+    Pool of connections to workers.
+
+    Every worker gets as many connections as the number of jobs it accepts.
+    If a worker is lost, the job is sent to another one. A worker is also
+    considered lost if it doesn't reply within `timeout` seconds.
+    """
+
+    def __init__(self, addresses, options_key, timeout=None):
+        self._condition = threading.Condition()
+        self._idle = collections.deque()
+        self._timeout = timeout
+        self._n_alive = 0
+        self.n_slots = 0
+        for address in addresses:
+            worker = _RemoteWorker(address)
+            try:
+                self._connect_worker(worker, options_key)
+            except (OSError, EOFError, ProtocolError, ValueError) as ex:
+                logger.warning(f'warning: cannot use OCR worker {address}: {ex or type(ex).__name__}')
+                continue
+            self._n_alive += 1
+        if not self._n_alive:
+            raise NoWorkersError
+
+    def _connect(self, worker):
+        family, address = parse_address(worker.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self._timeout)
+            sock.connect(address)
+            _enable_keepalive(sock)
+            hello, _ = receive_message(sock)
+        except BaseException:
+            sock.close()
+            raise
+        return sock, hello
+
+    def _connect_worker(self, worker, options_key):
+        sock, hello = self._connect(worker)
+        connections = [(worker, sock)]
+        try:
+            if hello.get('version') != PROTOCOL_VERSION:
+                raise ProtocolError(f'unsupported protocol version {hello.get("version")!r}')
+            if hello.get('options') != options_key:
+                raise ProtocolError('the worker uses different OCR options')
+            n_jobs = max(1, int(hello.get('jobs', 1)))
+            for _ in range(n_jobs - 1):
+                connections += [(worker, self._connect(worker)[0])]
+        except BaseException:
+            for _, sock in connections:
+                sock.close()
+            raise
+        self._idle.extend(connections)
+        self.n_slots += len(connections)
+
+    def _take(self):
+        with self._condition:
+            while True:
+                if not self._n_alive:
+                    raise NoWorkersError
+                while self._idle:
+                    worker, sock = self._idle.popleft()
+                    if worker.lost:
+                        sock.close()
+                        continue
+                    return worker, sock
+                self._condition.wait()
+
+    def _give_back(self, worker, sock):
+        with self._condition:
+            self._idle.append((worker, sock))
+            self._condition.notify()
+
+    def _lose(self, worker, sock, ex):
+        sock.close()
+        with self._condition:
+            if worker.lost:
+                return
+            worker.lost = True
+            self._n_alive -= 1
+            logger.warning(f'warning: lost OCR worker {worker.address}: {ex or type(ex).__name__}')
+            self._condition.notify_all()
+
+    def submit(self, header, payload=b''):
+        """
+        Send the job to a free worker and return the reply header.
+        Jobs sent to workers that are lost in the meantime are sent again.
+        """
+        while True:
+            worker, sock = self._take()
+            try:
+                send_message(sock, header, payload)
+                reply, _ = receive_message(sock)
+            except (OSError, EOFError, ProtocolError) as ex:
+                self._lose(worker, sock, ex)
+                continue
+            self._give_back(worker, sock)
+            if reply.get('status') == 'error':
+                raise RemoteError(f'{worker.address}: {reply.get("message")}')
+            return reply
+
+    def close(self):
+        with self._condition:
+            for _, sock in self._idle:
+                sock.close()
+            self._idle.clear()
+
+
+logger = logging.getLogger('ocrodjvu.main.distributed')
+
+
+__all__ = [
+    'Coordinator',
+    'NoWorkersError',
+    'ProtocolError',
+    'RemoteError',
+    'Worker',
+    'parse_address',
+    'receive_message',
+    'send_message',
+]
@@ -12,7 +12,11 @@
 # FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
 # for more details.
 
+import asyncio
+import functools
 import io
+import os
+import shutil
 
 from ocrodjvu import utils
 from ocrodjvu import image_io
@@ -23,6 +27,10 @@ class Engine:
     image_format = None
     needs_utf8_fix = False
     default_language = 'eng'
+    # Number of pages to be recognized by a single invocation of recognize_batch():
+    batch_size = 1
+    # Whether the engine reads images itself rather than passing their paths to a subprocess:
+    in_process = False
 
     def __init__(self, *args, **kwargs):
         type_name = f'{self.__module__}.{type(self).__name__}'
@@ -40,7 +48,56 @@ class Engine:
             except AttributeError as ex:
                 ex.args = (f'{key!r} is not a valid property for the {self.name} engine',)
                 raise
-            setattr(self, key, value)
+            try:
+                setattr(self, key, value)
+            except ValueError as ex:
+                ex.args = (f'invalid value {value!r} for the {key!r} property of the {self.name} engine',)
+                raise
+        self._properties = dict(kwargs)
+
+    def __reduce__(self):
+        # Engine instances are not picklable as such (they store property values
+        # under per-process names and may hold references to modules), so
+        # re-create them from the properties they were configured with.
+        return functools.partial(type(self), **self._properties), ()
+
+    def recognize_batch(self, images, language, details=None, uax29=None):
+        """
+        Recognize many images at once; return a list of outputs, one for every image.
+
+        Engines that can't recognize many images in a single run recognize
+        them one by one.
+        """
+        return [self.recognize(image, language, details=details, uax29=uax29) for image in images]
+
+    async def recognize_async(self, image, language, details=None, uax29=None):
+        """
+        Asynchronous variant of `recognize()`.
+
+        Engines that don't implement it on top of `ipc.run_async()` fall back
+        to running `recognize()` in a separate thread.
+        """
+        return await asyncio.to_thread(self.recognize, image, language, details=details, uax29=uax29)
+
+    def get_identity(self, language):
+        """
+        Return a list of strings that change whenever the engine (or its data
+        files for the language) is replaced, so that cached results of
+        another version are not reused.
+        """
+        identity = [self.name]
+        executable = getattr(self, 'executable', None)
+        if executable is not None:
+            identity += [_get_file_identity(shutil.which(executable) or executable)]
+        return identity
+
+
+def _get_file_identity(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return path
+    return f'{os.path.realpath(path)}:{stat.st_size}:{stat.st_mtime_ns}'
 
 
 class Output:
@@ -59,6 +116,18 @@ class Output:
     def __bytes__(self):
         return self._contents
 
+    @property
+    def contents(self):
+        return self._contents
+
+    def save(self, prefix):
+        path = f'{prefix}.{self.format}'
+        contents = self._contents
+        if isinstance(contents, str):
+            contents = contents.encode('UTF-8')
+        with open(path, 'wb') as file:
+            file.write(contents)
+
     def as_stringio(self):
         return io.StringIO(str(self))
 
@@ -143,28 +143,41 @@ class Engine(common.Engine):
         language = self.cuneiform_to_iso(language)
         return language
 
+    def _get_commandline(self, image, language, hocr_file_name):
+        return [
+            self.executable,
+            '-l', self.user_to_cuneiform(language),
+            '-f', 'hocr',
+            '-o', hocr_file_name
+        ] + self.extra_args + [image.name]
+
+    @staticmethod
+    def _read_output(hocr_file_name):
+        with open(hocr_file_name, 'r') as hocr_file:
+            return common.Output(
+                hocr_file.read(),
+                format_='html',
+            )
+
     def recognize(self, image, language, *args, **kwargs):
         with temporary.directory() as hocr_directory:
             # A separate non-world-writable directory is needed, as Cuneiform
             # can create additional files, e.g. images.
             hocr_file_name = os.path.join(hocr_directory, 'ocr.html')
             with ipc.Subprocess(
-                    [
-                        self.executable,
-                        '-l', self.user_to_cuneiform(language),
-                        '-f', 'hocr',
-                        '-o', hocr_file_name
-                    ] + self.extra_args + [image.name],
+                    self._get_commandline(image, language, hocr_file_name),
                     stdin=ipc.DEVNULL,
                     stdout=ipc.DEVNULL,
             ):
                 # Implicitly call `wait()` on `__exit__`.
                 pass
-            with open(hocr_file_name, 'r') as hocr_file:
-                return common.Output(
-                    hocr_file.read(),
-                    format_='html',
-                )
+            return self._read_output(hocr_file_name)
+
+    async def recognize_async(self, image, language, *args, **kwargs):
+        with temporary.directory() as hocr_directory:
+            hocr_file_name = os.path.join(hocr_directory, 'ocr.html')
+            await ipc.run_async(self._get_commandline(image, language, hocr_file_name))
+            return self._read_output(hocr_file_name)
 
     def extract_text(self, *args, **kwargs):
         return self._hocr.extract_text(*args, **kwargs)
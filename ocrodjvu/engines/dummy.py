@@ -30,6 +30,9 @@ class Engine(common.Engine):
     def recognize(self, image, language, details=None, uax29=None):
         return common.Output('', format_='dummy')
 
+    async def recognize_async(self, image, language, details=None, uax29=None):
+        return self.recognize(image, language, details=details, uax29=uax29)
+
     def extract_text(self, stream, **kwargs):
         bbox = text_zones.BBox(0, 0, 0, 0)
         page = text_zones.Zone(text_zones.const.TEXT_ZONE_PAGE, bbox, [])
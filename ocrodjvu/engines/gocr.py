@@ -147,9 +147,12 @@ class Engine(common.Engine):
     def list_languages(self):
         yield self.default_language
 
+    def _get_commandline(self, image):
+        return [self.executable, '-i', image.name, '-f', 'XML'] + self.extra_args
+
     def recognize(self, image, language, details=None, uax29=None):
         with ipc.Subprocess(
-                [self.executable, '-i', image.name, '-f', 'XML'] + self.extra_args,
+                self._get_commandline(image),
                 stdin=ipc.DEVNULL,
                 stdout=ipc.PIPE,
         ) as worker:
@@ -158,6 +161,13 @@ class Engine(common.Engine):
                 format_='gocr.xml',
             )
 
+    async def recognize_async(self, image, language, details=None, uax29=None):
+        stdout, _ = await ipc.run_async(self._get_commandline(image), stdout=ipc.PIPE)
+        return common.Output(
+            stdout,
+            format_='gocr.xml',
+        )
+
     def extract_text(self, stream, **kwargs):
         settings = ExtractSettings(**kwargs)
         stream = etree.iterparse(stream)
@@ -155,12 +155,15 @@ class Engine(common.Engine):
     def list_languages(self):
         return iter(self._languages)
 
-    def recognize(self, image, language, details=None, uax29=None):
+    def _get_commandline(self, image, language):
         charset = 'iso-8859-15'
         if language == 'tur':
             charset = 'iso-8859-9'
+        return [self.executable, '--charset', charset, '--format=utf8', '-x'] + self.extra_args + ['-', image.name]
+
+    def recognize(self, image, language, details=None, uax29=None):
         with ipc.Subprocess(
-                [self.executable, '--charset', charset, '--format=utf8', '-x'] + self.extra_args + ['-', image.name],
+                self._get_commandline(image, language),
                 stdin=ipc.DEVNULL,
                 stdout=ipc.PIPE,
         ) as worker:
@@ -170,6 +173,13 @@ class Engine(common.Engine):
                 format_='orf',
             )
 
+    async def recognize_async(self, image, language, details=None, uax29=None):
+        stdout, _ = await ipc.run_async(self._get_commandline(image, language), stdout=ipc.PIPE)
+        return common.Output(
+            stdout.decode(sys.stdout.encoding or locale.getpreferredencoding()),
+            format_='orf',
+        )
+
     def extract_text(self, stream, **kwargs):
         settings = ExtractSettings(**kwargs)
         settings.replacement_character = self.replacement_character
@@ -20,6 +20,7 @@ import os
 import re
 import shlex
 import sys
+import threading
 import warnings
 
 from ocrodjvu.engines import common
@@ -39,6 +40,9 @@ _ERROR_PATTERN = re.compile(
     r"^(Error openn?ing data|Unable to load unicharset) file (?P<dir>/.*)/nonexistent[.](?P<ext>[a-z]+)$",
     re.MULTILINE
 )
+_VERSION_PATTERN = re.compile(r'^tesseract\s+v?(\d+)[.](\d+)', re.MULTILINE)
+_PAGE_NUMBER_PATTERN = re.compile(r'^Page [0-9]+(?: : .*)?$')
+_HOCR_PAGE_PATTERN = re.compile(r'''<div\s+class=['"]ocr_page['"]''')
 
 _BBOX_EXTRAS_TEMPLATE = '''\
 <!-- The following script was appended to hOCR by ocrodjvu for internal purposes. -->
@@ -56,26 +60,58 @@ def _filter_boring_stderr(stderr):
     if stderr[0].startswith('Tesseract Open Source OCR Engine'):
         # Tesseract prints its own name on standard error even if nothing went wrong.
         del stderr[0]
-    if stderr and stderr[0] == 'Page 1':
-        # We also don't want page numbers, because we always pass just a single page to Tesseract.
-        del stderr[0]
+    # We also don't want page numbers: they are printed for batches of pages.
+    stderr[:] = [line for line in stderr if not _PAGE_NUMBER_PATTERN.match(line)]
 
 
-def _wait_for_worker(worker):
-    stderr = codecs.getreader(sys.stderr.encoding or locale.getpreferredencoding())(worker.stderr)
-    stderr = stderr.read().splitlines()
+def _print_stderr(stderr, failed=False):
+    if isinstance(stderr, bytes):
+        stderr = stderr.decode(sys.stderr.encoding or locale.getpreferredencoding())
+    stderr = (stderr or '').splitlines()
+    if not failed:
+        _filter_boring_stderr(stderr)
+    for line in stderr:
+        print(f'tesseract: {line}', file=sys.stderr)
 
-    def print_errors():
-        for line in stderr:
-            print(f'tesseract: {line}', file=sys.stderr)
 
+def _wait_for_worker(worker):
+    # Read standard error in a separate thread, so that neither of the pipes fills up.
+    stderr = []
+    thread = threading.Thread(target=lambda: stderr.append(worker.stderr.read()))
+    thread.start()
+    try:
+        stdout = worker.stdout.read()
+    finally:
+        thread.join()
+    [stderr] = stderr
     try:
         worker.wait()
     except Exception:
-        print_errors()
+        _print_stderr(stderr, failed=True)
         raise
-    _filter_boring_stderr(stderr)
-    print_errors()
+    _print_stderr(stderr)
+    return stdout
+
+
+def _needs_character_details(details, uax29):
+    # Character boxes come from hOCR or the box file; words are split on their own with UAX #29.
+    return details < text_zones.TEXT_DETAILS_WORD or (uax29 and details <= text_zones.TEXT_DETAILS_WORD)
+
+
+def split_hocr(contents):
+    """
+    Split hOCR document with many pages into documents with a single page each.
+    """
+    starts = [match.start() for match in _HOCR_PAGE_PATTERN.finditer(contents)]
+    end = contents.rfind('</body>')
+    if not starts or end < starts[-1]:
+        raise errors.MalformedHocrError('cannot find pages')
+    head = contents[:starts[0]]
+    tail = contents[end:]
+    return [
+        head + contents[start:stop].rstrip() + '\n' + tail
+        for start, stop in zip(starts, starts[1:] + [end])
+    ]
 
 
 def fix_html(s):
@@ -117,6 +153,9 @@ class Engine(common.Engine):
     executable = utils.Property('tesseract')
     extra_args = utils.Property([], shlex.split)
     use_hocr = utils.Property(None, int)
+    use_stdout = utils.Property(None, int)
+    use_char_boxes = utils.Property(None, int)
+    batch_size = utils.Property(1, utils.positive_int)
     fix_html = utils.Property(0, int)
 
     def __init__(self, *args, **kwargs):
@@ -133,6 +172,15 @@ class Engine(common.Engine):
             self._hocr = hocr
         else:
             self._hocr = None
+        version = None
+        if self.use_stdout is None or self.use_char_boxes is None:
+            version = self.get_version()
+        if self.use_stdout is None:
+            # Tesseract ≥ 3.03 can write its output to stdout.
+            self.use_stdout = version is not None and version >= (3, 3)
+        if self.use_char_boxes is None:
+            # Tesseract ≥ 4.1 can write bounding boxes of characters into hOCR.
+            self.use_char_boxes = version is not None and version >= (4, 1)
         self._user_to_tesseract = None  # To be defined later.
         self._languages = list(self._get_languages())
 
@@ -171,6 +219,31 @@ class Engine(common.Engine):
 
         return directory, extension
 
+    def get_version(self):
+        """
+        Return version of Tesseract as a tuple of integers, or None if it's not known.
+        """
+        try:
+            with ipc.Subprocess(
+                    [self.executable, '--version'],
+                    stdin=ipc.DEVNULL,
+                    stdout=ipc.PIPE,
+                    # Tesseract < 4 prints its version on standard error.
+                    stderr=ipc.STDOUT,
+            ) as tesseract:
+                output = codecs.getreader(sys.stdout.encoding or locale.getpreferredencoding())(tesseract.stdout, errors='replace')
+                output = output.read()
+                try:
+                    tesseract.wait()
+                except ipc.CalledProcessError:
+                    return None
+        except OSError:
+            return None
+        match = _VERSION_PATTERN.search(output)
+        if match is None:
+            return None
+        return tuple(map(int, match.groups()))
+
     def list_languages(self):
         return iter(self._languages)
 
@@ -213,25 +286,43 @@ class Engine(common.Engine):
     def check_language(self, language):
         self.user_to_tesseract(language)
 
-    def recognize_plain_text(self, image, language, details=None, uax29=None):
+    def get_identity(self, language):
+        identity = common.Engine.get_identity(self, language)
+        for code in self.user_to_tesseract(language).split('+'):
+            path = os.path.join(self._directory, f'{code}.{self._extension}')
+            identity += [common._get_file_identity(path)]
+        return identity
+
+    @staticmethod
+    def _decode_stdout(stdout):
+        # The same encoding as for files opened in text mode.
+        return stdout.decode(locale.getpreferredencoding(False))
+
+    def _recognize_plain_text(self, image, language, details=None, uax29=None):
+        # Generator yielding command lines to run (and receiving their stdout), and returning the output.
         language = self.user_to_tesseract(language)
+        if self.use_stdout:
+            stdout = yield [self.executable, image.name, 'stdout', '-l', language] + self.extra_args
+            return common.Output(
+                self._decode_stdout(stdout),
+                format_='txt',
+            )
         with temporary.directory() as output_dir:
-            with ipc.Subprocess(
-                    [self.executable, image.name, os.path.join(output_dir, 'tmp'), '-l', language] + self.extra_args,
-                    stdin=ipc.DEVNULL,
-                    stdout=ipc.DEVNULL,
-                    stderr=ipc.PIPE,
-            ) as worker:
-                _wait_for_worker(worker)
+            yield [self.executable, image.name, os.path.join(output_dir, 'tmp'), '-l', language] + self.extra_args
             with open(os.path.join(output_dir, 'tmp.txt'), 'rt') as file:
                 return common.Output(
                     file.read(),
                     format_='txt',
                 )
 
-    def recognize_hocr(self, image, language, details=text_zones.TEXT_DETAILS_WORD, uax29=None):
-        language = self.user_to_tesseract(language)
-        character_details = details < text_zones.TEXT_DETAILS_WORD or (uax29 and details <= text_zones.TEXT_DETAILS_WORD)
+    def _get_char_box_args(self, character_details):
+        # Tesseract ≥ 4.1 can write boxes of characters into hOCR, as ocrx_cinfo elements.
+        if character_details and self.use_char_boxes:
+            return ['-c', 'hocr_char_boxes=1']
+        return []
+
+    def _recognize_hocr_to_files(self, image, language, character_details):
+        # Generator yielding command lines to run, and returning the hOCR contents.
         with temporary.directory() as output_dir:
             tessconf_path = os.path.join(output_dir, 'tessconf')
             with open(tessconf_path, 'wt') as tessconf:
@@ -241,40 +332,44 @@ class Engine(common.Engine):
             commandline = [
                 self.executable, image.name, os.path.join(output_dir, 'tmp'),
                 '-l', language
-            ] + self.extra_args + [tessconf_path]
-            if character_details:
+            ] + self.extra_args + self._get_char_box_args(character_details) + [tessconf_path]
+            # Tesseract < 4.1 writes boxes of characters only to a box file.
+            makebox = character_details and not self.use_char_boxes
+            if makebox:
                 commandline += ['makebox']
-            with ipc.Subprocess(
-                    commandline,
-                    stdin=ipc.DEVNULL,
-                    stdout=ipc.DEVNULL,
-                    stderr=ipc.PIPE,
-            ) as worker:
-                _wait_for_worker(worker)
+            yield commandline
             hocr_path = os.path.join(output_dir, 'tmp.hocr')
             if not os.path.exists(hocr_path):
                 hocr_path = hocr_path[:-4] + 'html'
             with open(os.path.join(output_dir, hocr_path), 'r') as hocr_file:
                 contents = hocr_file.read()
-            if character_details:
+            if makebox:
                 assert commandline[-1] == 'makebox'
                 assert commandline[-2] == tessconf_path
                 box_path = os.path.join(output_dir, 'tmp.box')
                 if not os.path.exists(box_path):
                     # Tesseract << 3.04
                     del commandline[-2]
-                    with ipc.Subprocess(
-                            commandline,
-                            stdin=ipc.DEVNULL,
-                            stdout=ipc.DEVNULL,
-                            stderr=ipc.PIPE,
-                    ) as worker:
-                        _wait_for_worker(worker)
+                    yield commandline
                 with open(box_path, 'r') as box_file:
                     contents = contents.replace(
                         '</body>',
                         _BBOX_EXTRAS_TEMPLATE.format(box_file.read()) + '</body>'
                     )
+        return contents
+
+    def _recognize_hocr(self, image, language, details=text_zones.TEXT_DETAILS_WORD, uax29=None):
+        # Generator yielding command lines to run (and receiving their stdout), and returning the output.
+        language = self.user_to_tesseract(language)
+        character_details = _needs_character_details(details, uax29)
+        if self.use_stdout and (self.use_char_boxes or not character_details):
+            # The box file can't be written to stdout together with hOCR.
+            stdout = yield [
+                self.executable, image.name, 'stdout', '-l', language
+            ] + self.extra_args + self._get_char_box_args(character_details) + ['hocr']
+            contents = self._decode_stdout(stdout)
+        else:
+            contents = yield from self._recognize_hocr_to_files(image, language, character_details)
         if self.fix_html:
             contents = fix_html(contents)
         return common.Output(
@@ -282,13 +377,92 @@ class Engine(common.Engine):
             format_='html',
         )
 
-    def recognize(self, image, language, details=None, uax29=None):
+    def _recognize_batch(self, images, language, details=None, uax29=None):
+        # Generator yielding the command line to run (and receiving its stdout), and returning the outputs.
+        language = self.user_to_tesseract(language)
+        with temporary.file(mode='wt', suffix='.txt') as list_file:
+            # Tesseract recognizes all the images listed in a text file.
+            for image in images:
+                print(image.name, file=list_file)
+            list_file.flush()
+            commandline = [self.executable, list_file.name, 'stdout', '-l', language] + self.extra_args
+            if self._hocr is not None:
+                commandline += self._get_char_box_args(_needs_character_details(details, uax29)) + ['hocr']
+            stdout = yield commandline
+        contents = self._decode_stdout(stdout)
         if self._hocr is None:
-            f = self.recognize_plain_text
+            # Pages of plain text are terminated by form feeds.
+            pages = contents.split('\f')
+            if pages[-1].strip() == '':
+                del pages[-1]
         else:
-            f = self.recognize_hocr
+            pages = split_hocr(contents)
+            if self.fix_html:
+                pages = [fix_html(page) for page in pages]
+        if len(pages) != len(images):
+            raise errors.MalformedOcrOutputError(f'expected {len(images)} pages, got {len(pages)}')
+        format_ = 'txt' if self._hocr is None else 'html'
+        return [common.Output(page, format_=format_) for page in pages]
+
+    def _can_batch(self, details, uax29):
+        if not self.use_stdout:
+            return False
+        if self._hocr is None:
+            return True
+        # The box file can't be written to stdout together with hOCR,
+        # but boxes of characters in hOCR can.
+        return self.use_char_boxes or not _needs_character_details(details, uax29)
+
+    def recognize_batch(self, images, language, details=None, uax29=None):
+        if len(images) < 2 or not self._can_batch(details, uax29):
+            return common.Engine.recognize_batch(self, images, language, details=details, uax29=uax29)
+        return self._run_steps(self._recognize_batch(images, language, details=details, uax29=uax29))
+
+    def _get_steps(self, image, language, details=None, uax29=None):
+        if self._hocr is None:
+            f = self._recognize_plain_text
+        else:
+            f = self._recognize_hocr
         return f(image, language, details=details, uax29=uax29)
 
+    def recognize(self, image, language, details=None, uax29=None):
+        return self._run_steps(self._get_steps(image, language, details=details, uax29=uax29))
+
+    @staticmethod
+    def _run_steps(steps):
+        try:
+            commandline = next(steps)
+            while True:
+                with ipc.Subprocess(
+                        commandline,
+                        stdin=ipc.DEVNULL,
+                        stdout=ipc.PIPE,
+                        stderr=ipc.PIPE,
+                ) as worker:
+                    stdout = _wait_for_worker(worker)
+                commandline = steps.send(stdout)
+        except StopIteration as ex:
+            return ex.value
+        finally:
+            steps.close()
+
+    async def recognize_async(self, image, language, details=None, uax29=None):
+        steps = self._get_steps(image, language, details=details, uax29=uax29)
+        try:
+            commandline = next(steps)
+            while True:
+                try:
+                    stdout, stderr = await ipc.run_async(commandline, stdout=ipc.PIPE, stderr=ipc.PIPE)
+                except ipc.CalledProcessError as ex:
+                    _print_stderr(ex.stderr, failed=True)
+                    raise
+                _print_stderr(stderr)
+                commandline = steps.send(stdout)
+        except StopIteration as ex:
+            return ex.value
+        finally:
+            steps.close()
+
     def extract_text(self, stream, **kwargs):
         if self._hocr is not None:
             return self._hocr.extract_text(stream, **kwargs)
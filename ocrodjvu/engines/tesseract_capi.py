@@ -0,0 +1,431 @@
+# Copyright © 2024 FriedrichFroebel
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+"""
+Tesseract running in-process, through its C API[0].
+
+[0] https://github.com/tesseract-ocr/tesseract/blob/main/include/tesseract/capi.h
+"""
+
+import ctypes
+import ctypes.util
+import functools
+import os
+import threading
+
+from ocrodjvu.engines import common
+from ocrodjvu.engines import tesseract
+from ocrodjvu import errors
+from ocrodjvu import image_io
+from ocrodjvu import text_zones
+from ocrodjvu import unicode_support
+from ocrodjvu import utils
+
+
+const = text_zones.const
+sexpr = text_zones.sexpr
+
+# TessPageIteratorLevel:
+RIL_BLOCK = 0
+RIL_PARA = 1
+RIL_TEXTLINE = 2
+RIL_WORD = 3
+RIL_SYMBOL = 4
+
+# Resolution reported to Tesseract for images of unknown resolution:
+DEFAULT_RESOLUTION = 300
+
+# Text zones for the iterator levels, the same as for Tesseract's hOCR:
+_ZONE_TYPES = [
+    const.TEXT_ZONE_COLUMN,
+    const.TEXT_ZONE_PARAGRAPH,
+    const.TEXT_ZONE_LINE,
+    const.TEXT_ZONE_WORD,
+    const.TEXT_ZONE_CHARACTER,
+]
+
+_c_int_p = ctypes.POINTER(ctypes.c_int)
+
+_PROTOTYPES = dict(
+    TessVersion=(ctypes.c_char_p, []),
+    TessDeleteText=(None, [ctypes.c_void_p]),
+    TessDeleteTextArray=(None, [ctypes.c_void_p]),
+    TessBaseAPICreate=(ctypes.c_void_p, []),
+    TessBaseAPIDelete=(None, [ctypes.c_void_p]),
+    TessBaseAPIEnd=(None, [ctypes.c_void_p]),
+    TessBaseAPIInit3=(ctypes.c_int, [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p]),
+    TessBaseAPIGetDatapath=(ctypes.c_char_p, [ctypes.c_void_p]),
+    TessBaseAPIGetAvailableLanguagesAsVector=(ctypes.POINTER(ctypes.c_char_p), [ctypes.c_void_p]),
+    TessBaseAPISetImage=(None, [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int]),
+    TessBaseAPISetSourceResolution=(None, [ctypes.c_void_p, ctypes.c_int]),
+    TessBaseAPIRecognize=(ctypes.c_int, [ctypes.c_void_p, ctypes.c_void_p]),
+    TessBaseAPIGetIterator=(ctypes.c_void_p, [ctypes.c_void_p]),
+    TessBaseAPIClear=(None, [ctypes.c_void_p]),
+    TessResultIteratorDelete=(None, [ctypes.c_void_p]),
+    TessResultIteratorNext=(ctypes.c_int, [ctypes.c_void_p, ctypes.c_int]),
+    TessResultIteratorGetPageIterator=(ctypes.c_void_p, [ctypes.c_void_p]),
+    # The text has to be freed with TessDeleteText(), so don't let ctypes convert it:
+    TessResultIteratorGetUTF8Text=(ctypes.c_void_p, [ctypes.c_void_p, ctypes.c_int]),
+    TessPageIteratorIsAtBeginningOf=(ctypes.c_int, [ctypes.c_void_p, ctypes.c_int]),
+    TessPageIteratorBoundingBox=(ctypes.c_int, [ctypes.c_void_p, ctypes.c_int, _c_int_p, _c_int_p, _c_int_p, _c_int_p]),
+)
+
+
+def load_library(name):
+    """
+    Load libtesseract, and declare the functions used.
+    Raise OSError if the library (or any of the functions) is not available.
+    """
+    # Unlike with ctypes.PyDLL, the GIL is released while the functions run.
+    library = ctypes.CDLL(name)
+    for function_name, (restype, argtypes) in _PROTOTYPES.items():
+        try:
+            function = getattr(library, function_name)
+        except AttributeError as ex:
+            raise OSError(f'{name}: {ex}')
+        function.restype = restype
+        function.argtypes = argtypes
+    return library
+
+
+def _get_default_library():
+    return ctypes.util.find_library('tesseract') or 'libtesseract.so.5'
+
+
+class PNM(image_io.PNM):
+    """
+    Raw PBM or PPM, with the resolution of the page in a header comment.
+    """
+
+    def _get_header(self, size, page_job):
+        header = image_io.PNM._get_header(self, size, page_job)
+        if not page_job.dpi:
+            return header
+        magic, rest = header.split(' ', 1)
+        return f'{magic}\n# resolution {page_job.dpi}\n{rest}'
+
+
+def read_pnm(data):
+    """
+    Parse the raw PBM/PGM/PPM image.
+    Return (width, height, bytes per pixel, pixel data, resolution), as expected by TessBaseAPISetImage();
+    that is, 0 bytes per pixel for bitonal images, with 1 meaning white.
+    The resolution is None, unless it's given in a comment (see PNM).
+    """
+    n_fields = 3 if data[:2] == b'P4' else 4
+    fields = []
+    resolution = None
+    i = 0
+    while len(fields) < n_fields:
+        while data[i:i + 1].isspace():
+            i += 1
+        if data[i:i + 1] == b'#':
+            j = data.index(b'\n', i)
+            comment = data[i + 1:j].split()
+            if len(comment) == 2 and comment[0] == b'resolution' and comment[1].isdigit():
+                resolution = int(comment[1])
+            i = j
+            continue
+        j = i
+        while j < len(data) and not data[j:j + 1].isspace():
+            j += 1
+        if i == j:
+            raise ValueError('truncated PNM header')
+        fields += [data[i:j]]
+        i = j
+    # A single whitespace character separates the header from the pixels.
+    pixels = data[i + 1:]
+    magic = fields[0]
+    width, height = map(int, fields[1:3])
+    if magic == b'P4':
+        # In PBM, 1 means black.
+        return width, height, 0, pixels.translate(_INVERT_BITS), resolution
+    if magic == b'P5':
+        return width, height, 1, pixels, resolution
+    if magic == b'P6':
+        return width, height, 3, pixels, resolution
+    raise ValueError(f'unsupported image format: {magic!r}')
+
+
+_INVERT_BITS = bytes(range(255, -1, -1))
+
+
+def build_zones(records, leaf_level):
+    """
+    Build text zones out of (level, bbox, text) triples, one for every
+    element at the leaf level, in the order of Tesseract's iterator.
+    `level` is the outermost level of the iterator that begins at the element.
+    Elements without text are skipped.
+    Return the list of the outermost zones.
+    """
+    result = []
+    path = []  # (zone, bbox) pairs of the zones being built, from the outermost one
+
+    def close(level):
+        for zone, bbox in path[level:]:
+            zone.bbox = bbox
+        del path[level:]
+
+    pending_level = leaf_level
+    for level, (x0, y0, x1, y1), text in records:
+        pending_level = min(pending_level, level)
+        if not text or text.isspace():
+            continue
+        close(pending_level)
+        pending_level = leaf_level
+        while len(path) < leaf_level:
+            zone = text_zones.Zone(_ZONE_TYPES[len(path)])
+            (path[-1][0].children if path else result).append(zone)
+            path += [(zone, text_zones.BBox())]
+        leaf = text_zones.Zone(_ZONE_TYPES[leaf_level], text_zones.BBox(x0, y0, x1, y1), [text])
+        (path[-1][0].children if path else result).append(leaf)
+        for _, bbox in path:
+            bbox.update(leaf.bbox)
+    close(0)
+    return result
+
+
+def _join_lines(zone):
+    """
+    Replace the words of every line with the text of the line.
+    """
+    if zone.type == const.TEXT_ZONE_LINE:
+        zone.children = [str.join(' ', (word[0] for word in zone))]
+        return
+    for child in zone:
+        _join_lines(child)
+
+
+class ExtractSettings:
+
+    def __init__(self, rotation=0, details=text_zones.TEXT_DETAILS_WORD, uax29=None, page_size=None, **kwargs):
+        self.rotation = rotation
+        self.details = details
+        if uax29 is not None:
+            icu = unicode_support.get_icu()
+            if uax29 is True:
+                uax29 = icu.Locale('en-US-POSIX')
+            else:
+                uax29 = icu.Locale(uax29)
+        self.uax29 = uax29
+        self.page_size = page_size
+
+
+def _get_zone(value):
+    if isinstance(value, str):
+        return value
+    type_, x0, y0, x1, y1, *children = value
+    return text_zones.Zone(
+        const.get_text_zone_type(type_),
+        text_zones.BBox(x0, y0, x1, y1),
+        [_get_zone(child) for child in children if child != ''],
+    )
+
+
+def _regroup_words(zone, settings, word_break_iterator):
+    if zone.type != const.TEXT_ZONE_LINE:
+        for child in zone:
+            _regroup_words(child, settings, word_break_iterator)
+        return
+    characters = []
+    for word in zone:
+        if characters:
+            # The space separates the words; group_words() doesn't look at its bounding box.
+            characters += [text_zones.Zone(const.TEXT_ZONE_CHARACTER, word.bbox, [' '])]
+        characters += word.children
+    zone.children = text_zones.group_words(characters, settings.details, word_break_iterator)
+
+
+def extract_text(stream, **kwargs):
+    """
+    Extract DjVu text from the output of the engine: the page zone expression,
+    in coordinates of the image (with y measured from the top).
+    """
+    settings = ExtractSettings(**kwargs)
+    page = _get_zone(sexpr.Expression.from_string(stream.read()).value)
+    if settings.uax29 is not None and settings.details <= text_zones.TEXT_DETAILS_WORD:
+        word_break_iterator = functools.partial(unicode_support.word_break_iterator, locale=settings.uax29)
+        _regroup_words(page, settings, word_break_iterator)
+    page.rotate(settings.rotation)
+    return [page.sexpr]
+
+
+class _API:
+    """
+    Initialized TessBaseAPI.
+    """
+
+    def __init__(self, library, datapath, language):
+        self._library = library
+        self.handle = library.TessBaseAPICreate()
+        if datapath is not None:
+            datapath = os.fsencode(datapath)
+        if library.TessBaseAPIInit3(self.handle, datapath, language.encode('ASCII')) != 0:
+            self.close()
+            raise errors.MissingLanguagePackError(language)
+
+    def get_datapath(self):
+        return os.fsdecode(self._library.TessBaseAPIGetDatapath(self.handle))
+
+    def get_languages(self):
+        library = self._library
+        vector = library.TessBaseAPIGetAvailableLanguagesAsVector(self.handle)
+        try:
+            result = []
+            for code in vector:
+                if code is None:
+                    break
+                result += [code.decode('ASCII')]
+        finally:
+            library.TessDeleteTextArray(vector)
+        return result
+
+    def recognize(self, width, height, bytes_per_pixel, pixels, leaf_level, resolution=None):
+        """
+        Recognize the image; return the list of elements found at the leaf level, as expected by build_zones().
+        """
+        library = self._library
+        bytes_per_line = (width + 7) // 8 if bytes_per_pixel == 0 else width * bytes_per_pixel
+        library.TessBaseAPISetImage(self.handle, pixels, width, height, bytes_per_pixel, bytes_per_line)
+        try:
+            if resolution:
+                library.TessBaseAPISetSourceResolution(self.handle, resolution)
+            if library.TessBaseAPIRecognize(self.handle, None) != 0:
+                raise errors.MalformedOcrOutputError('recognition failed')
+            iterator = library.TessBaseAPIGetIterator(self.handle)
+            if not iterator:
+                return []
+            try:
+                return list(self._iterate(iterator, leaf_level))
+            finally:
+                library.TessResultIteratorDelete(iterator)
+        finally:
+            # Don't keep the image and results in memory until the next page.
+            library.TessBaseAPIClear(self.handle)
+
+    def _iterate(self, iterator, leaf_level):
+        library = self._library
+        page_iterator = library.TessResultIteratorGetPageIterator(iterator)
+        coordinates = [ctypes.c_int() for _ in range(4)]
+        while True:
+            level = RIL_SYMBOL
+            for outer_level in range(RIL_SYMBOL):
+                if library.TessPageIteratorIsAtBeginningOf(page_iterator, outer_level):
+                    level = outer_level
+                    break
+            if library.TessPageIteratorBoundingBox(page_iterator, leaf_level, *map(ctypes.byref, coordinates)):
+                text = library.TessResultIteratorGetUTF8Text(iterator, leaf_level)
+                if text:
+                    try:
+                        bbox = tuple(c.value for c in coordinates)
+                        yield level, bbox, ctypes.string_at(text).decode('UTF-8', 'replace')
+                    finally:
+                        library.TessDeleteText(text)
+            if not library.TessResultIteratorNext(iterator, leaf_level):
+                break
+
+    def close(self):
+        if self.handle:
+            self._library.TessBaseAPIEnd(self.handle)
+            self._library.TessBaseAPIDelete(self.handle)
+            self.handle = None
+
+    def __del__(self):
+        self.close()
+
+
+class Engine(common.Engine):
+    name = 'tesseract-capi'
+    image_format = PNM
+    in_process = True
+
+    library = utils.Property(None)
+    datapath = utils.Property(None)
+    # By default, the resolution at which the page was rendered:
+    resolution = utils.Property(None, int)
+
+    def __init__(self, *args, **kwargs):
+        common.Engine.__init__(self, **kwargs)
+        try:
+            self._library = load_library(self.library or _get_default_library())
+        except OSError:
+            raise errors.EngineNotFoundError(self.name)
+        self._local = threading.local()
+        try:
+            api = self._get_api(self.default_language)
+            self._datapath = api.get_datapath()
+            codes = api.get_languages()
+        except errors.MissingLanguagePackError:
+            raise errors.EngineNotFoundError(self.name)
+        self._user_to_tesseract = {}
+        for code in codes:
+            if code == 'osd':
+                continue
+            iso_code = tesseract.Engine.user_to_iso639(code)
+            self._user_to_tesseract[iso_code] = code
+
+    def _get_api(self, tesseract_language):
+        """
+        Return the TessBaseAPI of the current thread for the languages,
+        initializing it on first use.
+        """
+        try:
+            apis = self._local.apis
+        except AttributeError:
+            apis = self._local.apis = {}
+        api = apis.get(tesseract_language)
+        if api is None:
+            api = apis[tesseract_language] = _API(self._library, self.datapath, tesseract_language)
+        return api
+
+    def list_languages(self):
+        return iter(self._user_to_tesseract)
+
+    def user_to_tesseract(self, language):
+        result = []
+        for sub_lang in language.split('+'):
+            iso_code = tesseract.Engine.user_to_iso639(sub_lang)
+            try:
+                tesseract_code = self._user_to_tesseract[iso_code]
+            except LookupError:
+                raise errors.MissingLanguagePackError(iso_code)
+            result += [tesseract_code]
+        return str.join('+', result)
+
+    def check_language(self, language):
+        self.user_to_tesseract(language)
+
+    def get_identity(self, language):
+        identity = common.Engine.get_identity(self, language)
+        identity += [self._library.TessVersion().decode('ASCII', 'replace')]
+        for code in self.user_to_tesseract(language).split('+'):
+            path = os.path.join(self._datapath, f'{code}.traineddata')
+            identity += [common._get_file_identity(path)]
+        return identity
+
+    def recognize(self, image, language, details=None, uax29=None):
+        if details is None:
+            details = text_zones.TEXT_DETAILS_WORD
+        api = self._get_api(self.user_to_tesseract(language))
+        with open(image.name, 'rb') as file:
+            width, height, bytes_per_pixel, pixels, resolution = read_pnm(file.read())
+        resolution = self.resolution or resolution or DEFAULT_RESOLUTION
+        leaf_level = RIL_SYMBOL if tesseract._needs_character_details(details, uax29) else RIL_WORD
+        records = api.recognize(width, height, bytes_per_pixel, pixels, leaf_level, resolution)
+        page = text_zones.Zone(const.TEXT_ZONE_PAGE, text_zones.BBox(0, 0, width, height), build_zones(records, leaf_level))
+        if details > text_zones.TEXT_DETAILS_WORD:
+            _join_lines(page)
+        return common.Output(page.sexpr.as_string(escape_unicode=False), format_='sexpr')
+
+    def extract_text(self, stream, **kwargs):
+        return extract_text(stream, **kwargs)
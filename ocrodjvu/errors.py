@@ -47,12 +47,19 @@ class MalformedOcrOutputError(Exception):
 
     def __init__(self, message):
         Exception.__init__(self, f'malformed OCR output: {message}')
+        self.message = message
+
+    def __reduce__(self):
+        # Make it possible to pass the exception between processes without
+        # prefixing the message twice.
+        return type(self), (self.message,)
 
 
 class MalformedHocrError(MalformedOcrOutputError):
 
     def __init__(self, message):
         Exception.__init__(self, f'malformed hOCR document: {message}')
+        self.message = message
 
 
 EXIT_FATAL = 1
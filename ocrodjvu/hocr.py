@@ -94,6 +94,15 @@ TESSERACT_RSTRIP = functools.partial(
 )
 
 
+def _get_details(settings):
+    details = settings.details
+    if settings.uax29 is not None and details <= TEXT_DETAILS_WORD:
+        # If using UAX #29 segmentation, we might need more details than user
+        # requested, for internal purposes.
+        details = TEXT_DETAILS_CHARACTER
+    return details
+
+
 def _apply_bboxes(djvu_class, bbox_source, text, settings, page_size):
     embedded_eol = False
     if djvu_class <= const.TEXT_ZONE_LINE:
@@ -111,11 +120,7 @@ def _apply_bboxes(djvu_class, bbox_source, text, settings, page_size):
     trailing_whitespace_len = len(text) - len(new_text)
     text = new_text
     del new_text
-    details = settings.details
-    if settings.uax29 is not None and details <= TEXT_DETAILS_WORD:
-        # If using UAX #29 segmentation, we might need more details than user
-        # requested, for internal purposes.
-        details = TEXT_DETAILS_CHARACTER
+    details = _get_details(settings)
     if details >= djvu_class:
         return [text]
     if settings.tesseract and djvu_class > const.TEXT_ZONE_WORD and text.isspace():
@@ -189,6 +194,21 @@ def _apply_bboxes(djvu_class, bbox_source, text, settings, page_size):
         ]
 
 
+def _scan_cinfo(node):
+    """
+    Scan a single character, as written by Tesseract ≥ 4.1 with hocr_char_boxes enabled:
+    <span class='ocrx_cinfo' title='x_bboxes x0 y0 x1 y1; x_conf ...'>c</span>
+    """
+    text = node.text
+    if not text or text.isspace():
+        return []
+    m = BBOXES_RE.search(node.get('title') or '')
+    if m is None:
+        raise errors.MalformedHocrError('character without bounding box information')
+    bbox = text_zones.BBox(*map(int, m.group(1).replace(',', ' ').split()[:4]))
+    return [text_zones.Zone(type_=const.TEXT_ZONE_CHARACTER, bbox=bbox, children=[text])]
+
+
 def _scan(node, settings, page_size=None):
     def get_children(node_):
         result_ = []
@@ -213,6 +233,9 @@ def _scan(node, settings, page_size=None):
             *(int(m.group(ident)) for ident in ('x0', 'y0', 'x1', 'y1'))
         )
 
+    if 'ocrx_cinfo' in (node.get('class') or '').split():
+        return _scan_cinfo(node)
+
     if settings.cuneiform and settings.cuneiform <= (0, 8):
         # Cuneiform ≤ 0.8 doesn't mark OCR elements in an hOCR way.
         djvu_class = CUNEIFORM_TAG_TO_DJVU(node.tag)
@@ -292,6 +315,14 @@ def _scan(node, settings, page_size=None):
                 del children[-1]
 
     if djvu_class <= const.TEXT_ZONE_WORD:
+        if has_char_zone:
+            # Characters with bounding boxes of their own (see _scan_cinfo()).
+            # Whitespace between them is just formatting of the document.
+            children = [child for child in children if isinstance(child, text_zones.Zone)]
+            if _get_details(settings) >= djvu_class:
+                text = str.join('', (child[0] for child in children))
+                return [text_zones.Zone(type_=const.TEXT_ZONE_CHARACTER, bbox=bbox, children=[text])]
+            return children
         if has_zone:
             return children
         elif has_string:
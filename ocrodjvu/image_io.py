@@ -23,10 +23,100 @@ except ImportError as ex:
     raise
 
 
+# Samples darker than the middle gray count as ink:
+_dark_samples = bytes(int(value < 128) for value in range(256))
+
+
+def get_perceptual_hash(page_job, render_layers, size=128):
+    """
+    Return perceptual hash of the page, as an integer: every bit tells if
+    the respective pixel of a size×size grayscale thumbnail is darker than
+    the average.
+    """
+    pixel_format = djvu.decode.PixelFormatGrey()
+    pixel_format.rows_top_to_bottom = 1
+    pixel_format.y_top_to_bottom = 1
+    rect = (0, 0, size, size)
+    data = page_job.render(render_layers, rect, rect, pixel_format)
+    mean = sum(data) / len(data)
+    table = bytes(b'01'[value < mean] for value in range(256))
+    return int(b'0' + data.translate(table), 2)
+
+
+def get_hash_distance(hash1, hash2, size=128):
+    """
+    Return fraction of the bits that differ between the perceptual hashes.
+    """
+    return bin(hash1 ^ hash2).count('1') / (size * size)
+
+
+class ScaledPageJob:
+    """
+    Page job rendered at a different resolution.
+
+    DjVuLibre scales the image while rendering it, so the bitmap of the
+    original size is never made.
+    """
+
+    def __init__(self, page_job, dpi):
+        self._page_job = page_job
+        self.dpi = dpi
+        width, height = page_job.size
+        self.size = (
+            max(1, round(width * dpi / page_job.dpi)),
+            max(1, round(height * dpi / page_job.dpi)),
+        )
+
+    def render(self, *args, **kwargs):
+        return self._page_job.render(*args, **kwargs)
+
+
+def _split(length, n, overlap):
+    """
+    Yield (start, end) of n overlapping parts of the length, and of their cores.
+    """
+    bounds = [length * i // n for i in range(n + 1)]
+    for start, end in zip(bounds, bounds[1:]):
+        yield (max(0, start - overlap // 2), min(length, end + overlap // 2)), (start, end)
+
+
+def get_tiles(size, max_pixels, overlap):
+    """
+    Split the image of the size into a grid of tiles of at most max_pixels
+    pixels (if possible), overlapping by the given number of pixels.
+
+    Return list of (rect, core) pairs, both of them (x0, y0, x1, y1) with y
+    measured from the top. The cores (the tiles without halves of the overlap
+    bands) cover the image without overlapping.
+    """
+    width, height = size
+    nx = ny = 1
+
+    def get_tile_size(n, length):
+        return -(-length // n) + (overlap if n > 1 else 0)
+
+    while get_tile_size(nx, width) * get_tile_size(ny, height) > max_pixels:
+        # Split the longer side of the tiles, unless they would be no larger than the overlap.
+        can_split_x = width // (nx + 1) > overlap
+        can_split_y = height // (ny + 1) > overlap
+        if can_split_x and (get_tile_size(nx, width) >= get_tile_size(ny, height) or not can_split_y):
+            nx += 1
+        elif can_split_y:
+            ny += 1
+        else:
+            break
+    return [
+        ((x0, y0, x1, y1), (cx0, cy0, cx1, cy1))
+        for (y0, y1), (cy0, cy1) in _split(height, ny, overlap)
+        for (x0, x1), (cx0, cx1) in _split(width, nx, overlap)
+    ]
+
+
 class ImageFormat:
     extension = None
 
     _rgb = 'RGB'
+    _row_alignment = 1
 
     def __init__(self, bpp):
         self.bpp = bpp
@@ -43,9 +133,47 @@ class ImageFormat:
         self._pixel_format = pixel_format
 
     @utils.not_overridden
-    def write_image(self, page_job, render_layers, file):
+    def write_image(self, page_job, render_layers, file, rect=None):
+        """
+        Write the rendered image (of the whole page, or of the (x, y, width,
+        height) rectangle, with y measured from the top) to the file.
+        Return the rendered pixel data.
+        """
         raise NotImplementedError('Cannot output images in this format')
 
+    def get_ink_statistics(self, data, size):
+        """
+        Compute statistics of pixel data returned by `write_image()`.
+        Return (ink density, number of bands of consecutive rows with ink) pair.
+        """
+        width, height = size
+        if not width or not height:
+            return 0.0, 0
+        if self.bpp == 1:
+            row_size = (width + 7) // 8
+            padding_bits = 8 * row_size - width
+            n_samples = width
+        else:
+            row_size = n_samples = 3 * width
+        stride = (row_size + self._row_alignment - 1) // self._row_alignment * self._row_alignment
+        # Ignore specks of dust when looking for rows with ink:
+        min_row_ink = n_samples // 200 + 1
+        total_ink = 0
+        n_bands = 0
+        in_band = False
+        for offset in range(0, stride * height, stride):
+            row = data[offset:offset + row_size]
+            if self.bpp == 1:
+                row_ink = bin(int.from_bytes(row, 'big') >> padding_bits).count('1')
+            else:
+                row_ink = row.translate(_dark_samples).count(1)
+            total_ink += row_ink
+            has_ink = row_ink >= min_row_ink
+            if has_ink and not in_band:
+                n_bands += 1
+            in_band = has_ink
+        return total_ink / (n_samples * height), n_bands
+
     def __repr__(self):
         return f'{self.__module__}.{type(self).__name__}({self.bpp})'
 
@@ -67,19 +195,24 @@ class PNM(ImageFormat):
         elif bpp == 24:
             self.extension = 'ppm'
 
-    def write_image(self, page_job, render_layers, file):
-        size = page_job.size
-        rect = (0, 0) + size
+    def _get_header(self, size, page_job):
         if self._pixel_format.bpp == 1:
-            file.write('P4 {0} {1}\n'.format(*size).encode('ASCII'))  # PBM header
+            return 'P4 {0} {1}\n'.format(*size)  # PBM header
         else:
-            file.write('P6 {0} {1} 255\n'.format(*size).encode('ASCII'))  # PPM header
+            return 'P6 {0} {1} 255\n'.format(*size)  # PPM header
+
+    def write_image(self, page_job, render_layers, file, rect=None):
+        page_rect = (0, 0) + page_job.size
+        rect = rect or page_rect
+        size = rect[2:]
+        file.write(self._get_header(size, page_job).encode('ASCII'))
         data = page_job.render(
             render_layers,
-            rect, rect,
+            page_rect, rect,
             self._pixel_format
         )
         file.write(data)
+        return data
 
 
 class BMP(ImageFormat):
@@ -92,20 +225,22 @@ class BMP(ImageFormat):
     extension = 'bmp'
 
     _rgb = 'BGR'
+    _row_alignment = 4
 
     def __init__(self, bpp):
         ImageFormat.__init__(self, bpp)
         self._pixel_format.rows_top_to_bottom = 0
 
-    def write_image(self, page_job, render_layers, file):
-        size = page_job.size
-        rect = (0, 0) + size
+    def write_image(self, page_job, render_layers, file, rect=None):
+        page_rect = (0, 0) + page_job.size
+        rect = rect or page_rect
+        size = rect[2:]
         dpm = int(page_job.dpi * 39.37 + 0.5)
         data = page_job.render(
             render_layers,
-            rect, rect,
+            page_rect, rect,
             self._pixel_format,
-            row_alignment=4,
+            row_alignment=self._row_alignment,
         )
         n_palette_colors = 2 * (self._pixel_format.bpp == 1)
         headers_size = 54 + 4 * n_palette_colors
@@ -133,6 +268,7 @@ class BMP(ImageFormat):
             file.write(struct.pack('<BBBB', 0xFF, 0xFF, 0xFF, 0))
             file.write(struct.pack('<BBBB', 0, 0, 0, 0))
         file.write(data)
+        return data
 
 
 class TIFF(ImageFormat):
@@ -145,12 +281,13 @@ class TIFF(ImageFormat):
     extension = 'tif'
     # Ideally it should be 'tiff', but Tesseract is not happy with such an extension.
 
-    def write_image(self, page_job, render_layers, file):
-        size = page_job.size
-        rect = (0, 0) + size
+    def write_image(self, page_job, render_layers, file, rect=None):
+        page_rect = (0, 0) + page_job.size
+        rect = rect or page_rect
+        size = rect[2:]
         data = page_job.render(
             render_layers,
-            rect, rect,
+            page_rect, rect,
             self._pixel_format
         )
         if self._pixel_format.bpp == 1:
@@ -186,3 +323,4 @@ class TIFF(ImageFormat):
         assert len(header) == data_offset
         file.write(header)
         file.write(data)
+        return data
@@ -16,6 +16,9 @@
 Interprocess communication.
 """
 
+import asyncio
+import contextlib
+import contextvars
 import errno
 import logging
 import os
@@ -23,6 +26,8 @@ import re
 import shlex
 import signal
 import subprocess
+import threading
+import time
 
 
 # CalledProcessError, CalledProcessInterrupted
@@ -55,6 +60,7 @@ def get_signal_names():
 
 
 CalledProcessError = subprocess.CalledProcessError
+TimeoutExpired = subprocess.TimeoutExpired
 
 
 class CalledProcessInterrupted(CalledProcessError):
@@ -64,6 +70,10 @@ class CalledProcessInterrupted(CalledProcessError):
         Exception.__init__(self, command, signal_id)
         self.by_user = signal_id == signal.SIGINT
 
+    def __reduce__(self):
+        # The order of `self.args` does not match the constructor signature.
+        return type(self), (self.args[1], self.args[0])
+
     def __str__(self):
         signal_name = self._signal_names.get(self.args[1], self.args[1])
         return f'Command {self.args[0]!r} was interrupted by signal {signal_name}'
@@ -75,6 +85,90 @@ del get_signal_names
 # Subprocess
 # ==========
 
+_thread_env = contextvars.ContextVar('ocrodjvu.ipc.thread_env', default=None)
+_deadline = contextvars.ContextVar('ocrodjvu.ipc.deadline', default=None)
+
+# Process groups of subprocesses with a deadline; they don't get signals from the terminal.
+_process_groups = set()
+_process_groups_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def thread_environment(**override):
+    """
+    Override environment variables for subprocesses started by the current
+    thread (or asyncio task), without touching the environment of the whole
+    program.
+    """
+    env = dict(_thread_env.get() or {})
+    env.update(override)
+    token = _thread_env.set(env)
+    try:
+        yield
+    finally:
+        _thread_env.reset(token)
+
+
+@contextlib.contextmanager
+def deadline(timeout):
+    """
+    Kill subprocesses started by the current thread (or asyncio task) that
+    are still running `timeout` seconds from now, together with their
+    children; waiting for them then raises `TimeoutExpired`.
+
+    If timeout is None, the subprocesses have no time limit.
+    """
+    if timeout is None:
+        value = None
+    else:
+        value = time.monotonic() + timeout, timeout
+    token = _deadline.set(value)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def _add_process_group(pgid):
+    with _process_groups_lock:
+        _process_groups.add(pgid)
+
+
+def _discard_process_group(pgid):
+    with _process_groups_lock:
+        _process_groups.discard(pgid)
+
+
+def _kill_process_group(pgid, signal_id=signal.SIGKILL):
+    try:
+        os.killpg(pgid, signal_id)
+    except ProcessLookupError:  # no coverage
+        pass
+
+
+def interrupt_process_groups():
+    """
+    Pass SIGINT to subprocesses that run in process groups of their own.
+    """
+    with _process_groups_lock:
+        pgids = list(_process_groups)
+    for pgid in pgids:
+        _kill_process_group(pgid, signal.SIGINT)
+
+
+def _log_commandline(commandline):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(str.join(' ', map(shlex.quote, commandline)))
+
+
+def _fix_os_error(ex, command):
+    suffix = ': ' + repr(command)
+    if ex.strerror and ex.strerror.endswith(suffix):
+        # https://bugs.python.org/issue32490
+        ex.strerror = ex.strerror[:-len(suffix)]
+    ex.filename = command
+
+
 class Subprocess(subprocess.Popen):
 
     @classmethod
@@ -91,6 +185,9 @@ class Subprocess(subprocess.Popen):
         }
         if lc_ctype:
             env['LC_CTYPE'] = lc_ctype
+        thread_env = _thread_env.get()
+        if thread_env:
+            env.update(thread_env)
         if override:
             env.update(override)
         return env
@@ -103,23 +200,47 @@ class Subprocess(subprocess.Popen):
             commandline = kwargs['args']
         except KeyError:
             commandline = args[0]
-        if logger.isEnabledFor(logging.DEBUG):
-            logger.debug(str.join(' ', map(shlex.quote, commandline)))
+        _log_commandline(commandline)
         self.__command = commandline[0]
         self.__wait_called = False
+        self.__timer = None
+        self.__timed_out = False
+        deadline_ = _deadline.get()
+        if deadline_ is not None and os.name == 'posix':
+            # Kill the whole process group on timeout, including any children of the command.
+            kwargs.update(start_new_session=True)
         try:
             subprocess.Popen.__init__(self, *args, **kwargs)
         except EnvironmentError as ex:
-            suffix = ': ' + repr(self.__command)
-            if ex.strerror.endswith(suffix):
-                # https://bugs.python.org/issue32490
-                ex.strerror = ex.strerror[:-len(suffix)]
-            ex.filename = self.__command
+            _fix_os_error(ex, self.__command)
             raise
+        if deadline_ is not None:
+            end, self.__timeout = deadline_
+            if os.name == 'posix':
+                _add_process_group(self.pid)
+            self.__timer = threading.Timer(max(0.0, end - time.monotonic()), self.__kill_on_timeout)
+            self.__timer.daemon = True
+            self.__timer.start()
+
+    def __kill_on_timeout(self):
+        # A process that was not waited for yet still holds its process group ID.
+        if self.poll() is not None:
+            return
+        self.__timed_out = True
+        if os.name == 'posix':
+            _kill_process_group(self.pid)
+        else:  # no coverage
+            self.kill()
 
     def wait(self, *args, **kwargs):
         return_code = subprocess.Popen.wait(self, *args, **kwargs)
         self.__wait_called = True
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer.join()
+            _discard_process_group(self.pid)
+        if self.__timed_out:
+            raise TimeoutExpired(self.__command, self.__timeout)
         if return_code > 0:
             raise CalledProcessError(return_code, self.__command)
         if return_code < 0:
@@ -150,11 +271,84 @@ class Subprocess(subprocess.Popen):
             pass
 
 
+# run_async()
+# ===========
+
+async def run_async(commandline, stdout=None, stderr=None, env=None):
+    """
+    Run the command in a subprocess managed by asyncio, with the environment
+    prepared like for `Subprocess`. Return (stdout, stderr) data; the streams
+    that are not PIPE are discarded.
+
+    Raise `CalledProcessError` or `CalledProcessInterrupted` if the command
+    fails. If the awaiting task is cancelled, the subprocess is killed.
+    """
+    _log_commandline(commandline)
+    command = commandline[0]
+    deadline_ = _deadline.get()
+    new_session = deadline_ is not None and os.name == 'posix'
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *commandline,
+            stdin=DEVNULL,
+            stdout=stdout if stdout is PIPE else DEVNULL,
+            stderr=stderr if stderr is PIPE else DEVNULL,
+            env=Subprocess.override_env(env),
+            start_new_session=new_session,
+        )
+    except EnvironmentError as ex:
+        _fix_os_error(ex, command)
+        raise
+    if new_session:
+        _add_process_group(process.pid)
+
+    def kill():
+        if new_session:
+            _kill_process_group(process.pid)
+            return
+        try:
+            process.kill()
+        except ProcessLookupError:  # no coverage
+            pass
+
+    try:
+        if deadline_ is None:
+            stdout, stderr = await process.communicate()
+        else:
+            end, timeout = deadline_
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), max(0.0, end - time.monotonic()))
+            except asyncio.TimeoutError:
+                kill()
+                await process.wait()
+                raise TimeoutExpired(command, timeout) from None
+    except asyncio.CancelledError:
+        kill()
+        await process.wait()
+        raise
+    finally:
+        if new_session:
+            _discard_process_group(process.pid)
+    return_code = process.returncode
+    if return_code > 0:
+        raise CalledProcessError(return_code, command, stdout, stderr)
+    if return_code < 0:
+        ex = CalledProcessInterrupted(-return_code, command)
+        ex.output, ex.stderr = stdout, stderr
+        raise ex
+    return stdout, stderr
+
+
 # PIPE
 # ====
 
 PIPE = subprocess.PIPE
 
+# STDOUT
+# ======
+
+STDOUT = subprocess.STDOUT
+
 # DEVNULL
 # =======
 
@@ -186,7 +380,8 @@ logger = logging.getLogger('ocrodjvu.ipc')
 # =======
 
 __all__ = [
-    'CalledProcessError', 'CalledProcessInterrupted',
-    'Subprocess', 'PIPE', 'DEVNULL',
-    'require',
+    'CalledProcessError', 'CalledProcessInterrupted', 'TimeoutExpired',
+    'Subprocess', 'PIPE', 'STDOUT', 'DEVNULL',
+    'deadline', 'interrupt_process_groups',
+    'require', 'run_async', 'thread_environment',
 ]
@@ -0,0 +1,98 @@
+# Copyright © 2024 FriedrichFroebel
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+"""
+Crash-safe journal of finished pages.
+"""
+
+import hashlib
+import sqlite3
+import threading
+
+
+def get_file_digest(path):
+    """
+    Return digest of the file contents, to identify a document regardless of
+    its location.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_digest(*items):
+    """
+    Return digest of the string representations of the items.
+    """
+    digest = hashlib.sha256()
+    for item in items:
+        digest.update(repr(item).encode('UTF-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class Journal:
+    """
+    Append-only store of page texts, keyed by document identity, OCR options
+    and page identifier.
+
+    Every page is committed as soon as it is recorded, so that the results
+    survive a crash of the whole program.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode = WAL')
+            self._connection.execute('PRAGMA synchronous = NORMAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS pages ('
+                'document TEXT NOT NULL, '
+                'options TEXT NOT NULL, '
+                'page TEXT NOT NULL, '
+                'text TEXT, '
+                'PRIMARY KEY (document, options, page))'
+            )
+
+    def load(self, document, options):
+        """
+        Return dictionary mapping page identifiers to texts recorded for the
+        document. None means that the page had no image suitable for OCR.
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                'SELECT page, text FROM pages WHERE document = ? AND options = ?',
+                (document, options)
+            )
+            return dict(cursor.fetchall())
+
+    def record(self, document, options, page, text):
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO pages (document, options, page, text) VALUES (?, ?, ?, ?)',
+                (document, options, page, text)
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+__all__ = [
+    'Journal',
+    'get_digest',
+    'get_file_digest',
+]
@@ -0,0 +1,180 @@
+# Copyright © 2024 FriedrichFroebel
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+"""
+Progress metrics in the Prometheus text format[0], for the textfile
+collector of node_exporter.
+
+[0] https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+import bisect
+import contextlib
+import os
+import tempfile
+import threading
+
+
+DEFAULT_INTERVAL = 5
+
+_ENGINE_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+_PARSE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def format(self, name):
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            lines += [f'{name}_bucket{{le="{bound}"}} {total}']
+        lines += [
+            f'{name}_sum {_format_value(self.sum)}',
+            f'{name}_count {total}',
+        ]
+        return lines
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms of a single run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pages_done = 0
+        self.pages_failed = 0
+        self.pages_skipped = 0
+        self.rendered_bytes = 0
+        self.pages_in_progress = 0
+        self.queue_depth = 0
+        self.engine_seconds = Histogram(_ENGINE_BUCKETS)
+        self.parse_seconds = Histogram(_PARSE_BUCKETS)
+
+    def add(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def observe_stage(self, stage, values):
+        """
+        Update metrics with time (and other values) recorded for a processing stage.
+        This is meant to be used as the observer of `stats.Stats`.
+        """
+        with self._lock:
+            if stage == 'ocr':
+                self.engine_seconds.observe(values['wall'])
+            elif stage == 'parse':
+                self.parse_seconds.observe(values['wall'])
+            elif stage == 'render':
+                self.rendered_bytes += values.get('bytes', 0)
+
+    def format(self):
+        with self._lock:
+            metrics = [
+                ('pages_done_total', 'counter', 'Pages processed successfully.', self.pages_done),
+                ('pages_failed_total', 'counter', 'Pages that could not be processed.', self.pages_failed),
+                ('pages_skipped_total', 'counter', 'Pages without OCR: journal restored, with text, or no image.', self.pages_skipped),
+                ('rendered_bytes_total', 'counter', 'Size of images rendered for OCR.', self.rendered_bytes),
+                ('pages_in_progress', 'gauge', 'Pages being processed by workers.', self.pages_in_progress),
+                ('queue_depth', 'gauge', 'Pages waiting for a worker.', self.queue_depth),
+                ('engine_seconds', 'histogram', 'Time spent recognizing a page.', self.engine_seconds),
+                ('parse_seconds', 'histogram', 'Time spent parsing OCR results of a page.', self.parse_seconds),
+            ]
+            lines = []
+            for name, type_, help_, value in metrics:
+                name = f'ocrodjvu_{name}'
+                lines += [
+                    f'# HELP {name} {help_}',
+                    f'# TYPE {name} {type_}',
+                ]
+                if isinstance(value, Histogram):
+                    lines += value.format(name)
+                else:
+                    lines += [f'{name} {_format_value(value)}']
+        return str.join('', (line + '\n' for line in lines))
+
+    def write(self, path):
+        """
+        Replace the file atomically, so that the collector never sees it half-written.
+        """
+        directory, basename = os.path.split(os.path.abspath(path))
+        # The textfile collector reads only *.prom files, so the temporary file is ignored.
+        fd, tmp_path = tempfile.mkstemp(prefix=f'.{basename}.', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='UTF-8') as file:
+                file.write(self.format())
+            # The collector usually runs as a different user.
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            raise
+
+
+class Writer:
+    """
+    Thread rewriting the metrics file periodically.
+    """
+
+    def __init__(self, metrics, path, interval=DEFAULT_INTERVAL):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.metrics.write(self.path)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.metrics.write(self.path)
+            except OSError:
+                # Try again next time.
+                pass
+
+    def stop(self):
+        """
+        Stop the thread, and write the final values.
+        """
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.metrics.write(self.path)
+
+
+__all__ = [
+    'DEFAULT_INTERVAL',
+    'Histogram',
+    'Metrics',
+    'Writer',
+]
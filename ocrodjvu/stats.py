@@ -0,0 +1,164 @@
+# Copyright © 2024 FriedrichFroebel
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+"""
+Timing of the processing stages of every page.
+"""
+
+import contextlib
+import json
+import math
+import threading
+import time
+
+
+def percentile(sorted_values, p):
+    """
+    Return the p-th percentile (nearest-rank method) of the sorted values.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(values):
+    values = sorted(values)
+    return dict(
+        count=len(values),
+        total=sum(values),
+        p50=percentile(values, 50),
+        p95=percentile(values, 95),
+        max=values[-1] if values else None,
+    )
+
+
+class Stats:
+    """
+    Wall-clock and CPU time spent in every stage, for every page and document.
+
+    CPU time is the time of the calling thread; it doesn't include the OCR
+    engine subprocesses. Waits (such as time spent in queues) have only
+    wall-clock time.
+
+    `observer`, if not None, is called with the stage name and the recorded
+    values every time something is recorded.
+    """
+
+    def __init__(self, observer=None):
+        self._observer = observer
+        self._lock = threading.Lock()
+        self._pages = {}
+        self._documents = {}
+        self._marks = {}
+        self.started = time.perf_counter()
+
+    def _get_timings(self, document, page):
+        if page is None:
+            return self._documents.setdefault(document, {})
+        return self._pages.setdefault((document, page), {})
+
+    def add(self, stage, document, page, wall, cpu=None, **values):
+        """
+        Record time spent in the stage, and other values (such as sizes) that add up.
+        `page` is the page number (counting from 0), or None for stages of the whole document.
+        """
+        values['wall'] = wall
+        if cpu is not None:
+            values['cpu'] = cpu
+        with self._lock:
+            timing = self._get_timings(document, page).setdefault(stage, {})
+            for key, value in values.items():
+                timing[key] = timing.get(key, 0) + value
+        if self._observer is not None:
+            self._observer(stage, values)
+
+    @contextlib.contextmanager
+    def measure(self, stage, document, page=None, cpu=True):
+        """
+        Record time spent in the with-block.
+        Pass cpu=False if the block doesn't run in a single thread, such as a coroutine.
+        The with-block can add other values to the yielded dictionary.
+        """
+        values = {}
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            yield values
+        finally:
+            wall = time.perf_counter() - start_wall
+            self.add(stage, document, page, wall, time.thread_time() - start_cpu if cpu else None, **values)
+
+    def mark(self, document, page):
+        """
+        Remember when the page started waiting for something.
+        """
+        self._marks[document, page] = time.perf_counter()
+
+    def add_wait(self, stage, document, page):
+        """
+        Record time since mark() was called for the page.
+        """
+        try:
+            start = self._marks.pop((document, page))
+        except LookupError:
+            return
+        self.add(stage, document, page, time.perf_counter() - start)
+
+    def pop_page(self, document, page):
+        """
+        Remove and return timings of the page, to be merged into stats of another process.
+        """
+        with self._lock:
+            return self._pages.pop((document, page), {})
+
+    def merge_page(self, document, page, timings):
+        for stage, timing in timings.items():
+            self.add(stage, document, page, **timing)
+
+    def as_json(self):
+        with self._lock:
+            pages = sorted(self._pages.items())
+            documents = sorted(self._documents.items())
+        summary = {}
+        for _, timings in pages + documents:
+            for stage, timing in timings.items():
+                stage_summary = summary.setdefault(stage, {})
+                for key, value in timing.items():
+                    stage_summary.setdefault(key, []).append(value)
+        return dict(
+            wall=time.perf_counter() - self.started,
+            pages=[
+                dict(document=document, page=page + 1, stages=timings)
+                for (document, page), timings in pages
+            ],
+            documents=[
+                dict(document=document, stages=timings)
+                for document, timings in documents
+            ],
+            summary={
+                stage: {key: summarize(values) for key, values in sorted(stage_summary.items())}
+                for stage, stage_summary in sorted(summary.items())
+            },
+        )
+
+    def write(self, path):
+        with open(path, 'w', encoding='UTF-8') as file:
+            json.dump(self.as_json(), file, indent=2)
+            file.write('\n')
+
+
+__all__ = [
+    'Stats',
+    'percentile',
+]
@@ -14,6 +14,7 @@
 
 import contextlib
 import functools
+import os
 import shutil
 import tempfile as raw
 
@@ -35,4 +36,20 @@ def directory(*args, **kwargs):
         shutil.rmtree(tmpdir)
 
 
-__all__ = ['raw', 'file', 'directory', 'name', 'wrapper']
+def memory_file(name):
+    """
+    Return a binary file that is kept in memory rather than on disk.
+    Its name is a path other processes (of the same user) can open,
+    as long as the file is not closed.
+    """
+    fd = os.memfd_create(f'ocrodjvu.{name}', os.MFD_CLOEXEC)
+    try:
+        file = open(fd, 'w+b')
+    except BaseException:
+        os.close(fd)
+        raise
+    # The file disappears on its own when it is closed.
+    return wrapper(file, f'/proc/{os.getpid()}/fd/{fd}', delete=False)
+
+
+__all__ = ['raw', 'file', 'directory', 'memory_file', 'name', 'wrapper']
@@ -222,5 +222,83 @@ def group_words(zones, details, word_break_iterator):
     return words
 
 
+def scale_sexpr(expr, x_scale, y_scale):
+    """
+    Return copy of the text zone expression, with all the coordinates scaled.
+    """
+    def scale_zone(zone):
+        if isinstance(zone, str):
+            return zone
+        type_, x0, y0, x1, y1, *children = zone
+        x0, x1 = round(x0 * x_scale), round(x1 * x_scale)
+        y0, y1 = round(y0 * y_scale), round(y1 * y_scale)
+        return [type_, x0, y0, max(x1, x0 + 1), max(y1, y0 + 1)] + [scale_zone(child) for child in children]
+    return sexpr.Expression(scale_zone(expr.value))
+
+
+def _get_tile_zone(value, rect, core, scale):
+    """
+    Convert the zone expression (in coordinates of the tile, with y measured
+    from the bottom) to a Zone in coordinates of the page (with y measured from
+    the top). Return None if the zone is outside the core.
+    If core is None, keep the zone and all its children.
+    """
+    if isinstance(value, str):
+        return value
+    type_, x0, y0, x1, y1, *children = value
+    type_ = const.get_text_zone_type(type_)
+    # Position in the page image:
+    tile_x0, _, _, tile_y1 = rect
+    x0, y0, x1, y1 = tile_x0 + x0, tile_y1 - y1, tile_x0 + x1, tile_y1 - y0
+    if core is not None and (type_ <= const.TEXT_ZONE_WORD or any(isinstance(child, str) for child in children)):
+        # The smallest zone that can be split between tiles: decide by its center.
+        x = (x0 + x1) / 2
+        y = (y0 + y1) / 2
+        core_x0, core_y0, core_x1, core_y1 = core
+        if not (core_x0 <= x < core_x1 and core_y0 <= y < core_y1):
+            return None
+        core = None
+    zones = [_get_tile_zone(child, rect, core, scale) for child in children]
+    if core is None:
+        x_scale, y_scale = scale
+        bbox = BBox(round(x0 / x_scale), round(y0 / y_scale), round(x1 / x_scale), round(y1 / y_scale))
+        return Zone(type_, bbox, zones)
+    zones = [zone for zone in zones if zone is not None]
+    if not zones:
+        return None
+    bbox = BBox()
+    for zone in zones:
+        bbox.update(zone.bbox)
+    return Zone(type_, bbox, zones)
+
+
+def merge_tiles(tiles, page_size, rotation, scale=(1, 1)):
+    """
+    Return text of the whole page, merged from text of its overlapping tiles.
+
+    `tiles` is a list of (rect, core, text) triples: rect is the position of
+    the tile in the page image, and core is the part of it that doesn't belong
+    to other tiles (or None, if it's the only tile); both of them are (x0, y0,
+    x1, y1) with y measured from the top. text is the page zone expression
+    extracted from the tile, as if it was a page of its own, without rotation.
+
+    Zones that lie in the overlap bands are taken only from the tile whose
+    core contains their center; lines (and larger zones) split between tiles
+    are kept as separate zones.
+
+    `scale` is the (x, y) ratio of the page image size to the page size.
+    The coordinates are mapped back to the page size before the rotation.
+    """
+    children = []
+    for rect, core, text in tiles:
+        for child in text.value[5:]:
+            zone = _get_tile_zone(child, rect, core, scale)
+            if isinstance(zone, Zone):
+                children += [zone]
+    page = Zone(const.TEXT_ZONE_PAGE, BBox(0, 0, *page_size), children)
+    page.rotate(rotation)
+    return page.sexpr
+
+
 def print_sexpr(expr, file, width=None):
     return expr.print_into(file, width=width, escape_unicode=False)
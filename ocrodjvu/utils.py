@@ -12,10 +12,12 @@
 # FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
 # for more details.
 
+import collections
 import functools
 import locale
 import os
 import re
+import threading
 import warnings
 
 
@@ -55,6 +57,27 @@ def parse_page_numbers(pages):
     return result
 
 
+_SIZE_SUFFIXES = dict(K=1 << 10, M=1 << 20, G=1 << 30, T=1 << 40)
+
+
+def parse_size(size):
+    """
+    parse_size('4096') -> 4096
+    parse_size('512K') -> 524288
+    parse_size('2G') -> 2147483648
+    """
+    size = size.strip()
+    multiplier = 1
+    suffix = size[-1:].upper()
+    if suffix in _SIZE_SUFFIXES:
+        multiplier = _SIZE_SUFFIXES[suffix]
+        size = size[:-1]
+    n = int(size, 10)
+    if n < 0:
+        raise ValueError(f'negative size: {n}')
+    return n * multiplier
+
+
 _SPECIAL_CHARS_REPLACE = re.compile(r'''[\x00-\x1F'"\x5C\x7F-\x9F]''').sub
 
 
@@ -158,6 +181,16 @@ def identity(x):
     return x
 
 
+def positive_int(s):
+    """
+    Convert the string to an integer; raise ValueError unless it's positive.
+    """
+    n = int(s)
+    if n <= 0:
+        raise ValueError(f'{n} is not a positive integer')
+    return n
+
+
 class Property:
 
     def __init__(self, default_value=None, filter_=identity):
@@ -187,7 +220,112 @@ def get_cpu_count():
         return 1
 
 
-def get_thread_limit(nitems, njobs):
-    if nitems == 0:
-        return 1
-    return max(1, njobs // nitems)
+class ThreadAllocator:
+    """
+    Share `njobs` cores between `nitems` items, at most `njobs` of them
+    processed at the same time.
+
+    The number of threads is chosen only when an item starts. Items started
+    together share the free cores. Once items start finishing and fewer than
+    `njobs` items are pending, a new item is given up to twice its share of
+    all the cores among the remaining items, rather than only the cores freed
+    so far: the running items finish during its lifetime, and otherwise the
+    last items would run single-threaded while the other cores are idle.
+    The cores are oversubscribed in the meantime, about twice at most.
+    """
+
+    def __init__(self, nitems, njobs):
+        self._lock = threading.Lock()
+        self._njobs = njobs
+        self._n_pending = nitems
+        self._n_running = 0
+        self._n_free = njobs
+        self._draining = False
+
+    def acquire(self):
+        with self._lock:
+            # Items that can start right now, including this one:
+            n_starting = max(1, min(self._n_pending, self._njobs - self._n_running))
+            n_threads = max(1, -(-self._n_free // n_starting))
+            if self._draining and self._n_pending < self._njobs:
+                # Items still to be processed, including this one
+                # (which may be processed once more, e.g. after a timeout):
+                n_active = max(1, self._n_running + self._n_pending)
+                n_tail = -(-2 * self._njobs // n_active)
+                n_threads = max(n_threads, min(n_tail, self._njobs))
+            self._n_pending = max(0, self._n_pending - 1)
+            self._n_running += 1
+            self._n_free -= n_threads
+            return n_threads
+
+    def add(self, nitems):
+        """
+        Add more items to be processed.
+        """
+        with self._lock:
+            self._n_pending += nitems
+
+    def release(self, n_threads):
+        with self._lock:
+            self._draining = True
+            self._n_running -= 1
+            self._n_free += n_threads
+
+
+class MemoryBudget:
+    """
+    Limit the total size of reservations held at the same time to `limit`
+    bytes (or nothing, if the limit is None).
+
+    Reservations are granted in the order they were requested. A reservation
+    larger than the whole budget is granted when no other one is held, so
+    that it runs alone rather than never.
+    """
+
+    def __init__(self, limit):
+        self._limit = limit
+        self._condition = threading.Condition()
+        self._n_reserved = 0
+        self._waiting = collections.deque()
+
+    def _fits(self, n_bytes):
+        return self._n_reserved == 0 or self._n_reserved + n_bytes <= self._limit
+
+    def try_acquire(self, n_bytes):
+        """
+        Reserve n_bytes if it's possible without waiting.
+        Return the number of bytes reserved (to be passed to release()), or None.
+        """
+        if self._limit is None:
+            return 0
+        with self._condition:
+            if self._waiting or not self._fits(n_bytes):
+                return
+            self._n_reserved += n_bytes
+            return n_bytes
+
+    def acquire(self, n_bytes):
+        """
+        Wait until n_bytes can be reserved.
+        Return the number of bytes reserved (to be passed to release()).
+        """
+        if self._limit is None:
+            return 0
+        with self._condition:
+            ticket = object()
+            self._waiting.append(ticket)
+            try:
+                self._condition.wait_for(lambda: self._waiting[0] is ticket and self._fits(n_bytes))
+            finally:
+                self._waiting.remove(ticket)
+                # The next one in the queue may fit as well.
+                self._condition.notify_all()
+            self._n_reserved += n_bytes
+            return n_bytes
+
+    def release(self, n_bytes):
+        if not n_bytes:
+            return
+        with self._condition:
+            self._n_reserved -= n_bytes
+            self._condition.notify_all()
@@ -40,7 +40,7 @@ setup(
         exclude=['tests', 'tests.*', 'private', 'private.*']
     ),
     include_package_data=True,
-    python_requires=">=3.6, <4",
+    python_requires=">=3.9, <4",
     install_requires=[
         'python-djvulibre>=0.4',
         'lxml>=2.0',
@@ -0,0 +1,106 @@
+# Copyright © 2024 FriedrichFroebel
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import contextlib
+import io
+import json
+import os
+import time
+
+from ocrodjvu import bench
+from ocrodjvu import hocr
+from ocrodjvu import temporary
+from ocrodjvu import text_zones
+from ocrodjvu.engines import ocrad
+
+from tests.tools import try_run, TestCase
+
+
+def count_words(zone):
+    if not isinstance(zone, text_zones.Zone):
+        return 0
+    if zone.type == text_zones.const.TEXT_ZONE_WORD:
+        return 1
+    return sum(count_words(child) for child in zone)
+
+
+class SyntheticInputTestCase(TestCase):
+
+    def test_gocr(self):
+        zone = bench.make_page_zone(123)
+        self.assertEqual(count_words(zone), 123)
+
+    def test_ocrad(self):
+        settings = ocrad.ExtractSettings(page_size=bench._get_page_size(123))
+        settings.replacement_character = '\N{REPLACEMENT CHARACTER}'
+        zone = ocrad.scan(io.StringIO(bench.make_ocrad(123)), settings)
+        self.assertEqual(count_words(zone), 123)
+
+    def test_hocr(self):
+        [page] = hocr.extract_text(io.BytesIO(bench.make_hocr(123)))
+        self.assertEqual(str(page.value[0]), 'page')
+
+
+class BenchmarkTestCase(TestCase):
+
+    def test_with_setup(self):
+        args = []
+
+        def function(arg):
+            time.sleep(0.01)
+            args.append(arg)
+
+        result = bench.Benchmark('eggs', bench.WithSetup(list, function)).run(2)
+        self.assertEqual(len(result['times']), 2)
+        # Every call got a fresh argument:
+        self.assertEqual(len(set(map(id, args))), len(args))
+
+    def test_rotate(self):
+        zone = bench.make_page_zone(10)
+        copy = bench._copy_zone(zone)
+        copy.rotate(90)
+        self.assertNotEqual(copy.sexpr.value, zone.sexpr.value)
+        self.assertEqual(bench._copy_zone(zone).sexpr.value, zone.sexpr.value)
+
+
+class MainTestCase(TestCase):
+
+    def test_output(self):
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'bench.json')
+            stderr = io.StringIO()
+            with contextlib.redirect_stderr(stderr):
+                rc = try_run(bench.main, ['', '-k', 'group_words:words', '-k', 'PNM.write_image:1bpp', '--repeat', '2', '-o', path])
+                self.assertEqual(rc, 0)
+                with open(path, 'r') as file:
+                    results = json.load(file)
+                self.assertEqual(
+                    [item['name'] for item in results['benchmarks']],
+                    ['text_zones.group_words:words', 'image_io.PNM.write_image:1bpp']
+                )
+                for item in results['benchmarks']:
+                    self.assertEqual(len(item['times']), 2)
+                    self.assertEqual(item['best'], min(item['times']))
+                rc = try_run(bench.main, ['', '-k', 'group_words:words', '--repeat', '1', '-o', os.devnull, '--compare', path])
+        self.assertEqual(rc, 0)
+        self.assertIn('text_zones.group_words:words: ', stderr.getvalue())
+        self.assertIn('%)', stderr.getvalue())
+
+    def test_list(self):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            rc = try_run(bench.main, ['', '--list'])
+        self.assertEqual(rc, 0)
+        names = stdout.getvalue().splitlines()
+        self.assertIn('hocr.extract_text:synthetic-100k', names)
+        self.assertIn('image_io.TIFF.write_image:24bpp', names)
@@ -0,0 +1,93 @@
+# Copyright © 2024 FriedrichFroebel
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import os
+import threading
+
+from ocrodjvu import cache
+from ocrodjvu import temporary
+
+from tests.tools import TestCase
+
+
+class GetKeyTestCase(TestCase):
+
+    def test_key(self):
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'eggs')
+            with open(path, 'wb') as file:
+                file.write(b'ham')
+            key = cache.get_key(path, 'spam')
+            self.assertEqual(key, cache.get_key(path, 'spam'))
+            self.assertNotEqual(key, cache.get_key(path, 'bacon'))
+            with open(path, 'wb') as file:
+                file.write(b'ham!')
+            self.assertNotEqual(key, cache.get_key(path, 'spam'))
+
+
+class CacheTestCase(TestCase):
+
+    def test_miss(self):
+        with temporary.directory() as tmpdir:
+            self.assertIsNone(cache.Cache(tmpdir, 1 << 20).get('00eggs'))
+
+    def test_text(self):
+        with temporary.directory() as tmpdir:
+            cache.Cache(tmpdir, 1 << 20).put('00eggs', 'html', 'ham\N{EN DASH}')
+            self.assertEqual(cache.Cache(tmpdir, 1 << 20).get('00eggs'), ('html', 'ham\N{EN DASH}'))
+
+    def test_binary(self):
+        with temporary.directory() as tmpdir:
+            store = cache.Cache(tmpdir, 1 << 20)
+            store.put('00eggs', 'xml', b'\0\xffham\n')
+            self.assertEqual(store.get('00eggs'), ('xml', b'\0\xffham\n'))
+
+    def test_broken_entry(self):
+        with temporary.directory() as tmpdir:
+            store = cache.Cache(tmpdir, 1 << 20)
+            os.makedirs(os.path.join(tmpdir, '00'))
+            with open(os.path.join(tmpdir, '00', '00eggs'), 'wb') as file:
+                file.write(b'{\n')
+            self.assertIsNone(store.get('00eggs'))
+
+    def test_eviction(self):
+        with temporary.directory() as tmpdir:
+            store = cache.Cache(tmpdir, 1100)
+            for n in range(3):
+                store.put(f'0{n}eggs', 'txt', 'x' * 300)
+            # Make the entries look used in a well-defined order, oldest first:
+            for n, key in enumerate(['01eggs', '00eggs', '02eggs']):
+                path = os.path.join(tmpdir, key[:2], key)
+                os.utime(path, ns=(n * 10 ** 9, n * 10 ** 9))
+            store.put('03eggs', 'txt', 'x' * 300)
+            store.evict()
+            self.assertIsNone(store.get('01eggs'))
+            for key in ['00eggs', '02eggs', '03eggs']:
+                self.assertIsNotNone(store.get(key))
+
+    def test_concurrent_put(self):
+        with temporary.directory() as tmpdir:
+            store = cache.Cache(tmpdir, 1 << 20)
+
+            def put(n):
+                for _ in range(20):
+                    store.put('00eggs', 'txt', str(n) * 1000)
+
+            threads = [threading.Thread(target=put, args=(n,)) for n in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            format_, contents = store.get('00eggs')
+        self.assertEqual(format_, 'txt')
+        self.assertIn(contents, [str(n) * 1000 for n in range(4)])
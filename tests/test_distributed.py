@@ -0,0 +1,207 @@
+# Copyright © 2024 FriedrichFroebel
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import os
+import socket
+import threading
+
+from ocrodjvu import distributed
+from ocrodjvu import temporary
+
+from tests.tools import remove_logging_handlers, TestCase
+
+
+class ParseAddressTestCase(TestCase):
+    def test_tcp(self):
+        self.assertEqual(distributed.parse_address('localhost:4242'), (socket.AF_INET, ('localhost', 4242)))
+
+    def test_tcp6(self):
+        self.assertEqual(distributed.parse_address('[::1]:4242'), (socket.AF_INET6, ('::1', 4242)))
+
+    def test_unix(self):
+        self.assertEqual(distributed.parse_address('/tmp/ocrodjvu.sock'), (socket.AF_UNIX, '/tmp/ocrodjvu.sock'))
+        self.assertEqual(distributed.parse_address('ocrodjvu.sock'), (socket.AF_UNIX, 'ocrodjvu.sock'))
+
+    def test_bad_port(self):
+        with self.assertRaises(ValueError):
+            distributed.parse_address('localhost:eggs')
+
+
+class MessageTestCase(TestCase):
+    def test_round_trip(self):
+        left, right = socket.socketpair()
+        with left, right:
+            distributed.send_message(left, dict(eggs='ham'), b'\0spam')
+            header, payload = distributed.receive_message(right)
+        self.assertEqual(header, dict(eggs='ham'))
+        self.assertEqual(payload, b'\0spam')
+
+    def test_eof(self):
+        left, right = socket.socketpair()
+        with right:
+            left.close()
+            with self.assertRaises(EOFError):
+                distributed.receive_message(right)
+
+
+class CoordinatorTestCase(TestCase):
+
+    def setUp(self):
+        remove_logging_handlers('ocrodjvu.')
+        self.workers = []
+
+    def tearDown(self):
+        for worker, thread in self.workers:
+            worker.shutdown()
+            thread.join()
+            worker.close()
+
+    def start_worker(self, name, address='127.0.0.1:0', options_key='eggs', n_jobs=1):
+        def process(header, payload):
+            if header.get('fail'):
+                raise RuntimeError('ham')
+            return dict(status='ok', text=f'{name}:{header["n"]}:{payload.decode()}')
+
+        worker = distributed.Worker(address, process, options_key, n_jobs)
+        thread = threading.Thread(target=worker.serve_forever)
+        thread.start()
+        self.workers += [(worker, thread)]
+        return worker.address
+
+    @staticmethod
+    def start_lost_worker(options_key='eggs'):
+        # Accept a single job and die without replying.
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+
+        def serve():
+            with server:
+                sock, _ = server.accept()
+                with sock:
+                    distributed.send_message(sock, dict(version=distributed.PROTOCOL_VERSION, options=options_key, jobs=1))
+                    distributed.receive_message(sock)
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        host, port = server.getsockname()
+        return f'{host}:{port}', thread
+
+    def test_several_workers(self):
+        addresses = [self.start_worker('a', n_jobs=2), self.start_worker('b')]
+        coordinator = distributed.Coordinator(addresses, 'eggs')
+        try:
+            self.assertEqual(coordinator.n_slots, 3)
+            results = {}
+
+            def submit(n):
+                results[n] = coordinator.submit(dict(n=n), b'spam')
+
+            threads = [threading.Thread(target=submit, args=(n,)) for n in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            coordinator.close()
+        self.assertEqual(sorted(results), list(range(10)))
+        for n, reply in results.items():
+            self.assertEqual(reply['status'], 'ok')
+            self.assertRegex(reply['text'], f'^[ab]:{n}:spam$')
+
+    def test_unix_socket(self):
+        with temporary.directory() as tmpdir:
+            address = self.start_worker('a', address=os.path.join(tmpdir, 'worker.sock'))
+            coordinator = distributed.Coordinator([address], 'eggs')
+            try:
+                reply = coordinator.submit(dict(n=1))
+            finally:
+                coordinator.close()
+        self.assertEqual(reply, dict(status='ok', text='a:1:'))
+
+    def test_worker_lost(self):
+        lost_address, lost_thread = self.start_lost_worker()
+        coordinator = distributed.Coordinator([lost_address, self.start_worker('a')], 'eggs')
+        try:
+            self.assertEqual(coordinator.n_slots, 2)
+            replies = [coordinator.submit(dict(n=n)) for n in range(3)]
+        finally:
+            coordinator.close()
+            lost_thread.join()
+        self.assertEqual([reply['text'] for reply in replies], ['a:0:', 'a:1:', 'a:2:'])
+
+    @staticmethod
+    def start_hung_worker(released, options_key='eggs'):
+        # Accept a single job and never reply to it.
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+
+        def serve():
+            with server:
+                sock, _ = server.accept()
+                with sock:
+                    distributed.send_message(sock, dict(version=distributed.PROTOCOL_VERSION, options=options_key, jobs=1))
+                    distributed.receive_message(sock)
+                    released.wait()
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        host, port = server.getsockname()
+        return f'{host}:{port}', thread
+
+    def test_worker_timeout(self):
+        released = threading.Event()
+        hung_address, hung_thread = self.start_hung_worker(released)
+        try:
+            coordinator = distributed.Coordinator([hung_address, self.start_worker('a')], 'eggs', timeout=0.5)
+            try:
+                replies = [coordinator.submit(dict(n=n)) for n in range(2)]
+            finally:
+                coordinator.close()
+        finally:
+            released.set()
+            hung_thread.join()
+        self.assertEqual([reply['text'] for reply in replies], ['a:0:', 'a:1:'])
+
+    def test_all_workers_lost(self):
+        lost_address, lost_thread = self.start_lost_worker()
+        coordinator = distributed.Coordinator([lost_address], 'eggs')
+        try:
+            with self.assertRaises(distributed.NoWorkersError):
+                coordinator.submit(dict(n=0))
+        finally:
+            coordinator.close()
+            lost_thread.join()
+
+    def test_different_options(self):
+        address = self.start_worker('a', options_key='ham')
+        with self.assertRaises(distributed.NoWorkersError):
+            distributed.Coordinator([address], 'eggs')
+
+    def test_unreachable_worker(self):
+        with temporary.directory() as tmpdir:
+            address = os.path.join(tmpdir, 'nonexistent.sock')
+            coordinator = distributed.Coordinator([address, self.start_worker('a')], 'eggs')
+            coordinator.close()
+        self.assertEqual(coordinator.n_slots, 1)
+
+    def test_remote_error(self):
+        coordinator = distributed.Coordinator([self.start_worker('a')], 'eggs')
+        try:
+            with self.assertRaisesRegex(distributed.RemoteError, 'RuntimeError: ham'):
+                coordinator.submit(dict(n=0, fail=True))
+            # The worker is still usable:
+            self.assertEqual(coordinator.submit(dict(n=1))['text'], 'a:1:')
+        finally:
+            coordinator.close()
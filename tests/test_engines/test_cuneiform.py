@@ -12,6 +12,7 @@
 # FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
 # for more details.
 
+import asyncio
 import os
 import sys
 
@@ -83,6 +84,15 @@ class CuneiformTestCase(TestCase):
                 with self.subTest(lang1=lang1):
                     self._test_recognize(lang1, lang1)
 
+    def test_recognize_async(self):
+        async def fake_run_async(args, *rest, **kwrest):
+            self.assertEqual(args[:3], [self.engine.executable, '-l', 'eng'])
+            raise EOFError
+
+        with mock.patch.object(ipc, 'run_async', fake_run_async):
+            with self.assertRaises(EOFError):
+                asyncio.run(self.engine.recognize_async(sys.stdin, 'eng'))
+
 
 class CuneiformMultiLanguageTestCase(CuneiformTestCase):
     existing_languages = CuneiformTestCase.existing_languages + [
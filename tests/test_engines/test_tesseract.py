@@ -0,0 +1,155 @@
+# Copyright © 2024 FriedrichFroebel
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import asyncio
+import contextlib
+import io
+import os
+
+from ocrodjvu.engines.tesseract import Engine, split_hocr
+from ocrodjvu import errors
+from ocrodjvu import ipc
+from ocrodjvu import temporary
+from ocrodjvu import text_zones
+
+from tests.tools import interim_environ, TestCase
+
+
+HERE = os.path.dirname(__file__)
+HERE = os.path.relpath(HERE)
+
+
+class TesseractTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = Engine(
+            executable=os.path.join(HERE, 'fake-tesseract')
+        )
+
+    def test_list_languages(self):
+        self.assertEqual(list(self.engine.list_languages()), ['eng'])
+        with self.assertRaises(errors.MissingLanguagePackError):
+            self.engine.check_language('tlh')
+
+    def _recognize(self, recognize):
+        stderr = io.StringIO()
+        with temporary.file(suffix='.tif') as image:
+            with contextlib.redirect_stderr(stderr):
+                result = recognize(image, 'eng', details=text_zones.TEXT_DETAILS_WORD)
+        self.assertEqual(stderr.getvalue(), '')
+        self.assertEqual(result.format, 'html')
+        self.assertIn("class='ocr_page'", str(result))
+        return str(result).replace(image.name, '')
+
+    def test_recognize_async(self):
+        expected = self._recognize(self.engine.recognize)
+
+        def recognize(image, language, details):
+            return asyncio.run(self.engine.recognize_async(image, language, details=details))
+
+        self.assertMultiLineEqual(self._recognize(recognize), expected)
+
+    def test_recognize_async_error(self):
+        engine = Engine(executable=os.path.join(HERE, 'fake-tesseract'))
+        engine._user_to_tesseract['eng'] = 'tlh'
+        stderr = io.StringIO()
+        with temporary.file(suffix='.tif') as image:
+            with contextlib.redirect_stderr(stderr):
+                with self.assertRaises(ipc.CalledProcessError):
+                    asyncio.run(engine.recognize_async(image, 'eng', details=text_zones.TEXT_DETAILS_WORD))
+        self.assertEqual(
+            stderr.getvalue().splitlines(),
+            ['tesseract: Tesseract Open Source OCR Engine', 'tesseract: unknown language']
+        )
+
+
+class TesseractStdoutTestCase(TesseractTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with interim_environ(FAKE_TESSERACT_VERSION='5.3.0'):
+            cls.engine = Engine(
+                executable=os.path.join(HERE, 'fake-tesseract')
+            )
+
+    def test_version(self):
+        self.assertTrue(self.engine.use_stdout)
+        with interim_environ(FAKE_TESSERACT_VERSION='5.3.0'):
+            self.assertEqual(self.engine.get_version(), (5, 3))
+        self.assertIsNone(self.engine.get_version())
+        with interim_environ(FAKE_TESSERACT_VERSION='3.02.02'):
+            engine = Engine(executable=os.path.join(HERE, 'fake-tesseract'))
+        self.assertFalse(engine.use_stdout)
+        self.assertFalse(engine.use_char_boxes)
+        self.assertFalse(TesseractTestCase.engine.use_stdout)
+        self.assertTrue(self.engine.use_char_boxes)
+        with interim_environ(FAKE_TESSERACT_VERSION='4.0.0'):
+            engine = Engine(executable=os.path.join(HERE, 'fake-tesseract'))
+        self.assertTrue(engine.use_stdout)
+        self.assertFalse(engine.use_char_boxes)
+
+    def test_char_boxes(self):
+        stderr = io.StringIO()
+        with temporary.file(suffix='.tif') as image:
+            with contextlib.redirect_stderr(stderr):
+                result = self.engine.recognize(image, 'eng', details=text_zones.TEXT_DETAILS_CHARACTER)
+        self.assertEqual(stderr.getvalue(), '')
+        self.assertIn("class='ocrx_cinfo'", str(result))
+        [text] = self.engine.extract_text(result.as_stringio(), details=text_zones.TEXT_DETAILS_CHARACTER, page_size=(100, 100))
+        expected = text_zones.sexpr.Expression.from_string(
+            '(page 0 0 100 100 (line 10 80 30 90 (word 10 80 30 90 (char 10 80 20 90 "o") (char 20 80 30 88 "k"))))'
+        )
+        self.assertEqual(text.value, expected.value)
+        self.assertTrue(self.engine._can_batch(text_zones.TEXT_DETAILS_CHARACTER, None))
+
+    def test_files_fallback(self):
+        expected = self._recognize(TesseractTestCase.engine.recognize)
+        self.assertMultiLineEqual(self._recognize(self.engine.recognize), expected)
+
+    def test_recognize_batch(self):
+        stderr = io.StringIO()
+        for engine in self.engine, TesseractTestCase.engine:
+            with self.subTest(use_stdout=engine.use_stdout):
+                with temporary.file(suffix='.tif') as image1, temporary.file(suffix='.tif') as image2:
+                    with contextlib.redirect_stderr(stderr):
+                        results = engine.recognize_batch([image1, image2], 'eng', details=text_zones.TEXT_DETAILS_WORD)
+                    self.assertEqual(len(results), 2)
+                    for image, result in zip([image1, image2], results):
+                        self.assertEqual(result.format, 'html')
+                        self.assertEqual(str(result).count("class='ocr_page'"), 1)
+                        self.assertIn(image.name, str(result))
+                        self.assertTrue(str(result).startswith('<html><body>'))
+                        self.assertTrue(str(result).endswith('</body></html>\n'))
+        self.assertEqual(stderr.getvalue(), '')
+
+
+class SplitHocrTestCase(TestCase):
+
+    def test_split(self):
+        contents = (
+            '<html>\n <head><title></title></head>\n <body>\n'
+            "  <div class='ocr_page' id='page_1'>\n   <div class='ocr_carea'>a</div>\n  </div>\n"
+            '  <div class="ocr_page" id="page_2">\n  </div>\n'
+            ' </body>\n</html>\n'
+        )
+        self.assertEqual(split_hocr(contents), [
+            '<html>\n <head><title></title></head>\n <body>\n'
+            "  <div class='ocr_page' id='page_1'>\n   <div class='ocr_carea'>a</div>\n  </div>\n"
+            '</body>\n</html>\n',
+            '<html>\n <head><title></title></head>\n <body>\n  <div class="ocr_page" id="page_2">\n  </div>\n</body>\n</html>\n',
+        ])
+
+    def test_no_pages(self):
+        with self.assertRaises(errors.MalformedHocrError):
+            split_hocr('<html><body></body></html>')
@@ -0,0 +1,134 @@
+# Copyright © 2024 FriedrichFroebel
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import io
+
+from ocrodjvu.engines.tesseract_capi import Engine, PNM, RIL_BLOCK, RIL_SYMBOL, RIL_TEXTLINE, RIL_WORD, build_zones, extract_text, read_pnm
+from ocrodjvu import errors
+from ocrodjvu import text_zones
+
+from tests.tools import TestCase
+
+
+const = text_zones.const
+
+# Two lines of the same block, as reported by the result iterator at the word level:
+WORDS = [
+    (RIL_BLOCK, (10, 10, 40, 20), 'Hello'),
+    (RIL_WORD, (50, 10, 80, 20), 'world'),
+    (RIL_WORD, (85, 10, 90, 20), ' '),
+    (RIL_TEXTLINE, (10, 30, 30, 40), 'Bye'),
+]
+
+
+class ReadPnmTestCase(TestCase):
+
+    def test_pbm(self):
+        width, height, bytes_per_pixel, pixels, resolution = read_pnm(b'P4 10 2\n\x80\x00\xff\xc0')
+        self.assertEqual((width, height, bytes_per_pixel, resolution), (10, 2, 0, None))
+        # Tesseract wants 1 for white.
+        self.assertEqual(pixels, b'\x7f\xff\x00\x3f')
+
+    def test_ppm(self):
+        self.assertEqual(read_pnm(b'P6\n# comment\n1 1\n255\n\n\x01\x02'), (1, 1, 3, b'\n\x01\x02', None))
+
+    def test_resolution(self):
+        class PageJob:
+            size = 2, 1
+            dpi = 600
+
+            @staticmethod
+            def render(*args):
+                return b'\0' * 6
+
+        file = io.BytesIO()
+        PNM(24).write_image(PageJob, None, file)
+        self.assertEqual(read_pnm(file.getvalue()), (2, 1, 3, b'\0' * 6, 600))
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            read_pnm(b'P1 1 1\n0')
+        with self.assertRaises(ValueError):
+            read_pnm(b'P6 1 1')
+
+
+class BuildZonesTestCase(TestCase):
+
+    def test_words(self):
+        [block] = build_zones(WORDS, RIL_WORD)
+        self.assertEqual(block.type, const.TEXT_ZONE_COLUMN)
+        self.assertEqual(block.bbox, (10, 10, 80, 40))
+        [paragraph] = block
+        self.assertEqual(paragraph.type, const.TEXT_ZONE_PARAGRAPH)
+        line1, line2 = paragraph
+        self.assertEqual(line1.type, const.TEXT_ZONE_LINE)
+        self.assertEqual(line1.bbox, (10, 10, 80, 20))
+        self.assertEqual([(word.type, word.bbox, word.children) for word in line1], [
+            (const.TEXT_ZONE_WORD, (10, 10, 40, 20), ['Hello']),
+            (const.TEXT_ZONE_WORD, (50, 10, 80, 20), ['world']),
+        ])
+        self.assertEqual(line2.bbox, (10, 30, 30, 40))
+
+    def test_skipped_element(self):
+        # The new line starts at an element without text.
+        records = [
+            (RIL_BLOCK, (0, 0, 5, 5), 'a'),
+            (RIL_TEXTLINE, (0, 10, 5, 15), ''),
+            (RIL_WORD, (10, 10, 15, 15), 'b'),
+        ]
+        [block] = build_zones(records, RIL_WORD)
+        [paragraph] = block
+        self.assertEqual(len(paragraph), 2)
+
+    def test_symbols(self):
+        records = [
+            (RIL_BLOCK, (0, 0, 5, 10), 'a'),
+            (RIL_SYMBOL, (5, 0, 10, 10), 'b'),
+            (RIL_WORD, (20, 0, 25, 10), 'c'),
+        ]
+        [block] = build_zones(records, RIL_SYMBOL)
+        [word1, word2] = block[0][0]
+        self.assertEqual(word1.bbox, (0, 0, 10, 10))
+        self.assertEqual([char.type for char in word1], [const.TEXT_ZONE_CHARACTER] * 2)
+        self.assertEqual(word2[0].children, ['c'])
+
+    def test_empty(self):
+        self.assertEqual(build_zones([], RIL_WORD), [])
+
+
+class ExtractTextTestCase(TestCase):
+
+    def _get_output(self, records, leaf_level):
+        page = text_zones.Zone(const.TEXT_ZONE_PAGE, text_zones.BBox(0, 0, 100, 50), build_zones(records, leaf_level))
+        return io.StringIO(page.sexpr.as_string())
+
+    def test_extract_text(self):
+        [text] = extract_text(self._get_output(WORDS, RIL_WORD), rotation=0)
+        expected = text_zones.sexpr.Expression.from_string(
+            '(page 0 0 100 50 (column 10 10 80 40 (para 10 10 80 40'
+            ' (line 10 30 80 40 (word 10 30 40 40 "Hello") (word 50 30 80 40 "world"))'
+            ' (line 10 10 30 20 (word 10 10 30 20 "Bye")))))'
+        )
+        self.assertEqual(text.value, expected.value)
+
+    def test_empty_page(self):
+        [text] = extract_text(self._get_output([], RIL_WORD), rotation=0)
+        expected = text_zones.sexpr.Expression.from_string('(page 0 0 100 50 "")')
+        self.assertEqual(text.value, expected.value)
+
+
+class EngineTestCase(TestCase):
+
+    def test_library_not_found(self):
+        with self.assertRaises(errors.EngineNotFoundError):
+            Engine(library='libnonexistent-tesseract.so')
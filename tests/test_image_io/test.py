@@ -21,7 +21,7 @@ import djvu.decode
 
 from ocrodjvu import image_io
 
-from tests.tools import sorted_glob, TestCase
+from tests.tools import mock, sorted_glob, TestCase
 
 
 class ImageIoTestCase(TestCase):
@@ -70,3 +70,101 @@ class ImageIoTestCase(TestCase):
                 for bits_per_pixel in 1, 24:
                     with self.subTest(base_filename=base_filename, image_format=image_format, bpp=bits_per_pixel):
                         self._test_from_file(base_filename=base_filename, image_format=image_format(bits_per_pixel))
+
+
+class InkStatisticsTestCase(TestCase):
+
+    def test_1bpp(self):
+        image_format = image_io.PNM(1)
+        # 10×4 image: a blank row, two rows with ink, a blank row.
+        # Padding bits must be ignored.
+        data = b'\x00\x3F' + b'\xFF\xC0' + b'\x80\x00' + b'\x00\x3F'
+        density, n_bands = image_format.get_ink_statistics(data, (10, 4))
+        self.assertAlmostEqual(density, 11 / 40)
+        self.assertEqual(n_bands, 1)
+
+    def test_24bpp(self):
+        image_format = image_io.PNM(24)
+        white = b'\xFF\xFF\xFF'
+        black = b'\x00\x00\x00'
+        data = (black + white) + (white + white) + (black + black)
+        density, n_bands = image_format.get_ink_statistics(data, (2, 3))
+        self.assertAlmostEqual(density, 3 / 6)
+        self.assertEqual(n_bands, 2)
+
+    def test_row_alignment(self):
+        image_format = image_io.BMP(24)
+        white = b'\xFF\xFF\xFF'
+        # Rows are padded to 4 bytes with zeros, which must not count as ink.
+        data = (white + b'\0') * 3
+        self.assertEqual(image_format.get_ink_statistics(data, (1, 3)), (0.0, 0))
+
+    def test_empty(self):
+        self.assertEqual(image_io.PNM(24).get_ink_statistics(b'', (0, 0)), (0.0, 0))
+
+
+class PerceptualHashTestCase(TestCase):
+
+    @staticmethod
+    def get_hash(data):
+        page_job = mock.Mock()
+        page_job.render.return_value = bytes(data)
+        return image_io.get_perceptual_hash(page_job, djvu.decode.RENDER_COLOR, size=2)
+
+    def test_hash(self):
+        self.assertEqual(self.get_hash([0, 255, 255, 0]), 0b1001)
+        self.assertEqual(self.get_hash([255, 255, 255, 255]), 0)
+
+    def test_distance(self):
+        self.assertEqual(image_io.get_hash_distance(0b1001, 0b1001, size=2), 0)
+        self.assertEqual(image_io.get_hash_distance(0b1001, 0b1000, size=2), 0.25)
+
+
+class TilesTestCase(TestCase):
+
+    def test_small(self):
+        self.assertEqual(image_io.get_tiles((100, 200), 20000, 10), [((0, 0, 100, 200), (0, 0, 100, 200))])
+
+    def test_grid(self):
+        size = 10000, 14000
+        tiles = image_io.get_tiles(size, 25e6, 300)
+        self.assertGreater(len(tiles), 1)
+        area = 0
+        for (x0, y0, x1, y1), (cx0, cy0, cx1, cy1) in tiles:
+            self.assertLessEqual((x1 - x0) * (y1 - y0), 25e6)
+            self.assertTrue(x0 <= cx0 < cx1 <= x1)
+            self.assertTrue(y0 <= cy0 < cy1 <= y1)
+            # Neighbours overlap by the requested number of pixels:
+            self.assertIn(cx0 - x0, (0, 150))
+            self.assertIn(y1 - cy1, (0, 150))
+            area += (cx1 - cx0) * (cy1 - cy0)
+        # The cores cover the whole image without overlapping:
+        self.assertEqual(area, size[0] * size[1])
+
+    def test_overlap_too_large(self):
+        tiles = image_io.get_tiles((1000, 1000), 1000, 600)
+        self.assertEqual(len(tiles), 1)
+
+    def test_render(self):
+        page_job = mock.Mock(size=(100, 200), dpi=300)
+        page_job.render.return_value = bytes(10 * 20 * 3)
+        file = io.BytesIO()
+        image_io.PNM(24).write_image(page_job, djvu.decode.RENDER_COLOR, file, rect=(30, 40, 10, 20))
+        self.assertTrue(file.getvalue().startswith(b'P6 10 20 255\n'))
+        [args] = [call.args for call in page_job.render.call_args_list]
+        self.assertEqual(args[1:3], ((0, 0, 100, 200), (30, 40, 10, 20)))
+
+
+class ScaledPageJobTestCase(TestCase):
+
+    def test_render(self):
+        page_job = mock.Mock(size=(1001, 2000), dpi=600)
+        page_job.render.return_value = bytes(500 * 1000 * 3)
+        scaled_job = image_io.ScaledPageJob(page_job, 300)
+        self.assertEqual(scaled_job.size, (500, 1000))
+        file = io.BytesIO()
+        image_io.PNM(24).write_image(scaled_job, djvu.decode.RENDER_COLOR, file)
+        self.assertTrue(file.getvalue().startswith(b'P6 500 1000 255\n'))
+        # DjVuLibre scales the whole page to the size of the page rectangle:
+        [args] = [call.args for call in page_job.render.call_args_list]
+        self.assertEqual(args[1:3], ((0, 0, 500, 1000), (0, 0, 500, 1000)))
@@ -12,9 +12,13 @@
 # FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
 # for more details.
 
+import asyncio
 import errno
 import os
+import pickle
 import signal
+import threading
+import time
 
 from ocrodjvu import ipc
 from ocrodjvu import temporary
@@ -38,6 +42,12 @@ class ExceptionsTestCase(TestCase):
         self.assertEqual(str(ex), "Command 'eggs' was interrupted by signal SIGSEGV")
         self.assertFalse(ex.by_user)
 
+    def test_pickle(self):
+        ex = ipc.CalledProcessInterrupted(signal.SIGINT, 'eggs')
+        ex = pickle.loads(pickle.dumps(ex))
+        self.assertEqual(str(ex), "Command 'eggs' was interrupted by signal SIGINT")
+        self.assertTrue(ex.by_user)
+
     def test_invalid_signo(self):
         # signal.NSIG is guaranteed not be a correct signal number.
         ex = ipc.CalledProcessInterrupted(signal.NSIG, 'eggs')
@@ -84,6 +94,63 @@ class WaitTestCase(TestCase):
                 self._test_signal(name)
 
 
+def _is_running(pid):
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as file:
+            state = file.read().rsplit(')', 1)[1].split()[0]
+    except FileNotFoundError:
+        return False
+    return state != 'Z'
+
+
+class DeadlineTestCase(TestCase):
+    def test_in_time(self):
+        with ipc.deadline(60):
+            child = ipc.Subprocess(['true'])
+        child.wait()
+
+    def test_no_deadline(self):
+        with ipc.deadline(None):
+            child = ipc.Subprocess(['sh', '-c', 'sleep 0.2'])
+        child.wait()
+
+    def test_timeout(self):
+        start = time.monotonic()
+        with ipc.deadline(0.2):
+            # The background process is killed together with the shell.
+            child = ipc.Subprocess(['sh', '-c', 'sleep 60 & echo $!; wait'], stdout=ipc.PIPE)
+        grandchild = int(child.stdout.readline())
+        with self.assertRaises(ipc.TimeoutExpired) as ecm:
+            child.wait()
+        child.stdout.close()
+        self.assertLess(time.monotonic() - start, 30)
+        self.assertEqual(ecm.exception.cmd, 'sh')
+        self.assertEqual(ecm.exception.timeout, 0.2)
+        for _ in range(100):
+            if not _is_running(grandchild):
+                break
+            time.sleep(0.05)
+        self.assertFalse(_is_running(grandchild))
+
+    def test_timeout_async(self):
+        async def run():
+            with ipc.deadline(0.2):
+                return await ipc.run_async(['sleep', '60'])
+
+        start = time.monotonic()
+        with self.assertRaises(ipc.TimeoutExpired):
+            asyncio.run(run())
+        self.assertLess(time.monotonic() - start, 30)
+
+    def test_interrupt(self):
+        with ipc.deadline(60):
+            child = ipc.Subprocess(['sleep', '60'])
+        ipc.interrupt_process_groups()
+        with self.assertRaises(ipc.CalledProcessInterrupted) as ecm:
+            child.wait()
+        self.assertTrue(ecm.exception.by_user)
+
+
 class EnvironmentTestCase(TestCase):
     """
     https://bugs.debian.org/594385
@@ -121,6 +188,27 @@ class EnvironmentTestCase(TestCase):
             self.assertEqual(stdout, b'24')
             self.assertEqual(stderr, b'')
 
+    def _test_thread_environment(self):
+        child = ipc.Subprocess(
+            ['sh', '-c', 'printf $ocrodjvu'],
+            stdout=ipc.PIPE, stderr=ipc.PIPE,
+        )
+        stdout, stderr = child.communicate()
+        self.assertEqual(stderr, b'')
+        return stdout
+
+    def test_thread_environment(self):
+        with interim_environ(ocrodjvu='42'):
+            with ipc.thread_environment(ocrodjvu='24'):
+                self.assertEqual(self._test_thread_environment(), b'24')
+                results = []
+                thread = threading.Thread(target=lambda: results.append(self._test_thread_environment()))
+                thread.start()
+                thread.join()
+                self.assertEqual(results, [b'42'])
+                self.assertEqual(os.environ['ocrodjvu'], '42')
+            self.assertEqual(self._test_thread_environment(), b'42')
+
     def test_path(self):
         path = os.getenv('PATH')
         with temporary.directory() as tmpdir:
@@ -182,6 +270,56 @@ class EnvironmentTestCase(TestCase):
             self._test_locale()
 
 
+class RunAsyncTestCase(TestCase):
+    def test_output(self):
+        stdout, stderr = asyncio.run(ipc.run_async(['sh', '-c', 'printf 42; printf 24 >&2'], stdout=ipc.PIPE, stderr=ipc.PIPE))
+        self.assertEqual(stdout, b'42')
+        self.assertEqual(stderr, b'24')
+
+    def test_discard_output(self):
+        stdout, stderr = asyncio.run(ipc.run_async(['sh', '-c', 'printf 42; printf 24 >&2']))
+        self.assertIsNone(stdout)
+        self.assertIsNone(stderr)
+
+    def test_thread_environment(self):
+        async def run():
+            with ipc.thread_environment(ocrodjvu='24'):
+                return await ipc.run_async(['sh', '-c', 'printf $ocrodjvu'], stdout=ipc.PIPE)
+
+        with interim_environ(ocrodjvu='42'):
+            stdout, _ = asyncio.run(run())
+        self.assertEqual(stdout, b'24')
+
+    def test_failure(self):
+        with self.assertRaises(ipc.CalledProcessError) as ecm:
+            asyncio.run(ipc.run_async(['sh', '-c', 'printf eggs >&2; exit 42'], stderr=ipc.PIPE))
+        self.assertEqual(ecm.exception.returncode, 42)
+        self.assertEqual(ecm.exception.stderr, b'eggs')
+
+    def test_signal(self):
+        with self.assertRaises(ipc.CalledProcessInterrupted) as ecm:
+            asyncio.run(ipc.run_async(['sh', '-c', 'kill -TERM $$']))
+        self.assertEqual(str(ecm.exception), "Command 'sh' was interrupted by signal SIGTERM")
+
+    def test_not_found(self):
+        with self.assertRaises(OSError) as ecm:
+            asyncio.run(ipc.run_async(['ocrodjvu-nonexistent']))
+        self.assertEqual(ecm.exception.errno, errno.ENOENT)
+        self.assertEqual(ecm.exception.filename, 'ocrodjvu-nonexistent')
+
+    def test_cancel(self):
+        async def run():
+            task = asyncio.ensure_future(ipc.run_async(['sleep', '60']))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        start = time.monotonic()
+        asyncio.run(run())
+        self.assertLess(time.monotonic() - start, 30)
+
+
 class RequireTestCase(TestCase):
     def test_ok(self):
         ipc.require('cat')
@@ -0,0 +1,70 @@
+# Copyright © 2024 FriedrichFroebel
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import os
+
+from ocrodjvu import journal
+from ocrodjvu import temporary
+
+from tests.tools import TestCase
+
+
+class JournalTestCase(TestCase):
+    def test_record(self):
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'journal')
+            jrnl = journal.Journal(path)
+            try:
+                self.assertEqual(jrnl.load('doc', 'opts'), {})
+                jrnl.record('doc', 'opts', 'p0001.djvu', '(page 0 0 1 1 "")')
+                jrnl.record('doc', 'opts', 'p0002.djvu', None)
+                jrnl.record('doc', 'other-opts', 'p0003.djvu', '(page 0 0 2 2 "")')
+                jrnl.record('other-doc', 'opts', 'p0004.djvu', '(page 0 0 3 3 "")')
+            finally:
+                jrnl.close()
+            # Reopen to make sure that the results are persistent.
+            jrnl = journal.Journal(path)
+            try:
+                self.assertEqual(
+                    jrnl.load('doc', 'opts'),
+                    {'p0001.djvu': '(page 0 0 1 1 "")', 'p0002.djvu': None}
+                )
+            finally:
+                jrnl.close()
+
+    def test_record_again(self):
+        with temporary.directory() as tmpdir:
+            jrnl = journal.Journal(os.path.join(tmpdir, 'journal'))
+            try:
+                jrnl.record('doc', 'opts', 'p0001.djvu', None)
+                jrnl.record('doc', 'opts', 'p0001.djvu', '(page 0 0 1 1 "")')
+                self.assertEqual(jrnl.load('doc', 'opts'), {'p0001.djvu': '(page 0 0 1 1 "")'})
+            finally:
+                jrnl.close()
+
+
+class DigestTestCase(TestCase):
+    def test_digest(self):
+        self.assertEqual(journal.get_digest('eng', 1), journal.get_digest('eng', 1))
+        self.assertNotEqual(journal.get_digest('eng', 1), journal.get_digest('eng', 2))
+        self.assertNotEqual(journal.get_digest('ab', 'c'), journal.get_digest('a', 'bc'))
+
+    def test_file_digest(self):
+        with temporary.directory() as tmpdir:
+            paths = [os.path.join(tmpdir, name) for name in ('eggs', 'ham', 'spam')]
+            for path, contents in zip(paths, (b'eggs', b'eggs', b'spam')):
+                with open(path, 'wb') as fd:
+                    fd.write(contents)
+            digests = [journal.get_file_digest(path) for path in paths]
+            self.assertEqual(digests[0], digests[1])
+            self.assertNotEqual(digests[0], digests[2])
@@ -0,0 +1,81 @@
+# Copyright © 2024 FriedrichFroebel
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import os
+import stat
+
+from ocrodjvu import metrics
+from ocrodjvu import temporary
+
+from tests.tools import TestCase
+
+
+class HistogramTestCase(TestCase):
+
+    def test_format(self):
+        histogram = metrics.Histogram([1, 5])
+        for value in 0.5, 1, 3, 10:
+            histogram.observe(value)
+        self.assertEqual(histogram.format('eggs'), [
+            'eggs_bucket{le="1"} 2',
+            'eggs_bucket{le="5"} 3',
+            'eggs_bucket{le="+Inf"} 4',
+            'eggs_sum 14.5',
+            'eggs_count 4',
+        ])
+
+
+class MetricsTestCase(TestCase):
+
+    def test_format(self):
+        run_metrics = metrics.Metrics()
+        run_metrics.add('pages_done', 2)
+        run_metrics.add('queue_depth', 5)
+        run_metrics.add('queue_depth', -1)
+        run_metrics.observe_stage('ocr', dict(wall=1.5))
+        run_metrics.observe_stage('render', dict(wall=0.1, bytes=1000))
+        run_metrics.observe_stage('decode', dict(wall=0.1))
+        lines = run_metrics.format().splitlines()
+        self.assertIn('# TYPE ocrodjvu_pages_done_total counter', lines)
+        self.assertIn('ocrodjvu_pages_done_total 2', lines)
+        self.assertIn('# TYPE ocrodjvu_queue_depth gauge', lines)
+        self.assertIn('ocrodjvu_queue_depth 4', lines)
+        self.assertIn('ocrodjvu_rendered_bytes_total 1000', lines)
+        self.assertIn('# TYPE ocrodjvu_engine_seconds histogram', lines)
+        self.assertIn('ocrodjvu_engine_seconds_bucket{le="2"} 1', lines)
+        self.assertIn('ocrodjvu_engine_seconds_count 1', lines)
+        self.assertIn('ocrodjvu_parse_seconds_count 0', lines)
+
+    def test_write(self):
+        run_metrics = metrics.Metrics()
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'ocrodjvu.prom')
+            run_metrics.write(path)
+            run_metrics.add('pages_failed')
+            run_metrics.write(path)
+            self.assertEqual(os.listdir(tmpdir), ['ocrodjvu.prom'])
+            self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o644)
+            with open(path, encoding='UTF-8') as file:
+                self.assertIn('ocrodjvu_pages_failed_total 1\n', file.read())
+
+    def test_writer(self):
+        run_metrics = metrics.Metrics()
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'ocrodjvu.prom')
+            writer = metrics.Writer(run_metrics, path, interval=0.01)
+            writer.start()
+            self.assertTrue(os.path.exists(path))
+            run_metrics.add('pages_done')
+            writer.stop()
+            with open(path, encoding='UTF-8') as file:
+                self.assertIn('ocrodjvu_pages_done_total 1\n', file.read())
@@ -12,12 +12,21 @@
 # FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
 # for more details.
 
+import concurrent.futures
 import contextlib
 import io
+import json
 import os
 import shutil
+import threading
+import time
 
+import djvu.decode
+import djvu.sexpr
+
+from ocrodjvu import distributed
 from ocrodjvu import errors
+from ocrodjvu import ipc
 from ocrodjvu import temporary
 from ocrodjvu.cli import ocrodjvu
 
@@ -112,3 +121,720 @@ class OcrodjvuTestCase(TestCase):
         self.assertEqual(stderr.getvalue(), '')
         self.assertEqual(rc, 0)
         self.assertEqual(stdout.getvalue(), '')
+
+    def _test_save_script(self, *args):
+        remove_logging_handlers('ocrodjvu.')
+        here = os.path.dirname(__file__)
+        here = os.path.abspath(here)
+        path = os.path.join(here, '..', 'data', 'alice.djvu')
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with temporary.directory() as tmpdir:
+            script_path = os.path.join(tmpdir, 'tmp.djvused')
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--save-script', script_path, *args, path])
+            with open(script_path, 'r') as fd:
+                script = fd.read()
+        self.assertEqual(stderr.getvalue(), '')
+        self.assertEqual(rc, 0)
+        self.assertEqual(stdout.getvalue(), '')
+        return script
+
+    def test_process_executor(self):
+        expected = self._test_save_script('--executor', 'thread')
+        script = self._test_save_script('--executor', 'process', '-j', '2')
+        self.assertMultiLineEqual(script, expected)
+
+    def test_asyncio_executor(self):
+        expected = self._test_save_script()
+        script = self._test_save_script('--executor', 'asyncio', '-j', '4')
+        self.assertMultiLineEqual(script, expected)
+
+    def test_script_order_completion(self):
+        def split(script):
+            return sorted(script.split('\n.\n\n'))
+        expected = self._test_save_script()
+        script = self._test_save_script('--script-order', 'completion', '-j', '4')
+        self.assertEqual(split(script), split(expected))
+
+    def test_page_order_largest_first(self):
+        expected = self._test_save_script()
+        process_page = ocrodjvu.Context.process_page
+        order = []
+
+        def process_page_wrapper(context, page, *args):
+            order.append(page.n)
+            return process_page(context, page, *args)
+
+        with mock.patch.object(ocrodjvu.Context, 'estimate_page_cost', side_effect=lambda page: page.n):
+            with mock.patch.object(ocrodjvu.Context, 'process_page', process_page_wrapper):
+                script = self._test_save_script('--page-order', 'largest-first')
+        self.assertMultiLineEqual(script, expected)
+        self.assertEqual(order, sorted(order, reverse=True))
+
+    def test_remote_executor(self):
+        expected = self._test_save_script()
+        options = ocrodjvu.ArgumentParser().parse_args(['--engine', '_dummy', '--listen', '127.0.0.1:0'])
+        context = ocrodjvu.Context()
+        context.init(options)
+        worker = distributed.Worker('127.0.0.1:0', context.process_remote_job, context._get_options_journal_key(), n_jobs=2)
+        thread = threading.Thread(target=worker.serve_forever)
+        thread.start()
+        try:
+            for remote_input in 'image', 'path':
+                with self.subTest(remote_input=remote_input):
+                    script = self._test_save_script(
+                        '--executor', 'remote', '--worker', worker.address, '--remote-input', remote_input,
+                        '--worker-timeout', '60'
+                    )
+                    self.assertMultiLineEqual(script, expected)
+        finally:
+            worker.shutdown()
+            thread.join()
+            worker.close()
+            context.close()
+
+    def test_remote_executor_concurrent_documents(self):
+        here = os.path.dirname(__file__)
+        here = os.path.abspath(here)
+        path = os.path.join(here, '..', 'data', 'alice.djvu')
+        options = ocrodjvu.ArgumentParser().parse_args(['--engine', '_dummy', '--skip-duplicates', '--listen', '127.0.0.1:0'])
+        context = ocrodjvu.Context()
+        context.init(options)
+        worker = distributed.Worker('127.0.0.1:0', context.process_remote_job, context._get_options_journal_key(), n_jobs=2)
+        thread = threading.Thread(target=worker.serve_forever)
+        thread.start()
+        render_image = ocrodjvu.Context.render_image
+        barrier = threading.Barrier(2, timeout=60)
+        names = []
+
+        def render_image_wrapper(context, *args, **kwargs):
+            temp_file = render_image(context, *args, **kwargs)
+            names.append(temp_file.name)
+            barrier.wait()
+            return temp_file
+
+        try:
+            with temporary.directory() as tmpdir:
+                paths = []
+                for name in 'eggs', 'ham':
+                    paths += [os.path.join(tmpdir, f'{name}.djvu')]
+                    shutil.copy(path, paths[-1])
+                coordinator = distributed.Coordinator([worker.address], context._get_options_journal_key(), timeout=60)
+                try:
+                    with mock.patch.object(ocrodjvu.Context, 'render_image', render_image_wrapper):
+                        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+                            replies = list(executor.map(
+                                lambda path: coordinator.submit(dict(type='page', path=path, n=0)),
+                                paths
+                            ))
+                finally:
+                    coordinator.close()
+            self.assertEqual([reply['status'] for reply in replies], ['ok', 'ok'])
+            self.assertEqual(len(set(names)), 2)
+            self.assertEqual(context._page_hashes, {})
+            self.assertEqual(context._image_hashes, {})
+        finally:
+            worker.shutdown()
+            thread.join()
+            worker.close()
+            context.close()
+
+    def test_bad_batch_size(self):
+        for value in '0', '-1', 'eggs':
+            with self.subTest(value=value):
+                stdout = io.StringIO()
+                stderr = io.StringIO()
+                with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                    rc = try_run(ocrodjvu.main, ['', '--engine', 'tesseract', '-X', f'batch-size={value}', '--dry-run', 'eggs.djvu'])
+                self.assertEqual(rc, errors.EXIT_FATAL)
+                self.assertIn('argument -X', stderr.getvalue())
+                self.assertIn(f"invalid value '{value}' for the 'batch_size' property", stderr.getvalue())
+                self.assertEqual(stdout.getvalue(), '')
+
+    def test_remote_executor_without_worker(self):
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--dry-run', '--executor', 'remote', 'eggs.djvu'])
+        self.assertEqual(rc, errors.EXIT_FATAL)
+        self.assertIn('--worker', stderr.getvalue())
+
+    def test_pipeline(self):
+        expected = self._test_save_script()
+        script = self._test_save_script('-j', '2', '--render-jobs', '2', '--parse-jobs', '2', '--prefetch', '1')
+        self.assertMultiLineEqual(script, expected)
+
+    def test_pipeline_process_executor(self):
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--dry-run', '--executor', 'process', '--render-jobs', '1', 'eggs.djvu'])
+        self.assertEqual(rc, errors.EXIT_FATAL)
+        self.assertIn('--render-jobs', stderr.getvalue())
+
+    def test_batch(self):
+        remove_logging_handlers('ocrodjvu.')
+        here = os.path.dirname(__file__)
+        here = os.path.abspath(here)
+        path = os.path.join(here, '..', 'data', 'alice.djvu')
+        expected = self._test_save_script()
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with temporary.directory() as tmpdir:
+            paths = []
+            for name in 'eggs', 'ham':
+                paths += [os.path.join(tmpdir, f'{name}.djvu')]
+                shutil.copy(path, paths[-1])
+            manifest_path = os.path.join(tmpdir, 'manifest')
+            with open(manifest_path, 'w') as fd:
+                print(paths[1], file=fd)
+            template = os.path.join(tmpdir, '{name-ext}.djvused')
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                rc = try_run(
+                    ocrodjvu.main,
+                    ['', '--engine', '_dummy', '-j', '2', '--save-script', template, paths[0], '--manifest', manifest_path]
+                )
+            self.assertEqual(stderr.getvalue(), '')
+            self.assertEqual(rc, 0)
+            self.assertEqual(stdout.getvalue(), '')
+            for name in 'eggs', 'ham':
+                with open(os.path.join(tmpdir, f'{name}.djvused'), 'r') as fd:
+                    self.assertMultiLineEqual(fd.read(), expected)
+
+    def test_batch_open_lazily(self):
+        remove_logging_handlers('ocrodjvu.')
+        here = os.path.dirname(__file__)
+        here = os.path.abspath(here)
+        path = os.path.join(here, '..', 'data', 'alice.djvu')
+        expected = self._test_save_script()
+        open_document = ocrodjvu.Context.open_document
+        save_job = ocrodjvu.Context.save_job
+        n_open = [0]
+        max_open = [0]
+
+        def open_document_wrapper(context, *args):
+            n_open[0] += 1
+            max_open[0] = max(max_open[0], n_open[0])
+            return open_document(context, *args)
+
+        def save_job_wrapper(context, job):
+            save_job(context, job)
+            n_open[0] -= 1
+
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with temporary.directory() as tmpdir:
+            names = ['eggs', 'ham', 'spam', 'bacon', 'sausage', 'lobster']
+            paths = []
+            for name in names:
+                paths += [os.path.join(tmpdir, f'{name}.djvu')]
+                shutil.copy(path, paths[-1])
+            template = os.path.join(tmpdir, '{name-ext}.djvused')
+            with mock.patch.object(ocrodjvu.Context, 'open_document', open_document_wrapper):
+                with mock.patch.object(ocrodjvu.Context, 'save_job', save_job_wrapper):
+                    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                        rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '-j', '1', '--save-script', template, *paths])
+            self.assertEqual(stderr.getvalue(), '')
+            self.assertEqual(rc, 0)
+            self.assertEqual(stdout.getvalue(), '')
+            for name in names:
+                with open(os.path.join(tmpdir, f'{name}.djvused'), 'r') as fd:
+                    self.assertMultiLineEqual(fd.read(), expected)
+        self.assertEqual(n_open[0], 0)
+        # Only the documents whose pages are being processed are open.
+        self.assertLessEqual(max_open[0], 3)
+
+    def test_batch_missing_pages(self):
+        remove_logging_handlers('ocrodjvu.')
+        here = os.path.dirname(__file__)
+        here = os.path.abspath(here)
+        path = os.path.join(here, '..', 'data', 'alice.djvu')
+        expected = self._test_save_script('-p', '1')
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with temporary.directory() as tmpdir:
+            paths = []
+            for name in 'eggs', 'ham':
+                paths += [os.path.join(tmpdir, f'{name}.djvu')]
+                shutil.copy(path, paths[-1])
+            template = os.path.join(tmpdir, '{name-ext}.djvused')
+            with self.assertLogs('ocrodjvu.main', 'WARNING') as logs:
+                with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                    rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '-p', '1,3', '--save-script', template, *paths])
+            self.assertEqual(stderr.getvalue(), '')
+            self.assertEqual(rc, 0)
+            self.assertEqual(stdout.getvalue(), '')
+            self.assertEqual(
+                [record.getMessage() for record in logs.records],
+                [f'warning: {path} has no page 3; skipping it' for path in paths]
+            )
+            for name in 'eggs', 'ham':
+                with open(os.path.join(tmpdir, f'{name}.djvused'), 'r') as fd:
+                    self.assertMultiLineEqual(fd.read(), expected)
+
+    def test_batch_no_template(self):
+        here = os.path.dirname(__file__)
+        here = os.path.abspath(here)
+        path = os.path.join(here, '..', 'data', 'alice.djvu')
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--save-script', 'eggs.djvused', path, path])
+        self.assertEqual(rc, errors.EXIT_FATAL)
+        self.assertIn('output filename template', stderr.getvalue())
+        self.assertEqual(stdout.getvalue(), '')
+
+    def test_resume(self):
+        with temporary.directory() as tmpdir:
+            journal_path = os.path.join(tmpdir, 'journal')
+            expected = self._test_save_script('--journal', journal_path)
+            with mock.patch.object(ocrodjvu.Context, 'process_page', side_effect=AssertionError):
+                script = self._test_save_script('--journal', journal_path, '--resume')
+        self.assertMultiLineEqual(script, expected)
+
+    def test_resume_different_options(self):
+        process_page = ocrodjvu.Context.process_page
+        processed = []
+
+        def process_page_wrapper(context, page, *args):
+            processed.append(page.n)
+            return process_page(context, page, *args)
+
+        with temporary.directory() as tmpdir:
+            journal_path = os.path.join(tmpdir, 'journal')
+            self._test_save_script('--journal', journal_path)
+            for args in (
+                ['--dpi', '150'], ['--max-dpi', '150'], ['--tile-threshold', '0.1'],
+                ['--skip-non-text', '--blank-threshold', '0'], ['--skip-duplicates'],
+            ):
+                with self.subTest(args=args):
+                    del processed[:]
+                    with mock.patch.object(ocrodjvu.Context, 'process_page', process_page_wrapper):
+                        self._test_save_script('--journal', journal_path, '--resume', *args)
+                    # Pages recognized with other options are not reused.
+                    self.assertEqual(sorted(processed), [0, 1])
+
+    def test_cache(self):
+        from ocrodjvu.engines import dummy
+        with temporary.directory() as tmpdir:
+            cache_path = os.path.join(tmpdir, 'cache')
+            expected = self._test_save_script('--cache', cache_path)
+            self.assertNotEqual(os.listdir(cache_path), [])
+            with mock.patch.object(dummy.Engine, 'recognize', side_effect=AssertionError):
+                script = self._test_save_script('--cache', cache_path)
+            with mock.patch.object(dummy.Engine, 'recognize_async', side_effect=AssertionError):
+                async_script = self._test_save_script('--cache', cache_path, '--executor', 'asyncio')
+        self.assertMultiLineEqual(script, expected)
+        self.assertMultiLineEqual(async_script, expected)
+
+    def test_bad_cache_size(self):
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--dry-run', '--cache-size', 'eggs', 'eggs.djvu'])
+        self.assertEqual(rc, errors.EXIT_FATAL)
+        self.assertIn('--cache-size', stderr.getvalue())
+
+    def test_max_memory(self):
+        expected = self._test_save_script()
+        process_page = ocrodjvu.Context.process_page
+        lock = threading.Lock()
+        n_running = [0]
+        max_running = [0]
+
+        def process_page_wrapper(context, page, *args):
+            with lock:
+                n_running[0] += 1
+                max_running[0] = max(max_running[0], n_running[0])
+            try:
+                return process_page(context, page, *args)
+            finally:
+                with lock:
+                    n_running[0] -= 1
+
+        with mock.patch.object(ocrodjvu.Context, 'process_page', process_page_wrapper):
+            # Every page is larger than the budget, so the pages are processed one by one.
+            script = self._test_save_script('--max-memory', '1K', '-j', '4')
+        self.assertMultiLineEqual(script, expected)
+        self.assertEqual(max_running, [1])
+        for args in ['--executor', 'asyncio'], ['--render-jobs', '2']:
+            with self.subTest(args=args):
+                script = self._test_save_script('--max-memory', '1K', '-j', '4', *args)
+                self.assertMultiLineEqual(script, expected)
+
+    def test_tiles(self):
+        from ocrodjvu.engines import dummy
+        lock = threading.Lock()
+        page_sizes = []
+
+        def extract_text(engine, stream, page_size, **kwargs):
+            # A single word in the middle of every tile.
+            with lock:
+                page_sizes.append(page_size)
+            width, height = page_size
+            x, y = width // 2, height // 2
+            return [djvu.sexpr.Expression.from_string(f'(page 0 0 {width} {height} (word {x - 5} {y - 5} {x + 5} {y + 5} "x"))')]
+
+        expected = self._test_save_script()
+        for args in [], ['--executor', 'asyncio'], ['--render-jobs', '1']:
+            with self.subTest(args=args):
+                del page_sizes[:]
+                with mock.patch.object(dummy.Engine, 'extract_text', extract_text):
+                    script = self._test_save_script('--tile-threshold', '0.5', '-j', '2', *args)
+                # Every tile is recognized separately, and its word is kept once.
+                self.assertEqual(script.count('"x"'), len(page_sizes))
+                self.assertEqual(script.count('select'), expected.count('select'))
+                self.assertGreater(len(page_sizes), expected.count('select'))
+                for width, height in page_sizes:
+                    self.assertLessEqual(width * height, 0.5e6)
+
+    def test_tiles_in_process(self):
+        # In-process engines keep their state in threads, so the tiles of all pages
+        # are recognized by the same threads.
+        from ocrodjvu.engines import dummy
+        recognize = dummy.Engine.recognize
+        thread_names = set()
+
+        def recording_recognize(engine, *args, **kwargs):
+            thread_names.add(threading.current_thread().name)
+            return recognize(engine, *args, **kwargs)
+
+        expected = self._test_save_script()
+        with mock.patch.object(dummy.Engine, 'in_process', True):
+            with mock.patch.object(dummy.Engine, 'recognize', recording_recognize):
+                script = self._test_save_script('--tile-threshold', '0.1', '-j', '2')
+        self.assertEqual(script.count('select'), expected.count('select'))
+        self.assertLessEqual(len(thread_names), 2)
+        self.assertEqual(len({name.rsplit('_', 1)[0] for name in thread_names}), 1)
+
+    def test_max_dpi(self):
+        from ocrodjvu.engines import dummy
+        page_sizes = []
+
+        def extract_text(engine, stream, page_size, **kwargs):
+            page_sizes.append(page_size)
+            width, height = page_size
+            return [djvu.sexpr.Expression.from_string(f'(page 0 0 {width} {height} (word 0 0 {width} {height} "x"))')]
+
+        context = ocrodjvu.Context()
+        context._options = mock.Mock(dpi=None, max_dpi=150)
+        self.assertEqual(context.get_render_dpi(300), 150)
+        self.assertEqual(context.get_render_dpi(100), 100)
+        context._options = mock.Mock(dpi=400, max_dpi=None)
+        self.assertEqual(context.get_render_dpi(300), 400)
+        for args in [], ['--executor', 'asyncio'], ['--render-jobs', '1']:
+            with self.subTest(args=args):
+                del page_sizes[:]
+                with mock.patch.object(dummy.Engine, 'extract_text', extract_text):
+                    script = self._test_save_script('--max-dpi', '150', *args)
+                self.assertTrue(page_sizes)
+                # Images are rendered at half the resolution, but the text is in coordinates of the pages.
+                for width, height in page_sizes:
+                    self.assertIn(f'(word 0 0 {width * 2} {height * 2} "x")', script)
+
+    def _run_with_page_timeout(self, *args):
+        from ocrodjvu.engines import dummy
+        recognize = dummy.Engine.recognize
+        lock = threading.Lock()
+        sizes = {}
+
+        def hanging_recognize(engine, image, *args, **kwargs):
+            # The engine hangs on the first image of every page.
+            with open(image.name, 'rb') as file:
+                size = tuple(map(int, file.readline().split()[1:3]))
+            with lock:
+                sizes.setdefault(image.name, []).append(size)
+                first = len(sizes[image.name]) == 1
+            if first:
+                ipc.Subprocess(['sleep', '60']).wait()
+            return recognize(engine, image, *args, **kwargs)
+
+        remove_logging_handlers('ocrodjvu.')
+        here = os.path.dirname(__file__)
+        path = os.path.join(os.path.abspath(here), '..', 'data', 'alice.djvu')
+        with temporary.directory() as tmpdir:
+            script_path = os.path.join(tmpdir, 'tmp.djvused')
+            with self.assertLogs('ocrodjvu.main', 'WARNING') as logs:
+                with mock.patch.object(dummy.Engine, 'recognize', hanging_recognize):
+                    rc = try_run(ocrodjvu.main, [
+                        '', '--engine', '_dummy', '--save-script', script_path, '--page-timeout', '0.2', *args, path
+                    ])
+            with open(script_path, 'r') as fd:
+                script = fd.read()
+        return rc, script, str.join('\n', logs.output), sizes
+
+    def test_page_timeout(self):
+        expected = self._test_save_script()
+        for args in [], ['--executor', 'asyncio'], ['--render-jobs', '1']:
+            with self.subTest(args=args):
+                start = time.monotonic()
+                rc, script, log, sizes = self._run_with_page_timeout(*args)
+                self.assertLess(time.monotonic() - start, 30)
+                self.assertEqual(rc, 0)
+                self.assertEqual(script.count('select'), expected.count('select'))
+                self.assertIn('timed out; trying again at lower resolution', log)
+                # Every page is retried at half the resolution.
+                self.assertEqual(len(sizes), expected.count('select'))
+                for full, half in sizes.values():
+                    self.assertEqual(half, tuple(round(n / 2) for n in full))
+
+    def test_page_timeout_no_retries(self):
+        rc, script, log, sizes = self._run_with_page_timeout('--timeout-retries', '0', '--on-error', 'resume')
+        self.assertEqual(rc, errors.EXIT_NONFATAL)
+        self.assertIn('TimeoutExpired', log)
+        self.assertNotIn('trying again', log)
+        self.assertNotIn('(page', script)
+
+    def test_images_in_memory(self):
+        from ocrodjvu.engines import dummy
+        recognize = dummy.Engine.recognize
+        headers = []
+
+        def reading_recognize(engine, image, *args, **kwargs):
+            # The engine runs in a separate process.
+            with ipc.Subprocess(['head', '-c', '2', image.name], stdout=ipc.PIPE) as child:
+                headers.append((image.name, child.stdout.read()))
+            return recognize(engine, image, *args, **kwargs)
+
+        expected = self._test_save_script()
+        for args in [], ['--executor', 'asyncio'], ['--executor', 'process']:
+            with self.subTest(args=args):
+                del headers[:]
+                with mock.patch.object(dummy.Engine, 'recognize', reading_recognize):
+                    script = self._test_save_script('--images-in-memory', *args)
+                self.assertMultiLineEqual(script, expected)
+                if args != ['--executor', 'process']:
+                    self.assertEqual(len(headers), expected.count('select'))
+                for name, header in headers:
+                    self.assertTrue(name.startswith('/proc/'))
+                    self.assertEqual(header, b'P4')
+
+    def test_images_in_memory_debug(self):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--dry-run', '--images-in-memory', '--debug', 'eggs.djvu'])
+        self.assertEqual(rc, errors.EXIT_FATAL)
+        self.assertIn('--images-in-memory', stderr.getvalue())
+
+    def test_engine_batch(self):
+        from ocrodjvu.engines import dummy
+        recognize_batch = dummy.Engine.recognize_batch
+        batches = []
+
+        def recording_recognize_batch(engine, images, *args, **kwargs):
+            batches.append(len(images))
+            return recognize_batch(engine, images, *args, **kwargs)
+
+        expected = self._test_save_script()
+        with mock.patch.object(dummy.Engine, 'batch_size', 2):
+            with mock.patch.object(dummy.Engine, 'recognize_batch', recording_recognize_batch):
+                script = self._test_save_script('-j', '1')
+        self.assertMultiLineEqual(script, expected)
+        self.assertEqual(batches, [expected.count('select')])
+
+    def test_engine_batch_failure(self):
+        from ocrodjvu.engines import dummy
+        recognize = dummy.Engine.recognize
+        recognized = []
+
+        def recording_recognize(engine, image, *args, **kwargs):
+            recognized.append(image.name)
+            return recognize(engine, image, *args, **kwargs)
+
+        expected = self._test_save_script()
+        with mock.patch.object(dummy.Engine, 'batch_size', 2):
+            with mock.patch.object(dummy.Engine, 'recognize_batch', side_effect=errors.MalformedOcrOutputError('eggs')):
+                with mock.patch.object(dummy.Engine, 'recognize', recording_recognize):
+                    with mock.patch.object(ocrodjvu.LOGGER, 'warning') as warning:
+                        script = self._test_save_script('-j', '1')
+        self.assertMultiLineEqual(script, expected)
+        # Every page was recognized again on its own.
+        self.assertEqual(len(recognized), expected.count('select'))
+        [(message,)] = [call.args for call in warning.call_args_list]
+        self.assertIn('recognizing them one by one', message)
+
+    def test_page_failure_in_batch(self):
+        # The second page is processed first; it fails, while the first one was already taken:
+        # the run must be aborted rather than wait for the first page forever.
+        from ocrodjvu.engines import dummy
+        here = os.path.dirname(__file__)
+        path = os.path.join(here, '..', 'data', 'alice.djvu')
+        for method in 'render_page', 'parse_recognized_page':
+            with self.subTest(method=method):
+                remove_logging_handlers('ocrodjvu.')
+                original = getattr(ocrodjvu.Context, method)
+                results = []
+
+                def failing(context, page, *args, original_=original):
+                    if page.n == 1:
+                        raise RuntimeError('eggs')
+                    return original_(context, page, *args)
+
+                def run():
+                    args = ['', '--engine', '_dummy', '-j', '1', '--page-order', 'largest-first', '--dry-run', path]
+                    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                        results.append(try_run(ocrodjvu.main, args))
+
+                with mock.patch.object(dummy.Engine, 'batch_size', 2):
+                    with mock.patch.object(ocrodjvu.Context, 'estimate_page_cost', side_effect=lambda page: page.n):
+                        with mock.patch.object(ocrodjvu.Context, method, failing):
+                            thread = threading.Thread(target=run, daemon=True)
+                            thread.start()
+                            thread.join(timeout=30)
+                self.assertFalse(thread.is_alive())
+                self.assertEqual(results, [errors.EXIT_FATAL])
+
+    def test_skip_existing_text(self):
+        expected = self._test_save_script()
+        existing_text = djvu.sexpr.Expression.from_string('(page 0 0 10 10 (line 0 0 10 10 "eggs"))')
+        process_page = ocrodjvu.Context.process_page
+        processed = []
+
+        def process_page_wrapper(context, page, *args):
+            processed.append(page.n)
+            return process_page(context, page, *args)
+
+        with mock.patch.object(ocrodjvu.Context, 'process_page', process_page_wrapper):
+            with mock.patch.object(ocrodjvu.Context, 'get_existing_text', side_effect=lambda page: existing_text if page.n == 0 else None):
+                script = self._test_save_script('--skip-existing-text')
+        self.assertEqual(processed, [1])
+        [first, *rest] = script.split('\n.\n\n')
+        self.assertIn('"eggs"', first)
+        self.assertEqual(rest, expected.split('\n.\n\n')[1:])
+
+    def test_skip_non_text(self):
+        from ocrodjvu.engines import dummy
+        with mock.patch.object(dummy.Engine, 'recognize', side_effect=AssertionError):
+            with mock.patch.object(ocrodjvu, 'classify_image', return_value='blank') as classify_image:
+                script = self._test_save_script('--skip-non-text', '--blank-threshold', '0.01')
+        self.assertEqual(classify_image.call_count, 2)
+        self.assertEqual(classify_image.call_args[0][2], 0.01)
+        self.assertEqual(script.count('set-txt'), 2)
+        self.assertNotIn('(line', script)
+
+    def test_skip_duplicates(self):
+        from ocrodjvu.engines import dummy
+        from ocrodjvu import image_io
+        recognize = dummy.Engine.recognize
+        with mock.patch.object(dummy.Engine, 'recognize', autospec=True, side_effect=recognize) as recognize_mock:
+            with mock.patch.object(image_io, 'get_perceptual_hash', return_value=0):
+                script = self._test_save_script('--skip-duplicates', '-j', '1')
+        self.assertEqual(recognize_mock.call_count, 1)
+        self.assertEqual(script.count('set-txt'), 2)
+
+    def test_skip_duplicates_tiles(self):
+        # The first page is skipped as blank; the second one is split into tiles,
+        # which must not be taken for duplicates of the first one.
+        from ocrodjvu import image_io
+        render_tiles = ocrodjvu.Context.render_tiles
+
+        def render_tiles_wrapper(context, nth, *args):
+            if nth == 0:
+                return
+            return render_tiles(context, nth, *args)
+
+        with mock.patch.object(ocrodjvu.Context, 'render_tiles', render_tiles_wrapper):
+            with mock.patch.object(ocrodjvu, 'classify_image', return_value='blank'):
+                with mock.patch.object(image_io, 'get_perceptual_hash', return_value=0):
+                    script = self._test_save_script(
+                        '--skip-non-text', '--skip-duplicates', '--images-in-memory', '--tile-threshold', '0.1', '-j', '1'
+                    )
+        self.assertEqual(script.count('set-txt'), 2)
+
+    def test_stats(self):
+        with temporary.directory() as tmpdir:
+            stats_path = os.path.join(tmpdir, 'stats.json')
+            for args in [], ['--executor', 'process', '-j', '2'], ['--render-jobs', '1']:
+                with self.subTest(args=args):
+                    self._test_save_script('--stats', stats_path, *args)
+                    with open(stats_path, encoding='UTF-8') as file:
+                        data = json.load(file)
+                    self.assertEqual([page['page'] for page in data['pages']], [1, 2])
+                    for stage in 'queue', 'decode', 'render', 'ocr', 'parse', 'print', 'save':
+                        self.assertIn(stage, data['summary'])
+                    self.assertEqual(list(data['documents'][0]['stages']), ['save'])
+
+    def test_metrics_file(self):
+        with temporary.directory() as tmpdir:
+            metrics_path = os.path.join(tmpdir, 'ocrodjvu.prom')
+            for args in [], ['--executor', 'process', '-j', '2']:
+                with self.subTest(args=args):
+                    self._test_save_script('--metrics-file', metrics_path, *args)
+                    with open(metrics_path, encoding='UTF-8') as file:
+                        lines = file.read().splitlines()
+                    self.assertIn('ocrodjvu_pages_done_total 2', lines)
+                    self.assertIn('ocrodjvu_pages_failed_total 0', lines)
+                    self.assertIn('ocrodjvu_pages_in_progress 0', lines)
+                    self.assertIn('ocrodjvu_queue_depth 0', lines)
+                    self.assertIn('ocrodjvu_engine_seconds_count 2', lines)
+
+    def test_metrics_file_unwritable(self):
+        here = os.path.dirname(__file__)
+        path = os.path.join(os.path.abspath(here), '..', 'data', 'alice.djvu')
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with temporary.directory() as tmpdir:
+            metrics_path = os.path.join(tmpdir, 'nonexistent', 'ocrodjvu.prom')
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--dry-run', '--metrics-file', metrics_path, path])
+        self.assertEqual(rc, errors.EXIT_FATAL)
+        self.assertIn(f'cannot write {metrics_path!r}', stderr.getvalue())
+        self.assertNotIn('Traceback', stderr.getvalue())
+        self.assertEqual(stdout.getvalue(), '')
+
+    def test_resume_without_journal(self):
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--dry-run', '--resume', 'eggs.djvu'])
+        self.assertEqual(rc, errors.EXIT_FATAL)
+        self.assertIn('--journal', stderr.getvalue())
+
+
+class GetExistingTextTestCase(TestCase):
+
+    @staticmethod
+    def get_existing_text(text):
+        page = mock.Mock()
+        page.text.sexpr = djvu.sexpr.Expression.from_string(text)
+        return ocrodjvu.Context.get_existing_text(page)
+
+    def test_text(self):
+        text = '(page 0 0 10 10 (line 0 0 10 10 (word 0 0 5 5 " ") (word 5 5 10 10 "eggs")))'
+        self.assertEqual(self.get_existing_text(text).value, djvu.sexpr.Expression.from_string(text).value)
+
+    def test_no_text(self):
+        self.assertIsNone(self.get_existing_text('()'))
+
+    def test_whitespace(self):
+        self.assertIsNone(self.get_existing_text('(page 0 0 10 10 (line 0 0 10 10 " "))'))
+        self.assertIsNone(self.get_existing_text('(page 0 0 10 10 "")'))
+
+    def test_not_available(self):
+        page = mock.Mock()
+        page.text.wait.side_effect = djvu.decode.NotAvailable
+        self.assertIsNone(ocrodjvu.Context.get_existing_text(page))
+
+
+class ClassifyImageTestCase(TestCase):
+
+    def test_blank(self):
+        self.assertEqual(ocrodjvu.classify_image(0.001, 1, 0.002), 'blank')
+
+    def test_picture(self):
+        self.assertEqual(ocrodjvu.classify_image(0.6, 1, 0.002), 'picture')
+
+    def test_text(self):
+        self.assertIsNone(ocrodjvu.classify_image(0.08, 40, 0.002))
+        self.assertIsNone(ocrodjvu.classify_image(0.3, 40, 0.002))
+
+
+class ExpandDocumentTemplateTestCase(TestCase):
+    def test_expand(self):
+        self.assertEqual(ocrodjvu.expand_document_template('/tmp/{name}', '/eggs/ham.djvu'), '/tmp/ham.djvu')
+        self.assertEqual(ocrodjvu.expand_document_template('{name-ext}.ocr.djvu', 'ham.djvu'), 'ham.ocr.djvu')
+
+    def test_unknown_field(self):
+        with self.assertRaises(KeyError):
+            ocrodjvu.expand_document_template('{page}.djvu', 'ham.djvu')
@@ -0,0 +1,90 @@
+# Copyright © 2024 FriedrichFroebel
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import json
+import os
+
+from ocrodjvu import stats
+from ocrodjvu import temporary
+
+from tests.tools import TestCase
+
+
+class PercentileTestCase(TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(stats.percentile(values, 50), 50)
+        self.assertEqual(stats.percentile(values, 95), 95)
+        self.assertEqual(stats.percentile(values, 100), 100)
+        self.assertEqual(stats.percentile([7], 95), 7)
+        self.assertEqual(stats.percentile([1, 2], 0), 1)
+
+    def test_empty(self):
+        self.assertIsNone(stats.percentile([], 50))
+
+
+class StatsTestCase(TestCase):
+
+    def test_measure(self):
+        page_stats = stats.Stats()
+        with page_stats.measure('eggs', 'ham.djvu', 0):
+            pass
+        with page_stats.measure('eggs', 'ham.djvu', 0, cpu=False):
+            pass
+        with page_stats.measure('spam', 'ham.djvu'):
+            pass
+        data = page_stats.as_json()
+        [page] = data['pages']
+        self.assertEqual(page['document'], 'ham.djvu')
+        self.assertEqual(page['page'], 1)
+        self.assertEqual(sorted(page['stages']['eggs']), ['cpu', 'wall'])
+        [document] = data['documents']
+        self.assertEqual(list(document['stages']), ['spam'])
+        self.assertEqual(data['summary']['eggs']['wall']['count'], 1)
+
+    def test_summary(self):
+        page_stats = stats.Stats()
+        for n in range(20):
+            page_stats.add('eggs', 'ham.djvu', n, wall=float(n + 1))
+        summary = page_stats.as_json()['summary']
+        self.assertEqual(summary['eggs'], dict(wall=dict(count=20, total=210.0, p50=10.0, p95=19.0, max=20.0)))
+
+    def test_wait(self):
+        page_stats = stats.Stats()
+        page_stats.add_wait('eggs', 'ham.djvu', 0)
+        self.assertEqual(page_stats.as_json()['pages'], [])
+        page_stats.mark('ham.djvu', 0)
+        page_stats.add_wait('eggs', 'ham.djvu', 0)
+        [page] = page_stats.as_json()['pages']
+        self.assertEqual(list(page['stages']['eggs']), ['wall'])
+
+    def test_merge(self):
+        worker_stats = stats.Stats()
+        worker_stats.add('eggs', 'ham.djvu', 3, wall=2.0, cpu=1.0)
+        page_stats = stats.Stats()
+        page_stats.add('eggs', 'ham.djvu', 3, wall=1.0)
+        page_stats.merge_page('ham.djvu', 3, worker_stats.pop_page('ham.djvu', 3))
+        self.assertEqual(worker_stats.as_json()['pages'], [])
+        [page] = page_stats.as_json()['pages']
+        self.assertEqual(page['stages'], dict(eggs=dict(wall=3.0, cpu=1.0)))
+
+    def test_write(self):
+        page_stats = stats.Stats()
+        page_stats.add('eggs', 'ham.djvu', 0, wall=1.0)
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'stats.json')
+            page_stats.write(path)
+            with open(path, encoding='UTF-8') as file:
+                data = json.load(file)
+        self.assertEqual(data['pages'][0]['stages'], dict(eggs=dict(wall=1.0)))
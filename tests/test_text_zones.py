@@ -28,3 +28,60 @@ class PrintSexprTestCase(TestCase):
         text_zones.print_sexpr(expr, fp)
         fp.seek(0)
         self.assertEqual(fp.getvalue(), out)
+
+
+class ScaleSexprTestCase(TestCase):
+    def test_scale(self):
+        expr = text_zones.sexpr.Expression.from_string(
+            '(page 0 0 100 200 (line 10 20 90 30 (word 10 20 50 30 "jeż") (word 60 20 90 30 "x")))'
+        )
+        scaled = text_zones.scale_sexpr(expr, 2, 0.5)
+        expected = text_zones.sexpr.Expression.from_string(
+            '(page 0 0 200 100 (line 20 10 180 15 (word 20 10 100 15 "jeż") (word 120 10 180 15 "x")))'
+        )
+        self.assertEqual(scaled.value, expected.value)
+
+    def test_degenerate(self):
+        expr = text_zones.sexpr.Expression.from_string('(page 0 0 100 100 (word 10 10 11 11 "."))')
+        scaled = text_zones.scale_sexpr(expr, 0.1, 0.1)
+        self.assertEqual(list(scaled.value[5][1:5]), [1, 1, 2, 2])
+
+
+class MergeTilesTestCase(TestCase):
+    def test_merge(self):
+        # Tiles of a 200×100 page, overlapping by 40 pixels:
+        left = text_zones.sexpr.Expression.from_string(
+            '(page 0 0 120 100 (line 10 40 115 60 (word 10 40 50 60 "foo") (word 85 40 115 60 "ba")))'
+        )
+        right = text_zones.sexpr.Expression.from_string(
+            '(page 0 0 120 100 (line 5 40 100 60 (word 5 40 35 60 "bar") (word 60 40 100 60 "baz")))'
+        )
+        tiles = [
+            ((0, 0, 120, 100), (0, 0, 100, 100), left),
+            ((80, 0, 200, 100), (100, 0, 200, 100), right),
+        ]
+        merged = text_zones.merge_tiles(tiles, (200, 100), 0)
+        expected = text_zones.sexpr.Expression.from_string(
+            '(page 0 0 200 100'
+            ' (line 10 40 50 60 (word 10 40 50 60 "foo"))'
+            ' (line 85 40 180 60 (word 85 40 115 60 "bar") (word 140 40 180 60 "baz")))'
+        )
+        self.assertEqual(merged.value, expected.value)
+
+    def test_vertical_offset(self):
+        # The bottom tile of a 100×200 page; y is measured from the bottom in the text.
+        bottom = text_zones.sexpr.Expression.from_string('(page 0 0 100 120 (line 10 20 90 40 "eggs"))')
+        tiles = [
+            ((0, 0, 100, 120), (0, 0, 100, 100), text_zones.sexpr.Expression.from_string('(page 0 0 100 120 "")')),
+            ((0, 80, 100, 200), (0, 100, 100, 200), bottom),
+        ]
+        merged = text_zones.merge_tiles(tiles, (100, 200), 0)
+        expected = text_zones.sexpr.Expression.from_string('(page 0 0 100 200 (line 10 20 90 40 "eggs"))')
+        self.assertEqual(merged.value, expected.value)
+
+    def test_scale(self):
+        # The page image was rendered at half the resolution of the 200×100 page.
+        text = text_zones.sexpr.Expression.from_string('(page 0 0 100 50 (line 10 20 45 30 (word 10 20 45 30 "eggs")))')
+        merged = text_zones.merge_tiles([((0, 0, 100, 50), None, text)], (200, 100), 0, (0.5, 0.5))
+        expected = text_zones.sexpr.Expression.from_string('(page 0 0 200 100 (line 20 40 90 60 (word 20 40 90 60 "eggs")))')
+        self.assertEqual(merged.value, expected.value)
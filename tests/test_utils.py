@@ -12,7 +12,10 @@
 # FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
 # for more details.
 
+import collections
 import sys
+import threading
+import time
 import warnings
 from ast import literal_eval
 
@@ -142,6 +145,22 @@ class ParsePageNumbersTestCase(TestCase):
         self.assertEqual(utils.parse_page_numbers('17-17'), [17])
 
 
+class ParseSizeTestCase(TestCase):
+    def test_bytes(self):
+        self.assertEqual(utils.parse_size('4096'), 4096)
+
+    def test_suffix(self):
+        self.assertEqual(utils.parse_size('512K'), 512 << 10)
+        self.assertEqual(utils.parse_size('3m'), 3 << 20)
+        self.assertEqual(utils.parse_size('2G'), 2 << 30)
+
+    def test_bad_size(self):
+        for size in '', 'G', '-1', '1.5G', 'eggs':
+            with self.subTest(size=size):
+                with self.assertRaises(ValueError):
+                    utils.parse_size(size)
+
+
 class SanitizeUtf8TestCase(TestCase):
     def test_control_characters(self):
         def show(message, category, filename, lineno, file=None, line=None):
@@ -245,6 +264,18 @@ class IdentityTestCase(TestCase):
         self.assertIs(utils.identity(o), o)
 
 
+class PositiveIntTestCase(TestCase):
+    def test_positive(self):
+        self.assertEqual(utils.positive_int('1'), 1)
+        self.assertEqual(utils.positive_int('42'), 42)
+
+    def test_not_positive(self):
+        for s in '0', '-1', 'eggs':
+            with self.subTest(s=s):
+                with self.assertRaises(ValueError):
+                    utils.positive_int(s)
+
+
 class PropertyTestCase(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -280,16 +311,113 @@ class GetCpuCountTestCase(TestCase):
         self.assertGreaterEqual(n, 1)
 
 
-class GetThreadLimitTestCase(TestCase):
-    def test_get_thread_limit(self):
-        for item_count in range(0, 10):
-            for job_count in range(1, 10):
+class ThreadAllocatorTestCase(TestCase):
+    def test_few_items(self):
+        allocator = utils.ThreadAllocator(3, 16)
+        n_threads = [allocator.acquire() for _ in range(3)]
+        self.assertEqual(sorted(n_threads), [5, 5, 6])
+
+    def test_many_items(self):
+        allocator = utils.ThreadAllocator(200, 16)
+        n_threads = [allocator.acquire() for _ in range(16)]
+        self.assertEqual(n_threads, [1] * 16)
+
+    def test_release(self):
+        allocator = utils.ThreadAllocator(5, 4)
+        n_threads = [allocator.acquire() for _ in range(4)]
+        self.assertEqual(n_threads, [1] * 4)
+        for n in n_threads[:3]:
+            allocator.release(n)
+        # The last item gets all the cores, including the one still used by the running item.
+        self.assertEqual(allocator.acquire(), 4)
+
+    def test_drain(self):
+        # Items finish in the order they were started, and another one starts right away.
+        allocator = utils.ThreadAllocator(200, 16)
+        running = collections.deque(allocator.acquire() for _ in range(16))
+        n_threads = []
+        max_in_flight = 0
+        for _ in range(200 - 16):
+            allocator.release(running.popleft())
+            running.append(allocator.acquire())
+            n_threads += [running[-1]]
+            max_in_flight = max(max_in_flight, sum(running))
+        self.assertEqual(set(n_threads[:-15]), {1})
+        # The last items don't run single-threaded:
+        self.assertEqual(set(n_threads[-15:]), {2})
+        self.assertLessEqual(max_in_flight, 2 * 16)
+
+    def test_drain_uneven(self):
+        # One long item is still running, the others are done.
+        allocator = utils.ThreadAllocator(6, 4)
+        n_threads = [allocator.acquire() for _ in range(4)]
+        for n in n_threads[1:]:
+            allocator.release(n)
+        # The last two items take the idle cores, and some more
+        # in expectation of the long one finishing:
+        self.assertEqual([allocator.acquire() for _ in range(2)], [3, 3])
+
+    def test_more_items(self):
+        # Items can be processed more than once, e.g. after a timeout.
+        allocator = utils.ThreadAllocator(1, 4)
+        allocator.release(allocator.acquire())
+        self.assertEqual(allocator.acquire(), 4)
+
+    def test_add(self):
+        allocator = utils.ThreadAllocator(0, 4)
+        allocator.add(2)
+        self.assertEqual([allocator.acquire() for _ in range(2)], [2, 2])
+
+    def test_total(self):
+        for item_count in range(1, 20):
+            for job_count in range(1, 20):
                 with self.subTest(item_count=item_count, job_count=job_count):
-                    limit = utils.get_thread_limit(item_count, job_count)
-                    self.assertIsInstance(limit, int)
-                    if item_count == 0:
-                        self.assertEqual(limit, 1)
-                    else:
-                        npitems = min(item_count, job_count)
-                        self.assertLessEqual(limit * npitems, job_count)
-                        self.assertGreater((limit + 1) * npitems, job_count)
+                    allocator = utils.ThreadAllocator(item_count, job_count)
+                    n_threads = [allocator.acquire() for _ in range(min(item_count, job_count))]
+                    self.assertEqual(sum(n_threads), job_count)
+                    self.assertLessEqual(max(n_threads) - min(n_threads), 1)
+
+
+class MemoryBudgetTestCase(TestCase):
+    def test_unlimited(self):
+        budget = utils.MemoryBudget(None)
+        self.assertEqual(budget.acquire(1 << 40), 0)
+        self.assertEqual(budget.try_acquire(1 << 40), 0)
+
+    def test_limit(self):
+        budget = utils.MemoryBudget(100)
+        self.assertEqual(budget.acquire(60), 60)
+        self.assertIsNone(budget.try_acquire(50))
+        self.assertEqual(budget.try_acquire(40), 40)
+        budget.release(60)
+        self.assertEqual(budget.try_acquire(50), 50)
+
+    def test_too_large(self):
+        budget = utils.MemoryBudget(100)
+        self.assertEqual(budget.acquire(500), 500)
+        self.assertIsNone(budget.try_acquire(1))
+        budget.release(500)
+        self.assertEqual(budget.try_acquire(1), 1)
+        self.assertIsNone(budget.try_acquire(500))
+
+    def test_wait(self):
+        budget = utils.MemoryBudget(100)
+        budget.acquire(80)
+        acquired = []
+        threads = [
+            threading.Thread(target=lambda n=n: acquired.append(budget.acquire(n)))
+            for n in (500, 10)
+        ]
+        threads[0].start()
+        while not budget._waiting:
+            time.sleep(0.01)
+        threads[1].start()
+        # The small reservation would fit, but it waits for the large one.
+        time.sleep(0.1)
+        self.assertEqual(acquired, [])
+        budget.release(80)
+        threads[0].join()
+        self.assertEqual(acquired, [500])
+        budget.release(500)
+        threads[1].join()
+        self.assertEqual(acquired, [500, 10])